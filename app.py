@@ -1,27 +1,38 @@
 """
 Virtual Assistant - AI-powered task automation with OmniParser screen understanding and Voice Input
 Install dependencies:
-pip install PyQt5 mss pillow google-generativeai pyautogui pynput requests python-dotenv SpeechRecognition pyaudio pocketsphinx
+pip install PyQt5 mss pillow google-generativeai pyautogui requests python-dotenv SpeechRecognition pyaudio pocketsphinx
 """
 import sys
 import io
+import argparse
 import json
 import threading
 import time
 import math
+import queue
+import uuid
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from http import HTTPStatus
 import base64
+import copy
+import random
+import difflib
+import glob
 import requests
+from requests.adapters import HTTPAdapter
 from PyQt5 import QtWidgets, QtCore, QtGui
 import mss
-from PIL import Image
-import pyautogui
-import google.generativeai as genai
+from PIL import Image, ImageDraw, ImageFont
 from dotenv import load_dotenv
 import os 
 import signal
-from pynput import mouse
+import subprocess
+import wave
 import numpy as np
-import speech_recognition as sr
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 load_dotenv()
@@ -29,23 +40,108 @@ load_dotenv()
 # ----- Configuration -----
 API_KEY = os.getenv("gemini_key")
 MODEL_NAME = "gemini-2.5-flash"
+PLANNER_CACHE_SYSTEM_PROMPT = False  # Store SYSTEM_PROMPT as Gemini cached content (needs a prompt above the model's cache minimum)
+PLANNER_CACHE_TTL_S = 3600  # Lifetime of the cached system prompt
+UPLOAD_MAX_LONG_EDGE = 1920  # Downscale the image sent to Gemini to this long edge (0 = full resolution)
+UPLOAD_FORMAT = "JPEG"  # Image encoding for Gemini: JPEG, WEBP or PNG
+UPLOAD_QUALITY = 85  # JPEG/WEBP quality (ignored for PNG)
+UPLOAD_CROP_TO_ELEMENTS = False  # Crop the upload to the union of element bboxes
+UPLOAD_CROP_PADDING = 32  # Pixels kept around the element union when cropping
 OMNIPARSER_URL = "https://arrival-late-can-mason.trycloudflare.com/process" # This is a server running the OmniParser model 
+OMNIPARSER_CONNECT_TIMEOUT = 5  # Seconds to establish a connection to OmniParser
+OMNIPARSER_READ_TIMEOUT = 30  # Seconds to wait for the parse result
+OMNIPARSER_MAX_RETRIES = 2  # Retries after the first attempt on connection errors, timeouts and 5xx/429
+OMNIPARSER_BACKOFF_S = 0.5  # Base delay for exponential backoff between retries
+OMNIPARSER_BREAKER_THRESHOLD = 3  # Consecutive failed calls before the circuit breaker opens
+OMNIPARSER_BREAKER_RESET_S = 30  # Seconds the breaker stays open before a trial request
+PARSE_CACHE_SIZE = 16  # OmniParser results kept for unchanged screens
+PARSE_CACHE_MAX_AGE_S = 300  # Cached parses older than this are discarded
+PARSE_CACHE_TILE_TOLERANCE = 4  # Max per-tile brightness difference (0-255) for frames to match
+INCREMENTAL_PARSE = True  # Re-parse only the changed screen regions after the first parse
+INCREMENTAL_MAX_DIRTY_FRACTION = 0.4  # Fall back to a full parse when more of the screen changed
+INCREMENTAL_CROP_PADDING = 48  # Pixels of context added around each changed region before parsing
+INCREMENTAL_FULL_PARSE_EVERY = 5  # Force a full parse after this many incremental ones
+INCREMENTAL_TILE_SIZE = 16  # Tile edge in pixels of the unsampled diff that finds the regions to re-parse
+INCREMENTAL_TILE_THRESHOLD = 0.001  # Per-tile difference that marks a tile dirty (about one strongly changed pixel)
+LOCAL_ANNOTATION = True  # Draw element numbers locally and ask OmniParser for elements only
+OMNIPARSER_STREAM_UPLOAD = True  # Stream the PNG into the request while encoding (falls back if chunked uploads are rejected)
+PIPELINE_OVERLAP = True  # Overlap turn stages (parse, upload prep, prompt build, stability probe)
+PIPELINE_WORKERS = 4  # Threads used by the turn pipeline
+SPECULATIVE_PARSE = True  # Parse the settled screen in the background before wait_and_send_image asks for it
+TRACK_ELEMENTS = True  # Match each parse to the previous one so elements keep stable IDs across turns
+TRACK_MIN_SCORE = 0.55  # Minimum match score (position, text and appearance, 0-1) for two elements to be the same
+TRACK_MOVE_PX = 8  # Center shift in pixels that reports a tracked element as moved
+LOOP_REPEAT_LIMIT = 3  # The same action on the same tracked element this many times in a row is flagged as a loop
+PROMPT_TOKEN_BUDGET = 2000  # Max text tokens per planner prompt; the element list and history are trimmed to fit (image not included)
+PROMPT_RECENT_STEPS = 8  # Completed steps listed one by one; older ones are folded into a one-line summary
+PROMPT_FULL_ELEMENTS_EVERY = 10  # Full details for every element every N turns (and when most changed); else unchanged ones are shortened
+PROMPT_MEASURE_EVERY = 10  # Count every Nth prompt with the model's tokenizer to calibrate token estimates
 HIDE_AND_CAPTURE_DELAY_MS = 120
+STEP_ERROR_PAUSE_MS = 2000  # How long a failed step's error stays on screen before the next step
 SCREEN_CHANGE_THRESHOLD = 0.05  # 5% difference threshold
 BUFFER_DELAY_MS = 500  # 500ms buffer after screen change detected
 MAX_WAIT_FOR_CHANGE = 4000  # 4 seconds max wait
+CAPTURE_MONITOR = 1  # mss monitor index to capture and click on (1 = primary, 2+ = others, 0 = all combined)
+WATCH_CLICK_REGION = True  # After a click, poll only the area around the clicked element
+CLICK_REGION_PADDING = 200  # Pixels of context kept around the clicked element's bbox
+FULL_CHECK_EVERY = 3  # While watching a region, check the full screen every Nth poll
+INITIAL_CHECK_DELAY_MS = 300  # Delay before the first post-action screen check
+POLL_INTERVAL_MS = 200  # Interval between screen checks while waiting for a change
+ADAPTIVE_SETTLE = True  # Wait until the screen stops changing instead of using the fixed delays above
+SETTLE_MIN_INTERVAL_MS = 50  # Poll interval while the screen is moving (and for the first check)
+SETTLE_MAX_INTERVAL_MS = 400  # Poll interval ceiling while nothing happens
+SETTLE_QUIET_FRAMES = 3  # Consecutive unchanged frames needed to call the screen settled
+SETTLE_QUIET_MS = 250  # ...spanning at least this long
+SETTLE_TILE_THRESHOLD = 0.02  # Per-tile difference that counts as movement between consecutive frames
+SETTLE_QUIET_FRACTION = 0.002  # Fraction of tiles allowed to move in a quiet frame
+SETTLE_ANIMATION_HITS = 4  # Tiles changing in this many of the last 2x polls are treated as animation and masked
+SETTLE_ANIMATION_MAX_FRACTION = 0.02  # Only mask animations (spinners, cursors) up to this share of the screen
+SETTLE_MAX_MS = 8000  # Give up waiting for quiescence this long after the change started
+SETTLE_BUFFER_MS = 100  # Delay after the screen settled (replaces BUFFER_DELAY_MS)
+DEBUG_SAVE_SCREENSHOTS = False  # Write captured frames to disk (current_screen.png etc.) for debugging
+SCREENSHOT_PNG_COMPRESS_LEVEL = 1  # zlib level used when a frame is encoded for upload (0-9, lower = faster)
+CHANGE_DETECT_STRIDE = 4  # Compare every Nth pixel in each axis when detecting screen changes
+CHANGE_TILE_SIZE = 16  # Tile edge (in sampled pixels) used to localize changed regions
+CHANGE_TILE_THRESHOLD = 0.10  # Per-tile difference for a tile to count as a changed region
+TRACE_ENABLED = False  # Record per-stage spans and write a Chrome/Perfetto trace per task (or run with --trace)
+TRACE_DIR = "traces"  # Where trace_*.json files are written
+TRACE_KEEP = 50  # Newest trace files kept in TRACE_DIR; older ones are deleted
+TRACE_MAX_EVENTS = 50000  # Spans kept per task; later ones are dropped
+
+# Daemon mode (python app.py --daemon): no windows or microphone, tasks arrive over a local API
+DAEMON_LISTEN = "127.0.0.1:8700"  # host:port of the HTTP task API (--socket PATH listens on a Unix socket instead)
+DAEMON_DISPLAYS = []  # X displays the agents drive, e.g. [":1", ":2"] for Xvfb sessions; empty = current display
+DAEMON_CONCURRENCY = 1  # Tasks run at once (at most one per display); the rest wait in a queue
+DAEMON_MAX_TURNS = 30  # Planner turns before a daemon task is given up
+DAEMON_EVENT_HISTORY = 1000  # Events kept per task for clients that start streaming late
+DAEMON_TASK_HISTORY = 200  # Finished tasks kept for GET /tasks
+SHARED_OMNIPARSER_MAX_INFLIGHT = 4  # OmniParser requests in flight across all daemon sessions
+SHARED_PLANNER_MAX_INFLIGHT = 4  # Planner requests in flight across all daemon sessions
+SESSION_OMNIPARSER_RPM = 0  # OmniParser requests per minute per session (0 = unlimited)
+SESSION_PLANNER_RPM = 0  # Planner requests per minute per session (0 = unlimited)
 
 # Voice Recognition Settings
 USE_OFFLINE_RECOGNITION = False  # Set to True for offline, False for Google API
 WAKE_WORD = "hey vision"  # Wake word to activate voice input
 SILENCE_DURATION = 1.5  # Seconds of silence before stopping recording
 VOICE_ENABLED = True  # Global flag to enable/disable voice input
+MIC_CALIBRATION_S = 1.0  # Ambient-noise calibration when there is no saved calibration
+MIC_CALIBRATION_FILE = ".mic_calibration.json"  # Saved energy threshold reused at startup ("" = always calibrate)
+MIC_CALIBRATION_MAX_AGE_S = 7 * 24 * 3600  # Calibrate again when the saved one is older than this
+WAKE_WORD_TEMPLATE_DIR = "wake_word"  # WAV recordings of the wake word for local detection (python app.py --enroll-wake-word)
+WAKE_WORD_THRESHOLD = 0.06  # Max distance to a recording for a hit (lower = fewer false wakes)
+VOICE_PREPARE_ON_WAKE = True  # Capture and parse the screen while the command is still being spoken
+VOICE_CONFIRM_MS = 1000  # A recognized command waits this long before it starts (Enter starts now, Esc cancels; 0 = no wait)
+MIC_SAMPLE_RATE = 16000  # Microphone stream rate (wake word, voice activity and commands)
+WAKE_WORD_ENROLL_SAMPLES = 3  # Recordings made by --enroll-wake-word
 
 # System prompt for AI with OmniParser
 SYSTEM_PROMPT = """You are a virtual assistant that helps users automate tasks by analyzing screenshots with numbered UI elements. Before making decisions, carefully examine the screenshot and the parsed content of each numbered element to understand what is the current state of the screen.
 
 IMPORTANT: You will receive a screenshot where ALL clickable elements are labeled with numbers (e.g., [1], [2], [3]). You must respond with the NUMBER of the element to interact with. The numbers for each box is written adjacent to the bbox in the image, but sometimes it can be misleading due to multiple boxes together, for this i have given you the parsed content of each element as well, which contains the content of each box, so use that to verify what each element is. Also note that to open a program/application/desktop icon or a folder, you need to DOUBLE click the icon.
 
+The element list shows each element as [number] #id type "content". Numbers are reassigned with every screenshot, but an element keeps its #id for as long as it stays on screen, so the #id in earlier steps still refers to the same element. Every screenshot comes with the list of all its elements: to save space, elements that did not change since the previous screenshot are shortened to [number] #id "content", elements marked (new) or (moved) have appeared or changed position, and elements listed under "Gone" are no longer on screen.
+
 RESPONSE FORMAT:
 You must respond with ONLY a valid JSON object:
 {
@@ -67,6 +163,7 @@ STEP TYPES:
      "double_click": false
    }
    - element_number: The number shown in the screenshot (e.g., if you see [5], use 5)
+   - element_id: Optional, the #id from the element list (e.g. for #12 use 12); used instead of element_number when given
    - description: What you're clicking
    - double_click: true for opening apps, false otherwise
 
@@ -120,120 +217,559 @@ RULES:
 """
 
 
+class VoiceActivityDetector:
+    """Energy-based voice activity per audio hop, relative to a running noise floor"""
+    def __init__(self, ratio=3.0, min_rms=100.0):
+        self.ratio = ratio
+        self.min_rms = min_rms  # int16 units
+        self.noise_rms = None  # Set from the first hop, then tracked over unvoiced hops
+        self.calibration_hops = 0  # Hops taken as background noise before anything counts as voice
+    
+    @property
+    def threshold(self):
+        return max(self.min_rms, (self.noise_rms or 0.0) * self.ratio)
+    
+    def is_voiced(self, hop):
+        rms = math.sqrt(float(np.dot(hop, hop)) / len(hop))
+        if self.noise_rms is None:
+            self.noise_rms = rms
+        if self.calibration_hops:
+            self.calibration_hops -= 1
+            self.noise_rms = 0.9 * self.noise_rms + 0.1 * rms
+            return False
+        voiced = rms > self.threshold
+        if not voiced:
+            self.noise_rms = 0.95 * self.noise_rms + 0.05 * rms
+        return voiced
+
+
+class WakeWordDetector:
+    """Streaming wake-word spotter that runs locally on raw microphone audio
+    
+    Audio is cut into 10 ms hops. Hops are only analysed while the energy gate is
+    open (VoiceActivityDetector: the running noise floor times a ratio), so silence costs almost
+    nothing, and the last PREROLL_S of audio is kept in a ring buffer so the start
+    of the word is not lost when the gate opens. Each analysed hop becomes an MFCC
+    vector that advances a subsequence DTW against every enrolled recording of the
+    wake word, so a hit is reported a hop or two after the word ends.
+    """
+    HOP_S = 0.01
+    WINDOW_S = 0.025
+    N_MELS = 26
+    N_MFCC = 13
+    PREROLL_S = 0.2
+    HANGOVER_S = 0.3  # Gate stays open this long after the level drops
+    REFRACTORY_S = 1.0  # No second hit this soon after one
+    
+    def __init__(self, templates, sample_rate=MIC_SAMPLE_RATE, threshold=WAKE_WORD_THRESHOLD):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.vad = VoiceActivityDetector()
+        self.hop = int(sample_rate * self.HOP_S)
+        self.window = int(sample_rate * self.WINDOW_S)
+        self.nfft = 1 << (self.window - 1).bit_length()
+        self._hamming = np.hamming(self.window)
+        self._mel = self._mel_filterbank(sample_rate, self.nfft, self.N_MELS)
+        k = np.arange(self.N_MELS)
+        self._dct = np.cos(np.pi / self.N_MELS * (k + 0.5) * np.arange(1, self.N_MFCC)[:, None])
+        self.templates = [f for f in (self.features(self.trim(t)) for t in templates) if len(f) >= 10]
+        if not self.templates:
+            raise ValueError("no usable wake-word recordings")
+        self.stats = {"hops": 0, "analysed": 0, "segments": 0, "hits": 0}
+        self.reset()
+    
+    @classmethod
+    def from_directory(cls, path=WAKE_WORD_TEMPLATE_DIR, sample_rate=MIC_SAMPLE_RATE, **kwargs):
+        """Detector built from the WAV files in path, or None if there are none"""
+        if not path or not os.path.isdir(path):
+            return None
+        files = sorted(name for name in os.listdir(path) if name.lower().endswith(".wav"))
+        if not files:
+            return None
+        return cls([cls.read_wav(os.path.join(path, name), sample_rate) for name in files], sample_rate, **kwargs)
+    
+    @staticmethod
+    def read_wav(path, sample_rate=MIC_SAMPLE_RATE):
+        """16-bit PCM WAV as a mono int16 array at sample_rate"""
+        with wave.open(path, "rb") as f:
+            if f.getsampwidth() != 2:
+                raise ValueError(f"{path}: only 16-bit PCM is supported")
+            channels, rate = f.getnchannels(), f.getframerate()
+            samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1)
+        if rate != sample_rate:
+            n = int(len(samples) * sample_rate / rate)
+            samples = np.interp(np.arange(n) * rate / sample_rate, np.arange(len(samples)), samples)
+        return samples.astype(np.int16)
+    
+    @staticmethod
+    def _mel_filterbank(sample_rate, nfft, n_mels):
+        mel = lambda hz: 2595 * np.log10(1 + hz / 700)
+        hz = lambda m: 700 * (10 ** (m / 2595) - 1)
+        edges = hz(np.linspace(mel(60), mel(min(7600, sample_rate / 2)), n_mels + 2))
+        bins = np.fft.rfftfreq(nfft, 1 / sample_rate)
+        bank = np.zeros((n_mels, len(bins)))
+        for i in range(n_mels):
+            lo, mid, hi = edges[i:i + 3]
+            bank[i] = np.clip(np.minimum((bins - lo) / (mid - lo), (hi - bins) / (hi - mid)), 0, None)
+        return bank
+    
+    def trim(self, samples):
+        """Cut leading and trailing silence from a recording"""
+        hops = len(samples) // self.hop
+        if not hops:
+            return samples
+        rms = np.sqrt((samples[:hops * self.hop].astype(np.float64).reshape(hops, self.hop) ** 2).mean(axis=1))
+        voiced = np.flatnonzero(rms > max(rms.max() * 0.1, self.vad.min_rms))
+        if not len(voiced):
+            return samples[:0]
+        return samples[voiced[0] * self.hop:(voiced[-1] + 1) * self.hop]
+    
+    def _mfcc(self, frames):
+        """Unit-length MFCC vectors (c0 dropped, so loudness does not matter) for (n, window) frames"""
+        power = np.abs(np.fft.rfft(frames * self._hamming, self.nfft)) ** 2
+        cepstra = np.log(power @ self._mel.T + 1e-6) @ self._dct.T
+        return cepstra / (np.linalg.norm(cepstra, axis=-1, keepdims=True) + 1e-9)
+    
+    def features(self, samples):
+        """MFCC vector per hop for a whole recording"""
+        samples = np.asarray(samples, dtype=np.float64)
+        count = (len(samples) - self.window) // self.hop + 1
+        if count <= 0:
+            return np.zeros((0, self.N_MFCC - 1))
+        index = np.arange(self.window)[None, :] + self.hop * np.arange(count)[:, None]
+        return self._mfcc(samples[index])
+    
+    def reset(self):
+        """Forget buffered audio and partial matches"""
+        self._pending = b""
+        self._context = np.zeros(self.window - self.hop)
+        self._preroll = deque(maxlen=max(1, int(self.PREROLL_S / self.HOP_S)))
+        self._quiet_hops = 0
+        self._gate_open = False
+        self._refractory = 0
+        self.samples_seen = 0
+        self._reset_match()
+    
+    def _reset_match(self):
+        self._columns = [(np.full(len(t), np.inf), np.full(len(t), np.inf)) for t in self.templates]
+    
+    def feed(self, data):
+        """Add raw 16-bit mono PCM; returns the stream time (s) of a wake-word hit, else None"""
+        data = self._pending + data
+        usable = len(data) // (2 * self.hop) * 2 * self.hop
+        self._pending = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype=np.int16).astype(np.float64)
+        hit = None
+        for start in range(0, len(samples), self.hop):
+            hop = samples[start:start + self.hop]
+            if self.push(hop, self.vad.is_voiced(hop)):
+                hit = self.samples_seen / self.sample_rate
+        return hit
+    
+    def push(self, hop, voiced):
+        """Analyse one hop whose voice activity is already known; True on a hit"""
+        self.samples_seen += self.hop
+        self.stats["hops"] += 1
+        frame = np.concatenate((self._context, hop))
+        self._context = frame[self.hop:]
+        if self._refractory:
+            self._refractory -= 1
+        if voiced:
+            self._quiet_hops = 0
+            if not self._gate_open:
+                self._gate_open = True
+                self.stats["segments"] += 1
+                preroll = list(self._preroll)
+                self._preroll.clear()
+                if any(self._match(f) for f in preroll):
+                    return self._hit()
+        elif self._gate_open:
+            self._quiet_hops += 1
+            if self._quiet_hops * self.HOP_S > self.HANGOVER_S:
+                self._gate_open = False
+                self._reset_match()
+        if not self._gate_open:
+            self._preroll.append(frame)
+            return False
+        return self._match(frame) and self._hit()
+    
+    def _hit(self):
+        self.stats["hits"] += 1
+        self._refractory = int(self.REFRACTORY_S / self.HOP_S)
+        self._reset_match()
+        return True
+    
+    def _match(self, frame):
+        """Advance the DTW of every template by one frame; True if one ends below the threshold
+        
+        Local steps (1,1), (1,2) and (2,1) keep the warp between half and double
+        speed and need only the previous two columns, so each update is one
+        vectorized pass over the template.
+        """
+        self.stats["analysed"] += 1
+        vector = self._mfcc(frame)
+        best = np.inf
+        for i, template in enumerate(self.templates):
+            prev1, prev2 = self._columns[i]
+            column = self._dtw_column(prev1, prev2, 1.0 - template @ vector)
+            self._columns[i] = (column, prev1)
+            best = min(best, column[-1] / len(template))
+        return best < self.threshold and not self._refractory
+    
+    @staticmethod
+    def _dtw_column(prev1, prev2, cost):
+        column = np.empty_like(prev1)
+        column[0] = cost[0]  # A match may start at any frame
+        column[1:] = np.minimum(prev1[:-1], prev2[:-1]) + cost[1:]
+        column[2:] = np.minimum(column[2:], prev1[:-2] + 2 * cost[2:])
+        return column
+    
+    def distance(self, samples):
+        """Best distance of any template to any stretch of a recording (what feed() compares to the threshold)"""
+        features = self.features(samples)
+        best = np.inf
+        for template in self.templates:
+            prev1 = prev2 = np.full(len(template), np.inf)
+            for cost in 1.0 - features @ template.T:
+                prev1, prev2 = self._dtw_column(prev1, prev2, cost), prev1
+                best = min(best, prev1[-1] / len(template))
+        return best
+
+
+def enroll_wake_word(count=WAKE_WORD_ENROLL_SAMPLES, path=WAKE_WORD_TEMPLATE_DIR):
+    """Record the wake word a few times for WakeWordDetector"""
+    import speech_recognition as sr
+    os.makedirs(path, exist_ok=True)
+    recognizer = sr.Recognizer()
+    recognizer.pause_threshold = 0.5
+    with sr.Microphone(sample_rate=MIC_SAMPLE_RATE) as source:
+        print("🎤 Adjusting for ambient noise...")
+        recognizer.adjust_for_ambient_noise(source, duration=MIC_CALIBRATION_S)
+        for i in range(count):
+            print(f"🎤 Say '{WAKE_WORD}' ({i + 1}/{count})")
+            audio = recognizer.listen(source, timeout=10, phrase_time_limit=3)
+            file = os.path.join(path, f"wake_{int(time.time())}_{i}.wav")
+            with open(file, "wb") as f:
+                f.write(audio.get_wav_data(convert_rate=MIC_SAMPLE_RATE, convert_width=2))
+            print(f"✓ Saved {file}")
+    files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(".wav"))
+    worst = 0.0
+    for file in files:
+        others = [WakeWordDetector.read_wav(other) for other in files if other != file]
+        if others:
+            worst = max(worst, WakeWordDetector(others).distance(WakeWordDetector.read_wav(file)))
+    print(f"✓ {len(files)} wake-word recordings in {path}; they differ by up to {worst:.3f} "
+          f"(WAKE_WORD_THRESHOLD = {WAKE_WORD_THRESHOLD}, keep it well above that)")
+
+
+class AudioRingBuffer:
+    """The last `seconds` of microphone audio with a voice-activity flag per 10 ms hop
+    
+    Positions are absolute sample counts since the stream opened, so wake-word
+    spotting and command capture can slice the same audio.
+    """
+    HOP_S = 0.01
+    
+    def __init__(self, sample_rate=MIC_SAMPLE_RATE, seconds=30.0, vad=None):
+        self.sample_rate = sample_rate
+        self.hop = int(sample_rate * self.HOP_S)
+        self.capacity = int(seconds / self.HOP_S) * self.hop
+        self.vad = vad or VoiceActivityDetector()
+        self.end = 0  # Samples written so far (whole hops)
+        self._samples = np.zeros(self.capacity, dtype=np.int16)
+        self._voiced = np.zeros(self.capacity // self.hop, dtype=bool)
+        self._pending = b""
+    
+    @property
+    def start(self):
+        """Oldest position still buffered"""
+        return max(0, self.end - self.capacity)
+    
+    def write(self, data):
+        """Append raw 16-bit mono PCM; returns (position, hop samples, voiced) per new hop"""
+        data = self._pending + data
+        usable = len(data) // (2 * self.hop) * 2 * self.hop
+        self._pending = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype=np.int16)
+        hops = []
+        for i in range(0, len(samples), self.hop):
+            hop = samples[i:i + self.hop]
+            slot = self.end % self.capacity
+            voiced = self.vad.is_voiced(hop.astype(np.float64))
+            self._samples[slot:slot + self.hop] = hop
+            self._voiced[slot // self.hop] = voiced
+            hops.append((self.end, hop, voiced))
+            self.end += self.hop
+        return hops
+    
+    def read(self, start, end):
+        """Samples between two positions (clipped to what is still buffered)"""
+        start, end = max(start, self.start), min(end, self.end)
+        if end <= start:
+            return np.zeros(0, dtype=np.int16)
+        return self._samples[np.arange(start, end) % self.capacity]
+    
+    def voiced(self, start, end):
+        """Voice-activity flags of the hops between two positions"""
+        first, last = max(start, self.start) // self.hop, min(end, self.end) // self.hop
+        return self._voiced[np.arange(first, last) % len(self._voiced)]
+
+
 class VoiceRecognitionThread(QtCore.QThread):
-    """Thread for handling voice recognition"""
+    """Thread for handling voice recognition
+    
+    The microphone is opened once and every chunk goes into an AudioRingBuffer
+    that marks voice activity per hop. Wake-word spotting and command capture read
+    the same buffer by position, so nothing is lost between them: the command
+    starts where the wake word ended ("hey vision open chrome" can be said in one
+    breath) and ends after SILENCE_DURATION of silence. Transcription runs on a
+    worker thread while audio keeps flowing into the buffer.
+    
+    With wake-word recordings in WAKE_WORD_TEMPLATE_DIR the wake word is spotted
+    locally (WakeWordDetector); otherwise each utterance is transcribed and the
+    words after the wake word, if any, are the command.
+    
+    speech_recognition is imported on the thread, not at startup. The voice
+    threshold saved by the last run (MIC_CALIBRATION_FILE) seeds the noise floor;
+    without it the first MIC_CALIBRATION_S of audio is taken as background noise.
+    `microphone` (anything shaped like speech_recognition.Microphone) and
+    `recognize(pcm, start_s, end_s)` can be replaced to run on recorded audio.
+    """
     wake_word_detected = QtCore.pyqtSignal()
     text_recognized = QtCore.pyqtSignal(str)
     listening_started = QtCore.pyqtSignal()
     listening_stopped = QtCore.pyqtSignal()
     error_occurred = QtCore.pyqtSignal(str)
     
-    def __init__(self):
+    BUFFER_S = 30.0
+    COMMAND_PREROLL_S = 0.3  # Audio kept before the first voiced hop of a command
+    COMMAND_TAIL_S = 0.2  # Audio kept after the last voiced hop
+    COMMAND_TIMEOUT_S = 5.0  # Give up when no speech follows the wake word
+    COMMAND_MAX_S = 10.0
+    UTTERANCE_PAUSE_S = 0.5  # Silence that ends an utterance checked for the wake word
+    UTTERANCE_MAX_S = 3.0
+    
+    def __init__(self, microphone=None, recognize=None):
         super().__init__()
-        self.recognizer = sr.Recognizer()
-        self.recognizer.energy_threshold = 4000
-        self.recognizer.dynamic_energy_threshold = True
-        self.recognizer.pause_threshold = SILENCE_DURATION
+        self.sr = None  # speech_recognition module, imported in run()
+        self.recognizer = None
         self.is_running = False
         self.is_listening_for_command = False
-        self.microphone = None
-        
+        self.microphone = microphone
+        self.recognize = recognize or self._recognize
+        self.wake_detector = None
+        self.buffer = None
+        self._executor = None
+        self._transcripts = deque()  # (kind, start, end, future) in submission order
+        self._command_start = None
+        self._utterance = None  # [start, end of last voiced hop] while an utterance is open
+    
+    @staticmethod
+    def _load_calibration():
+        """Saved voice threshold, or None if missing or stale"""
+        if not MIC_CALIBRATION_FILE:
+            return None
+        try:
+            with open(MIC_CALIBRATION_FILE, encoding="utf-8") as f:
+                saved = json.load(f)
+            if time.time() - saved["saved_at"] <= MIC_CALIBRATION_MAX_AGE_S:
+                return float(saved["energy_threshold"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+    
+    def _save_calibration(self):
+        if not MIC_CALIBRATION_FILE or self.buffer is None or self.buffer.vad.noise_rms is None:
+            return
+        try:
+            with open(MIC_CALIBRATION_FILE, "w", encoding="utf-8") as f:
+                json.dump({"energy_threshold": self.buffer.vad.threshold, "saved_at": time.time()}, f)
+        except OSError as e:
+            print(f"⚠️ Could not save microphone calibration: {e}")
+    
     def run(self):
         """Main voice recognition loop"""
         self.is_running = True
         
         try:
-            self.microphone = sr.Microphone()
-            with self.microphone as source:
+            start = time.perf_counter()
+            import speech_recognition
+            self.sr = speech_recognition
+            self.recognizer = self.sr.Recognizer()
+            if self.microphone is None:
+                self.microphone = self.sr.Microphone(sample_rate=MIC_SAMPLE_RATE)
+            try:
+                self.wake_detector = WakeWordDetector.from_directory(WAKE_WORD_TEMPLATE_DIR)
+            except (OSError, ValueError, wave.Error) as e:
+                print(f"⚠️ Could not load wake-word recordings: {e}")
+            if self.wake_detector:
+                print(f"🎤 Local wake-word detection ({len(self.wake_detector.templates)} recordings)")
+            else:
+                print(f"ℹ️ No wake-word recordings in '{WAKE_WORD_TEMPLATE_DIR}', transcribing each utterance "
+                      "(python app.py --enroll-wake-word enables local detection)")
+            vad = VoiceActivityDetector()
+            threshold = self._load_calibration()
+            if threshold is not None:
+                vad.noise_rms = threshold / vad.ratio
+                print(f"🎤 Using saved microphone calibration (voice threshold {threshold:.0f})")
+            else:
+                vad.calibration_hops = int(MIC_CALIBRATION_S / AudioRingBuffer.HOP_S)
                 print("🎤 Adjusting for ambient noise...")
-                self.recognizer.adjust_for_ambient_noise(source, duration=1)
-                print("✓ Voice recognition ready")
+            self.buffer = AudioRingBuffer(MIC_SAMPLE_RATE, self.BUFFER_S, vad)
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="voice-asr")
         except Exception as e:
             print(f"⚠️ Microphone initialization error: {e}")
             self.error_occurred.emit(f"Microphone error: {str(e)}")
             return
         
         while self.is_running:
-            if not self.is_listening_for_command:
-                # Listen for wake word
-                self._listen_for_wake_word()
-            else:
-                # Listen for command
-                self._listen_for_command()
-            
-            time.sleep(0.1)
-    
-    def _listen_for_wake_word(self):
-        """Listen for the wake word"""
-        try:
-            with self.microphone as source:
-                # Short listen with timeout
-                audio = self.recognizer.listen(source, timeout=1, phrase_time_limit=3)
-                
-            # Recognize speech
             try:
-                if USE_OFFLINE_RECOGNITION:
-                    text = self.recognizer.recognize_sphinx(audio).lower()
-                else:
-                    text = self.recognizer.recognize_google(audio).lower()
-                
-                print(f"🎤 Heard: {text}")
-                
-                # Check for wake word
-                if WAKE_WORD.lower() in text:
-                    print(f"✓ Wake word detected: '{WAKE_WORD}'")
+                with self.microphone as source:
+                    if start is not None:
+                        print(f"✓ Voice recognition ready ({(time.perf_counter() - start) * 1000:.0f}ms)")
+                        start = None
+                    while self.is_running:
+                        data = source.stream.read(source.CHUNK)
+                        if not data:  # Recorded audio ran out
+                            self.is_running = False
+                            break
+                        self._on_audio(data)
+            except Exception as e:
+                print(f"⚠️ Microphone stream error: {e}")
+                time.sleep(1)
+        
+        while self._transcripts:
+            self._collect_transcripts(wait=True)
+        self._executor.shutdown(wait=False)
+        self._save_calibration()
+    
+    def _on_audio(self, data):
+        """Buffer a chunk and advance wake-word spotting and command capture"""
+        for position, hop, voiced in self.buffer.write(data):
+            if self.wake_detector:
+                # Fed during commands too, so its gate and noise floor stay current
+                if self.wake_detector.push(hop.astype(np.float64), voiced) and self._command_start is None:
+                    print(f"✓ Wake word detected: '{WAKE_WORD}' (local)")
                     self.wake_word_detected.emit()
-                    self.is_listening_for_command = True
-                    
-            except sr.UnknownValueError:
-                pass  # Could not understand audio
-            except sr.RequestError as e:
-                if not USE_OFFLINE_RECOGNITION:
-                    print(f"⚠️ Recognition service error: {e}")
-                    
-        except sr.WaitTimeoutError:
-            pass  # Timeout, continue listening
-        except Exception as e:
-            print(f"⚠️ Wake word listening error: {e}")
+                    self._start_command(position + self.buffer.hop)
+            elif self._command_start is None:
+                self._track_utterance(position, voiced)
+        if self.is_listening_for_command and self._command_start is None:  # Manual activation
+            self._start_command(self.buffer.end - int(self.COMMAND_PREROLL_S * self.buffer.sample_rate))
+        if self._command_start is not None:
+            self._check_command()
+        self._collect_transcripts()
     
-    def _listen_for_command(self):
-        """Listen for voice command after wake word"""
-        try:
-            self.listening_started.emit()
-            print("🎤 Listening for command...")
-            
-            with self.microphone as source:
-                # Listen for command with longer timeout
-                audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=10)
-            
-            print("🎤 Processing speech...")
-            
-            # Recognize speech
+    def _track_utterance(self, position, voiced):
+        """Without local spotting: cut utterances at pauses and transcribe them for the wake word"""
+        rate = self.buffer.sample_rate
+        if voiced:
+            if self._utterance is None:
+                self._utterance = [max(self.buffer.start, position - int(self.COMMAND_PREROLL_S * rate)), position]
+            self._utterance[1] = position + self.buffer.hop
+            return
+        if self._utterance is None:
+            return
+        start, last = self._utterance
+        if position - last >= self.UTTERANCE_PAUSE_S * rate or position - start >= self.UTTERANCE_MAX_S * rate:
+            self._utterance = None
+            self._transcribe("wake", start, min(last + int(self.COMMAND_TAIL_S * rate), self.buffer.end))
+    
+    def _start_command(self, position):
+        self._command_start = max(position, self.buffer.start)
+        self._utterance = None
+        self.is_listening_for_command = True
+        self.listening_started.emit()
+        print("🎤 Listening for command...")
+    
+    def _check_command(self):
+        """End the command after SILENCE_DURATION of silence, COMMAND_MAX_S, or no speech at all"""
+        rate, hop = self.buffer.sample_rate, self.buffer.hop
+        start = self._command_start
+        flags = self.buffer.voiced(start, self.buffer.end)
+        elapsed = len(flags) * AudioRingBuffer.HOP_S
+        speech = np.flatnonzero(flags)
+        if not len(speech):
+            if elapsed >= self.COMMAND_TIMEOUT_S:
+                print("⚠️ No speech detected")
+                self.error_occurred.emit("No speech detected")
+                self._stop_command()
+            return
+        silence = (len(flags) - 1 - speech[-1]) * AudioRingBuffer.HOP_S
+        if silence < SILENCE_DURATION and elapsed < self.COMMAND_MAX_S:
+            return
+        first = max(start, start + speech[0] * hop - int(self.COMMAND_PREROLL_S * rate))
+        last = min(self.buffer.end, start + (speech[-1] + 1) * hop + int(self.COMMAND_TAIL_S * rate))
+        print("🎤 Processing speech...")
+        self._transcribe("command", first, last)
+        self._stop_command()
+    
+    def _stop_command(self):
+        self._command_start = None
+        self.is_listening_for_command = False
+        self.listening_stopped.emit()
+    
+    def _transcribe(self, kind, start, end):
+        rate = self.buffer.sample_rate
+        pcm = self.buffer.read(start, end).tobytes()
+        future = self._executor.submit(self.recognize, pcm, start / rate, end / rate)
+        self._transcripts.append((kind, start, end, future))
+    
+    def _recognize(self, pcm, start_s, end_s):
+        """Transcribe a slice of the buffer with Google or Sphinx"""
+        audio = self.sr.AudioData(pcm, self.buffer.sample_rate, 2)
+        if USE_OFFLINE_RECOGNITION:
+            return self.recognizer.recognize_sphinx(audio)
+        return self.recognizer.recognize_google(audio)
+    
+    def _collect_transcripts(self, wait=False):
+        """Handle finished transcriptions, oldest first"""
+        while self._transcripts and (wait or self._transcripts[0][3].done()):
+            kind, start, end, future = self._transcripts.popleft()
             try:
-                if USE_OFFLINE_RECOGNITION:
-                    text = self.recognizer.recognize_sphinx(audio)
-                else:
-                    text = self.recognizer.recognize_google(audio)
-                
+                text = future.result()
+            except self.sr.UnknownValueError:
+                if kind == "command":
+                    print("⚠️ Could not understand audio")
+                    self.error_occurred.emit("Could not understand audio")
+                continue
+            except self.sr.RequestError as e:
+                if kind == "command" or not USE_OFFLINE_RECOGNITION:
+                    print(f"⚠️ Recognition error: {e}")
+                if kind == "command":
+                    self.error_occurred.emit(f"Recognition error: {str(e)}")
+                continue
+            except Exception as e:
+                print(f"⚠️ Recognition error: {e}")
+                if kind == "command":
+                    self.error_occurred.emit(str(e))
+                continue
+            if kind == "command":
+                text = self._after_wake_word(text) or text
                 print(f"✓ Recognized: {text}")
                 self.text_recognized.emit(text)
-                
-            except sr.UnknownValueError:
-                print("⚠️ Could not understand audio")
-                self.error_occurred.emit("Could not understand audio")
-            except sr.RequestError as e:
-                print(f"⚠️ Recognition error: {e}")
-                self.error_occurred.emit(f"Recognition error: {str(e)}")
-                
-        except sr.WaitTimeoutError:
-            print("⚠️ No speech detected")
-            self.error_occurred.emit("No speech detected")
-        except Exception as e:
-            print(f"⚠️ Command listening error: {e}")
-            self.error_occurred.emit(str(e))
-        finally:
-            self.listening_stopped.emit()
-            self.is_listening_for_command = False
+                continue
+            print(f"🎤 Heard: {text.lower()}")
+            if WAKE_WORD.lower() not in text.lower() or self._command_start is not None:
+                continue
+            print(f"✓ Wake word detected: '{WAKE_WORD}'")
+            self.wake_word_detected.emit()
+            command = self._after_wake_word(text)
+            if command:
+                print(f"✓ Recognized: {command}")
+                self.text_recognized.emit(command)
+            else:
+                self._start_command(end)
+    
+    @staticmethod
+    def _after_wake_word(text):
+        """Words after the wake word ('' if it is not there or nothing follows)"""
+        index = text.lower().find(WAKE_WORD.lower())
+        if index < 0:
+            return ""
+        return text[index + len(WAKE_WORD):].strip(" ,.!?")
     
     def stop(self):
         """Stop the voice recognition thread"""
@@ -575,19 +1111,215 @@ class FloatingButtonPanel(QtWidgets.QWidget):
         super().showEvent(event)
 
 
+class Tracer:
+    """Records timed spans for each stage of a task and exports them as Chrome trace JSON.
+    
+    Spans carry free-form args (sizes, counts, outcome) and the thread they ran
+    on. finish_task() writes TRACE_DIR/trace_*.json, which opens in
+    chrome://tracing or ui.perfetto.dev; `benchmark.py trace-summary` reports
+    p50/p95 per stage across many files. Only the newest `keep` files are kept.
+    Thread-safe; a no-op when disabled.
+    """
+    def __init__(self, enabled=TRACE_ENABLED, trace_dir=TRACE_DIR, max_events=TRACE_MAX_EVENTS, keep=TRACE_KEEP):
+        self.enabled = enabled
+        self.trace_dir = trace_dir
+        self.max_events = max_events
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._epoch = time.perf_counter()
+        self.start_task(None)
+    
+    def start_task(self, name):
+        """Drop recorded spans and start collecting for a new task"""
+        with self._lock:
+            self.task = name
+            self.task_started = time.time()
+            self._events = []
+            self._threads = set()
+            self.dropped = 0
+    
+    def _us(self, t):
+        return (t - self._epoch) * 1e6
+    
+    def _record(self, name, start, end, args, tid=None):
+        tid = tid if tid is not None else threading.get_ident()
+        with self._lock:
+            if len(self._events) >= self.max_events:
+                self.dropped += 1
+                return
+            if tid not in self._threads:
+                self._threads.add(tid)
+                thread_name = next((t.name for t in threading.enumerate() if t.ident == tid), str(tid))
+                self._events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                                     "args": {"name": thread_name}})
+            self._events.append({"name": name, "cat": "va", "ph": "X", "pid": os.getpid(), "tid": tid,
+                                 "ts": self._us(start), "dur": (end - start) * 1e6, "args": args})
+    
+    @contextmanager
+    def span(self, name, **args):
+        """Time the enclosed block; add sizes or an outcome to the yielded args dict"""
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args.setdefault("outcome", "error")
+            args["error"] = str(e)[:200]
+            raise
+        finally:
+            args.setdefault("outcome", "ok")
+            self._record(name, start, time.perf_counter(), args)
+    
+    def begin(self, name, **args):
+        """Open a span that ends in another callback; pass the token to end()"""
+        if not self.enabled:
+            return None
+        return (name, time.perf_counter(), args, threading.get_ident())
+    
+    def end(self, token, **args):
+        if token is None:
+            return
+        name, start, begin_args, tid = token
+        begin_args.update(args)
+        begin_args.setdefault("outcome", "ok")
+        self._record(name, start, time.perf_counter(), begin_args, tid)
+    
+    def finish_task(self, outcome="completed"):
+        """Write the spans recorded since start_task() to a trace file; returns its path"""
+        with self._lock:
+            events, self._events = self._events, []
+            self._threads = set()
+            task, started, dropped = self.task, self.task_started, self.dropped
+        if not self.enabled or not any(e["ph"] == "X" for e in events):
+            return None
+        os.makedirs(self.trace_dir, exist_ok=True)
+        path = os.path.join(self.trace_dir, f"trace_{int(started * 1000)}.json")
+        trace = {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "metadata": {"task": task, "outcome": outcome, "started": started,
+                         "dropped_events": dropped},
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace, f)
+        print(f"🧭 Trace written to {path} ({len(events)} events)")
+        self._prune()
+        return path
+    
+    def _prune(self):
+        """Delete all but the newest `keep` trace files"""
+        if not self.keep:
+            return
+        paths = sorted(glob.glob(os.path.join(self.trace_dir, "trace_*.json")))  # named by start time
+        for old in paths[:-self.keep]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+tracer = Tracer()
+
+
+class PyAutoGuiBackend:
+    """Mouse and keyboard input through pyautogui
+    
+    pyautogui is imported on first use, because importing it needs a display;
+    headless runs that use another backend never touch it.
+    """
+    def __init__(self):
+        self._gui = None
+    
+    @property
+    def gui(self):
+        if self._gui is None:
+            import pyautogui
+            self._gui = pyautogui
+        return self._gui
+    
+    def click(self, x, y):
+        self.gui.click(x, y)
+    
+    def press(self, key):
+        self.gui.press(key)
+    
+    def write(self, text, interval=0.05):
+        self.gui.write(text, interval=interval)
+    
+    def scroll(self, clicks):
+        self.gui.scroll(clicks)
+
+
+class NullInputBackend:
+    """Input backend that only records actions (headless runs and benchmarks)
+    
+    `on_action` is called with each action tuple, e.g. to advance a fake screen.
+    """
+    def __init__(self, on_action=None):
+        self.on_action = on_action
+        self.actions = []
+    
+    def _record(self, *action):
+        self.actions.append(action)
+        if self.on_action:
+            self.on_action(action)
+    
+    def click(self, x, y):
+        self._record("click", x, y)
+    
+    def press(self, key):
+        self._record("press", key)
+    
+    def write(self, text, interval=0.05):
+        self._record("write", text)
+    
+    def scroll(self, clicks):
+        self._record("scroll", clicks)
+
+
+class XdotoolBackend:
+    """Input through xdotool on a given X display, so agents on separate Xvfb sessions do not collide"""
+    KEYS = {"enter": "Return", "tab": "Tab", "backspace": "BackSpace"}
+    
+    def __init__(self, display):
+        self.display = display
+        self.env = dict(os.environ, DISPLAY=display)
+    
+    def _run(self, *args):
+        subprocess.run(["xdotool", *args], env=self.env, check=True, timeout=30,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    
+    def click(self, x, y):
+        self._run("mousemove", str(x), str(y), "click", "1")
+    
+    def press(self, key):
+        self._run("key", self.KEYS.get(key, key))
+    
+    def write(self, text, interval=0.05):
+        self._run("type", "--delay", str(int(interval * 1000)), "--", text)
+    
+    def scroll(self, clicks):
+        # Same convention as pyautogui on X11: one wheel button press per click, positive is up
+        self._run("click", "--repeat", str(abs(clicks)), "--delay", "1", "4" if clicks > 0 else "5")
+
+
 class TaskContext:
     """Stores conversation history and task context"""
     def __init__(self):
         self.original_task = ""
         self.conversation_history = []
         self.steps_completed = []
-        self.last_screenshot_path = None
+        self.last_frame = None
+        self.prompt = PromptContext()
     
     def reset(self):
         self.original_task = ""
         self.conversation_history = []
         self.steps_completed = []
-        self.last_screenshot_path = None
+        self.last_frame = None
+        self.prompt.reset()
     
     def add_user_message(self, msg):
         self.conversation_history.append({"role": "user", "content": msg})
@@ -595,155 +1327,2898 @@ class TaskContext:
     def add_step_completed(self, step):
         self.steps_completed.append(step)
     
-    def get_context_summary(self):
+    def repeated_step(self, limit=LOOP_REPEAT_LIMIT):
+        """The last step if the last `limit` actions hit the same tracked element the same way, else None"""
+        recent = [s for s in self.steps_completed if s.get("type") != "wait_and_send_image"][-limit:]
+        if limit < 2 or len(recent) < limit or recent[-1].get("element_id") is None:
+            return None
+        signature = lambda s: (s.get("type"), s.get("element_id"), s.get("content"))
+        return recent[-1] if all(signature(s) == signature(recent[-1]) for s in recent) else None
+    
+    def get_context_summary(self, recent=None):
+        """Task and completed steps; with `recent`, only the last `recent` steps are listed one by one"""
         summary = f"Original task: {self.original_task}\n\n"
-        summary += f"Steps completed so far:\n"
-        for i, step in enumerate(self.steps_completed, 1):
-            summary += f"{i}. {step.get('type', 'unknown')} - {step.get('description', 'no description')}\n"
+        if self.conversation_history:
+            summary += "User follow-ups: " + " | ".join(m["content"][:100] for m in self.conversation_history[-3:]) + "\n\n"
+        if recent is None:
+            older = []
+        else:
+            older = self.steps_completed[:len(self.steps_completed) - recent] if recent else self.steps_completed
+        if older:
+            kinds, targets = {}, {}
+            for step in older:
+                kinds[step.get("type", "unknown")] = kinds.get(step.get("type", "unknown"), 0) + 1
+                if step.get("element_id") is not None:
+                    targets[step["element_id"]] = step.get("element_text", "")
+            summary += f"Earlier steps ({len(older)}): " + ", ".join(f"{n} {kind}" for kind, n in kinds.items())
+            if targets:
+                shown = list(targets.items())[-5:]
+                summary += "; elements used: " + ", ".join(f'#{i} "{text}"' for i, text in shown)
+                if len(targets) > len(shown):
+                    summary += f" and {len(targets) - len(shown)} more"
+            summary += "\n"
+        summary += "Steps completed so far:\n" if not older else "Latest steps:\n"
+        for i, step in enumerate(self.steps_completed[len(older):], len(older) + 1):
+            summary += f"{i}. {step.get('type', 'unknown')} - {str(step.get('description', 'no description'))[:100]}"
+            if step.get("element_id") is not None:
+                summary += f" (element #{step['element_id']} \"{step.get('element_text', '')}\")"
+            summary += "\n"
+        repeated = self.repeated_step()
+        if repeated is not None:
+            summary += (f"\nWARNING: the last {LOOP_REPEAT_LIMIT} steps repeated {repeated.get('type')} on element "
+                        f"#{repeated['element_id']}. If the screen is not changing, try a different approach.\n")
         return summary
 
 
-def call_omniparser(image_path, box_threshold=0.05, iou_threshold=0.1):
-    """Call OmniParser API and return parsed results"""
-    try:
-        with open(image_path, "rb") as img_file:
-            files = {"image": img_file}
-            data = {
-                "box_threshold": box_threshold,
-                "iou_threshold": iou_threshold
-            }
-            print("📡 Calling OmniParser...")
-            response = requests.post(OMNIPARSER_URL, files=files, data=data, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            print(f"✓ OmniParser found {len(result['parsed_content'])} elements")
-            
-            # Save annotated image
-            image_data = base64.b64decode(result["image_base64"])
-            img = Image.open(io.BytesIO(image_data))
-            timestamp = int(time.time() * 1000)
-            annotated_path = f"annotated_screen_{timestamp}.png"
-            img.save(annotated_path)
-            print(f"✓ Annotated image saved: {annotated_path}")
-            return result["parsed_content"], annotated_path
-        else:
-            print(f"⚠️ OmniParser error: {response.text}")
-            return None, None
-    except Exception as e:
-        print(f"⚠️ Error calling OmniParser: {e}")
-        return None, None
+class EncodeCancelled(Exception):
+    """Raised inside a streamed encode once its consumer has stopped reading"""
 
 
-def compare_screenshots(img1_path, img2_path, threshold=SCREEN_CHANGE_THRESHOLD):
-    """Compare two screenshots and return if they differ significantly"""
-    try:
-        img1 = Image.open(img1_path).convert('RGB')
-        img2 = Image.open(img2_path).convert('RGB')
+class ScreenFrame:
+    """In-memory screenshot backed by the raw BGRA buffer returned by mss.
+    
+    Pixels are only converted or encoded when a consumer asks for them, and
+    encodings are cached so repeated uploads of the same frame are free.
+    """
+    def __init__(self, bgra, width, height, left=0, top=0):
+        self.bgra = bgra
+        self.width = width
+        self.height = height
+        self.left = left
+        self.top = top
+        self.timestamp = time.time()
+        self._pil = None
+        self._encoded = {}
+    
+    @classmethod
+    def from_mss(cls, shot):
+        """Wrap an mss ScreenShot without copying its pixel buffer"""
+        return cls(shot.raw, shot.width, shot.height, shot.left, shot.top)
+    
+    @classmethod
+    def from_pil(cls, img, left=0, top=0):
+        """Build a frame from a PIL image (used for recorded or synthetic screens)"""
+        bgra = img.convert("RGBA").tobytes("raw", "BGRA")
+        return cls(bgra, img.width, img.height, left, top)
+    
+    @property
+    def size(self):
+        return (self.width, self.height)
+    
+    @property
+    def array(self):
+        """Zero-copy (height, width, 4) uint8 BGRA view of the frame"""
+        return np.frombuffer(self.bgra, dtype=np.uint8).reshape(self.height, self.width, 4)
+    
+    def crop(self, region):
+        """Copy of the (x1, y1, x2, y2) region of this frame, in frame-relative pixels"""
+        x1, y1, x2, y2 = region
+        pixels = np.ascontiguousarray(self.array[y1:y2, x1:x2])
+        return ScreenFrame(pixels.tobytes(), pixels.shape[1], pixels.shape[0],
+                           self.left + x1, self.top + y1)
+    
+    def to_pil(self):
+        """RGB PIL image of the frame (converted once, then cached)"""
+        if self._pil is None:
+            self._pil = Image.frombuffer("RGB", self.size, self.bgra, "raw", "BGRX", 0, 1)
+        return self._pil
+    
+    def encode(self, fmt="PNG", **params):
+        """Encode the frame to image bytes, caching the result per format/params"""
+        if fmt.upper() == "PNG":
+            params.setdefault("compress_level", SCREENSHOT_PNG_COMPRESS_LEVEL)
+        key = (fmt.upper(), tuple(sorted(params.items())))
+        if key not in self._encoded:
+            with tracer.span("encode", format=fmt.upper(), width=self.width, height=self.height) as span:
+                buf = io.BytesIO()
+                self.to_pil().save(buf, format=fmt, **params)
+                self._encoded[key] = buf.getvalue()
+                span["bytes"] = len(self._encoded[key])
+        return self._encoded[key]
+    
+    def iter_encode(self, fmt="PNG", **params):
+        """Yield encoded bytes in chunks as the encoder produces them
         
-        # Resize to same size if different
-        if img1.size != img2.size:
-            img2 = img2.resize(img1.size)
+        Encoding runs on a helper thread so a consumer (e.g. an HTTP upload) can
+        send the first chunks while the rest is still being compressed. The full
+        encoding is cached, so a retry does not encode again.
+        """
+        if fmt.upper() == "PNG":
+            params.setdefault("compress_level", SCREENSHOT_PNG_COMPRESS_LEVEL)
+        key = (fmt.upper(), tuple(sorted(params.items())))
+        if key in self._encoded:
+            yield self._encoded[key]
+            return
         
-        # Convert to numpy arrays
-        arr1 = np.array(img1)
-        arr2 = np.array(img2)
+        chunks = queue.Queue(maxsize=64)
+        stop = threading.Event()
         
-        # Calculate difference
-        diff = np.abs(arr1.astype(float) - arr2.astype(float))
-        mean_diff = np.mean(diff) / 255.0  # Normalize to 0-1
+        def put(item):
+            # Bounded waits, so the encoder gives up once the consumer has gone away
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+            raise EncodeCancelled()
         
-        changed = mean_diff > threshold
-        print(f"📊 Screen difference: {mean_diff*100:.2f}% (threshold: {threshold*100:.0f}%)")
+        class _QueueWriter(io.RawIOBase):
+            def writable(self):
+                return True
+            
+            def write(self, b):
+                put(bytes(b))
+                return len(b)
         
-        return changed, mean_diff
-    except Exception as e:
-        print(f"⚠️ Error comparing screenshots: {e}")
-        return True, 1.0  # Assume changed on error
+        def encode():
+            try:
+                with tracer.span("encode", format=fmt.upper(), width=self.width, height=self.height, streamed=True):
+                    self.to_pil().save(_QueueWriter(), format=fmt, **params)
+                put(None)
+            except EncodeCancelled:
+                pass
+            except Exception as e:
+                try:
+                    put(e)
+                except EncodeCancelled:
+                    pass
+        
+        threading.Thread(target=encode, daemon=True).start()
+        parts = []
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                parts.append(chunk)
+                yield chunk
+        finally:
+            # Stops the encoder when the upload fails or the generator is closed early
+            stop.set()
+        self._encoded[key] = b"".join(parts)
+    
+    def save(self, path):
+        """Write the frame to disk as PNG"""
+        with open(path, "wb") as f:
+            f.write(self.encode("PNG"))
+        return path
+    
+    def debug_save(self, path):
+        """Write the frame to disk only when DEBUG_SAVE_SCREENSHOTS is set"""
+        if DEBUG_SAVE_SCREENSHOTS:
+            self.save(path)
+            print(f"📸 Screenshot saved: {path}")
+            return path
+        return None
 
 
-def send_to_gemini(api_key, prompt, annotated_image_path, parsed_elements, context=None):
-    """Send annotated image and parsed elements to Gemini"""
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(MODEL_NAME)
-    
-    # Load annotated image
-    with open(annotated_image_path, 'rb') as f:
-        img_bytes = f.read()
-    pil_img = Image.open(io.BytesIO(img_bytes))
-    
-    # Build prompt
-    full_prompt = SYSTEM_PROMPT + "\n\n"
-    full_prompt += f"**AVAILABLE ELEMENTS**:\n"
-    to_save=""
-    for i, elem in enumerate(parsed_elements, 0):
-        to_save+=f"[{i}]: {elem}\n"
-    full_prompt += "\n"
-
-    # Save full prompt to a text file with timestamp
-    timestamp = int(time.time())
-    prompt_filename = f"gemini_prompt_{timestamp}.txt"
-    with open(prompt_filename, "w", encoding="utf-8") as f:
-        f.write(full_prompt)
-        f.write(to_save)
-    print(f"✓ Full prompt saved to {prompt_filename}")
-    
-    if context and context.steps_completed:
-        full_prompt += context.get_context_summary() + "\n\n"
-    
-    full_prompt += f"User request: {prompt}\n\n"
-    full_prompt += "Analyze the numbered screenshot and provide the next step(s) as JSON.\n"
-    
-    # Generate response
-    response = model.generate_content([full_prompt, pil_img])
-    response_text = response.text.strip()
-    
-    # Extract JSON
-    if "```json" in response_text:
-        json_start = response_text.find("```json") + 7
-        json_end = response_text.find("```", json_start)
-        response_text = response_text[json_start:json_end].strip()
-    elif "```" in response_text:
-        json_start = response_text.find("```") + 3
-        json_end = response_text.find("```", json_start)
-        response_text = response_text[json_start:json_end].strip()
-    
-    # Parse JSON
-    try:
-        result = json.loads(response_text)
-        return result, response_text
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Could not parse JSON: {response_text}\nError: {e}")
+class CaptureService:
+    """Long-lived screen capture service.
+    
+    Keeps one mss session open per thread (mss handles are thread-bound) instead
+    of reconnecting to the display server for every grab, and supports grabbing
+    a region of interest on the selected monitor.
+    """
+    def __init__(self, monitor_index=CAPTURE_MONITOR, display=None):
+        self.monitor_index = monitor_index
+        self.display = display  # X display such as ":1" (None = the current one)
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+    
+    def _session(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            sct = mss.mss(display=self.display) if self.display else mss.mss()
+            self._local.sct = sct
+            with self._lock:
+                self._sessions.append(sct)
+        return sct
+    
+    @property
+    def monitors(self):
+        """All monitors known to mss (index 0 is the union of all screens)"""
+        return self._session().monitors
+    
+    @property
+    def monitor(self):
+        """Geometry dict (left, top, width, height) of the selected monitor"""
+        monitors = self.monitors
+        if not 0 <= self.monitor_index < len(monitors):
+            print(f"⚠️ Monitor {self.monitor_index} not found, using primary")
+            self.monitor_index = 1
+        return monitors[self.monitor_index]
+    
+    def select_monitor(self, index):
+        """Capture (and click on) a different monitor"""
+        self.monitor_index = index
+        return self.monitor
+    
+    def clip_region(self, region):
+        """Clip an (x1, y1, x2, y2) monitor-relative region to the monitor bounds"""
+        mon = self.monitor
+        x1, y1, x2, y2 = (int(round(v)) for v in region)
+        x1 = max(0, min(x1, mon["width"] - 1))
+        y1 = max(0, min(y1, mon["height"] - 1))
+        x2 = max(x1 + 1, min(x2, mon["width"]))
+        y2 = max(y1 + 1, min(y2, mon["height"]))
+        return (x1, y1, x2, y2)
+    
+    def region_around(self, bbox, padding=CLICK_REGION_PADDING):
+        """Padded, clipped region around a monitor-relative pixel bbox"""
+        x1, y1, x2, y2 = bbox
+        return self.clip_region((x1 - padding, y1 - padding, x2 + padding, y2 + padding))
+    
+    def grab(self, region=None):
+        """Capture the selected monitor, or only an (x1, y1, x2, y2) region of it"""
+        sct = self._session()
+        mon = self.monitor
+        if region is not None:
+            x1, y1, x2, y2 = self.clip_region(region)
+            mon = {"left": mon["left"] + x1, "top": mon["top"] + y1,
+                   "width": x2 - x1, "height": y2 - y1}
+        return ScreenFrame.from_mss(sct.grab(mon))
+    
+    def close_thread_session(self):
+        """Close the calling thread's session (call before a worker thread exits)"""
+        sct = getattr(self._local, "sct", None)
+        if sct is not None:
+            self._local.sct = None
+            with self._lock:
+                if sct in self._sessions:
+                    self._sessions.remove(sct)
+            sct.close()
+    
+    def close(self):
+        """Close every session opened by this service"""
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for sct in sessions:
+            try:
+                sct.close()
+            except Exception:
+                pass
+        self._local = threading.local()
 
 
-class VirtualAssistant(QtWidgets.QWidget):
-    # Signals for thread-safe UI updates
-    status_signal = QtCore.pyqtSignal(str, str, bool)  # status, detail, show_progress
+def frame_signature(frame, grid=(64, 36), stride=4):
+    """Perceptual tile hash of a frame: mean brightness of each cell of a coarse grid
     
-    def __init__(self):
-        super().__init__()
-        self.context = TaskContext()
-        self._pending_steps = []
-        self._current_step_index = 0
-        self._parsed_elements = []
-        self._awaiting_action = False
-        self._voice_enabled = VOICE_ENABLED
-        
-        # Create status overlay
-        self.status_overlay = StatusOverlay()
-        self.status_signal.connect(self._update_status_overlay)
+    Returns a (rows, cols) uint8 array; two frames of the same size whose
+    signatures differ by at most a few levels per tile look the same to OmniParser.
+    """
+    cols, rows = grid
+    sample = frame.array[::stride, ::stride, :3]
+    tile_h = max(1, sample.shape[0] // rows)
+    tile_w = max(1, sample.shape[1] // cols)
+    rows = min(rows, sample.shape[0] // tile_h)
+    cols = min(cols, sample.shape[1] // tile_w)
+    cells = sample[:rows * tile_h, :cols * tile_w].reshape(rows, tile_h, cols, tile_w, 3)
+    sums = cells.sum(axis=(1, 3, 4), dtype=np.uint32)
+    return (sums // (tile_h * tile_w * 3)).astype(np.uint8)
+
+
+class ParseCache:
+    """LRU cache of OmniParser results keyed by a perceptual hash of the frame.
+    
+    A lookup hits when a cached frame of the same size has a signature within
+    `tile_tolerance` in every tile, so Retry, question answers and no-op steps
+    reuse the previous parse instead of another round-trip.
+    """
+    def __init__(self, max_entries=PARSE_CACHE_SIZE, max_age_s=PARSE_CACHE_MAX_AGE_S,
+                 tile_tolerance=PARSE_CACHE_TILE_TOLERANCE):
+        self.max_entries = max_entries
+        self.max_age_s = max_age_s
+        self.tile_tolerance = tile_tolerance
+        self._entries = OrderedDict()  # key -> (size, signature, created, parsed_content, annotated_image)
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.task_hits = 0
+        self.task_misses = 0
+    
+    def _expire(self):
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if now - e[2] > self.max_age_s]:
+            del self._entries[key]
+    
+    def lookup(self, frame, signature=None):
+        """Return (parsed_content, annotated_image) for a matching frame, or None"""
+        if signature is None:
+            signature = frame_signature(frame)
+        with self._lock:
+            self._expire()
+            for key in reversed(self._entries):
+                size, cached_signature, _, parsed_content, annotated_image = self._entries[key]
+                if size != frame.size or cached_signature.shape != signature.shape:
+                    continue
+                diff = np.abs(cached_signature.astype(np.int16) - signature.astype(np.int16))
+                if diff.max() <= self.tile_tolerance:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.task_hits += 1
+                    return parsed_content, annotated_image
+            self.misses += 1
+            self.task_misses += 1
+            return None
+    
+    def store(self, frame, parsed_content, annotated_image, signature=None):
+        """Remember the parse of `frame`, evicting the least recently used entry if full"""
+        if signature is None:
+            signature = frame_signature(frame)
+        with self._lock:
+            self._entries[self._next_key] = (frame.size, signature, time.time(), parsed_content, annotated_image)
+            self._next_key += 1
+            self._expire()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def start_task(self):
+        """Reset the per-task hit/miss counters"""
+        self.task_hits = 0
+        self.task_misses = 0
+    
+    def task_summary(self):
+        total = self.task_hits + self.task_misses
+        return (f"Parse cache: {self.task_hits}/{total} OmniParser round-trips saved this task "
+                f"({self.hits} hits, {self.misses} misses overall)")
+
+
+class OmniParserError(Exception):
+    """OmniParser could not parse the screenshot"""
+
+
+class CircuitOpenError(OmniParserError):
+    """Raised without contacting the server while the circuit breaker is open"""
+
+
+class RateLimiter:
+    """Token bucket allowing `per_minute` calls a minute with bursts of `burst`; acquire() blocks until allowed"""
+    def __init__(self, per_minute, burst=1):
+        self.interval = 60.0 / per_minute
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_s = 0.0
+    
+    def acquire(self):
+        """Take a token, sleeping until one is available; returns the delay in seconds"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) / self.interval)
+            self._last = now
+            self._tokens -= 1  # Reserve now, so waiters are served in arrival order
+            delay = -self._tokens * self.interval if self._tokens < 0 else 0.0
+            self.waited_s += delay
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class FairGate:
+    """Caps concurrent calls to a shared backend and hands free slots out round-robin across sessions.
+    
+    Each session waits in its own FIFO; when a slot frees up, the session that
+    has waited longest since it was last served goes next, so one session
+    issuing a burst of requests cannot starve the others. Thread-safe.
+    """
+    def __init__(self, name, max_inflight):
+        self.name = name
+        self.max_inflight = max(1, max_inflight)
+        self._cond = threading.Condition()
+        self._queues = {}  # session key -> deque of waiting tickets
+        self._order = deque()  # Session keys with waiters, in serving order
+        self._inflight = 0
+        self.stats = {"calls": 0, "queued": 0, "wait_s": 0.0, "max_wait_s": 0.0}
+    
+    def acquire(self, key):
+        """Block until `key` may start a call; returns the wait in seconds"""
+        start = time.perf_counter()
+        with self._cond:
+            if self._inflight < self.max_inflight and not self._order:
+                self._inflight += 1
+            else:
+                ticket = object()
+                queue = self._queues.setdefault(key, deque())
+                queue.append(ticket)
+                if len(queue) == 1:
+                    self._order.append(key)
+                self.stats["queued"] += 1
+                while not (self._inflight < self.max_inflight and self._order[0] == key and queue[0] is ticket):
+                    self._cond.wait()
+                queue.popleft()
+                self._order.popleft()
+                if queue:
+                    self._order.append(key)  # Back of the line for its next request
+                else:
+                    del self._queues[key]
+                self._inflight += 1
+                self._cond.notify_all()
+            waited = time.perf_counter() - start
+            self.stats["calls"] += 1
+            self.stats["wait_s"] += waited
+            self.stats["max_wait_s"] = max(self.stats["max_wait_s"], waited)
+        return waited
+    
+    def release(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+    
+    @contextmanager
+    def slot(self, key, limiter=None):
+        """Wait for the session's rate limit and a fair slot, hold it for the enclosed call"""
+        with tracer.span(f"queue:{self.name}", session=key) as span:
+            if limiter is not None:
+                span["rate_limited_ms"] = round(limiter.acquire() * 1000, 1)
+            self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker (closed -> open -> half-open -> closed)"""
+    def __init__(self, threshold=OMNIPARSER_BREAKER_THRESHOLD, reset_after_s=OMNIPARSER_BREAKER_RESET_S):
+        self.threshold = threshold
+        self.reset_after_s = reset_after_s
+        self.failures = 0
+        self.opened_at = None
+        self._trial_at = None  # When the current half-open trial was handed out
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.reset_after_s:
+            return "half-open"
+        return "open"
+    
+    def allow(self):
+        """True if a request may be sent: always when closed, once per trial when half-open
         
-        # Create voice indicator
-        self.voice_indicator = VoiceIndicator()
+        Only one caller gets the half-open trial; the rest are rejected until it
+        records a result (or, if it never does, until reset_after_s has passed).
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.time()
+            if now - self.opened_at < self.reset_after_s:
+                return False
+            if self._trial_at is not None and now - self._trial_at < self.reset_after_s:
+                return False
+            self._trial_at = now
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_at = None
+    
+    def record_failure(self):
+        with self._lock:
+            self._trial_at = None
+            self.failures += 1
+            if self.failures >= self.threshold or self.opened_at is not None:
+                # Trip, or re-trip after a failed half-open trial
+                self.opened_at = time.time()
+
+
+class OmniParserClient:
+    """Pooled, retrying HTTP client for the OmniParser server.
+    
+    Reuses connections through a requests.Session, retries transient failures
+    with exponential backoff and jitter, and stops calling a dead server for a
+    while once the circuit breaker opens.
+    """
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    STREAM_REJECT_STATUS = (400, 411, 415, 501)  # Servers without chunked-upload support
+    RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+    FATAL_ERRORS = (requests.exceptions.SSLError, requests.exceptions.ProxyError)  # ConnectionErrors not worth retrying
+    session_key = None  # Set on per-session views, see for_session()
+    gate = None
+    limiter = None
+    
+    def __init__(self, url=OMNIPARSER_URL, connect_timeout=OMNIPARSER_CONNECT_TIMEOUT,
+                 read_timeout=OMNIPARSER_READ_TIMEOUT, max_retries=OMNIPARSER_MAX_RETRIES,
+                 backoff_s=OMNIPARSER_BACKOFF_S, breaker=None, pool_size=4,
+                 stream_upload=OMNIPARSER_STREAM_UPLOAD):
+        self.url = url
+        self.stream_upload = stream_upload
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0, "rejected": 0,
+                      "bytes_sent": 0, "bytes_received": 0}
+        self.last_elapsed_ms = 0.0
+    
+    def for_session(self, key, gate=None, limiter=None):
+        """A view of this client for one agent session
         
-        # Create voice recognition thread
-        self.voice_thread = None
+        The view shares the connection pool and circuit breaker, keeps its own
+        stats, and sends each request through `gate` (a FairGate) and `limiter`.
+        """
+        bound = copy.copy(self)
+        bound.session_key, bound.gate, bound.limiter = key, gate, limiter
+        bound.stats = dict.fromkeys(self.stats, 0)
+        return bound
+    
+    def _backoff(self, attempt):
+        delay = self.backoff_s * (2 ** attempt)
+        return delay * random.uniform(0.5, 1.5)
+    
+    def _stream_body(self, frame, data, boundary):
+        """Multipart body generator that sends PNG chunks while the frame is encoded"""
+        head = b""
+        for name, value in data.items():
+            head += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+                     f"{value}\r\n").encode("utf-8")
+        head += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"screen.png\"\r\n"
+                 f"Content-Type: image/png\r\n\r\n").encode("utf-8")
+        yield head
+        for chunk in frame.iter_encode("PNG"):
+            self.stats["bytes_sent"] += len(chunk)
+            yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+    
+    def _post(self, image, data):
+        """Single HTTP attempt; returns the response"""
+        if isinstance(image, ScreenFrame) and self.stream_upload:
+            response = self._post_streamed(image, data)
+            if response.status_code not in self.STREAM_REJECT_STATUS:
+                self.stats["bytes_received"] += len(response.content)
+                return response
+            print(f"⚠️ OmniParser rejected a chunked upload (HTTP {response.status_code}), sending whole images")
+            self.stream_upload = False
+        if isinstance(image, ScreenFrame):
+            payload = image.encode("PNG")
+            self.stats["bytes_sent"] += len(payload)
+            files = {"image": ("screen.png", payload, "image/png")}
+            response = self.session.post(self.url, files=files, data=data, timeout=self.timeout)
+        else:
+            self.stats["bytes_sent"] += os.path.getsize(image)
+            with open(image, "rb") as img_file:
+                response = self.session.post(self.url, files={"image": img_file}, data=data, timeout=self.timeout)
+        self.stats["bytes_received"] += len(response.content)
+        return response
+    
+    def _post_streamed(self, frame, data):
+        boundary = uuid.uuid4().hex
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        body = self._stream_body(frame, data, boundary)
+        try:
+            return self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+        finally:
+            body.close()  # stops the encoder thread if the upload ended early
+    
+    def request(self, image, box_threshold=0.05, iou_threshold=0.1, return_image=True):
+        """POST the image and return the decoded JSON result; raises OmniParserError
         
-        self.init_ui()
+        With return_image=False the server is asked to skip the annotated image
+        (servers that ignore the flag still work, the image is just not used).
+        """
+        size = image.size if isinstance(image, ScreenFrame) else None
+        with tracer.span("omniparser_request", size=size, return_image=return_image) as span:
+            before = dict(self.stats)
+            try:
+                result = self._request(image, box_threshold, iou_threshold, return_image)
+            finally:
+                for key in ("attempts", "bytes_sent", "bytes_received"):
+                    span[key] = self.stats[key] - before[key]
+            span["elements"] = len(result["parsed_content"])
+            return result
+    
+    def _request(self, image, box_threshold, iou_threshold, return_image):
+        self.stats["calls"] += 1
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise CircuitOpenError("OmniParser unavailable (circuit breaker open)")
         
-        # Start voice recognition if enabled
-        if self._voice_enabled:
-            self.start_voice_recognition()
+        data = {
+            "box_threshold": box_threshold,
+            "iou_threshold": iou_threshold
+        }
+        if not return_image:
+            data["return_image"] = "false"
+        start = time.perf_counter()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                delay = self._backoff(attempt - 1)
+                print(f"⏳ Retrying OmniParser in {delay:.1f}s ({last_error})")
+                time.sleep(delay)
+            self.stats["attempts"] += 1
+            # A slot per attempt, so a session backing off does not hold one while it sleeps
+            slot = self.gate.slot(self.session_key, self.limiter) if self.gate else nullcontext()
+            try:
+                print("📡 Calling OmniParser...")
+                with slot:
+                    response = self._post(image, data)
+            except requests.RequestException as e:
+                last_error = f"{type(e).__name__}: {e}"
+                if isinstance(e, self.RETRY_ERRORS) and not isinstance(e, self.FATAL_ERRORS):
+                    continue
+                break
+            
+            if response.status_code == 200:
+                try:
+                    result = response.json()
+                    result["parsed_content"]
+                except (ValueError, KeyError) as e:
+                    last_error = f"invalid response: {e}"
+                    break
+                self.breaker.record_success()
+                self.last_elapsed_ms = (time.perf_counter() - start) * 1000
+                return result
+            
+            last_error = f"HTTP {response.status_code}: {response.text[:200]}"
+            if response.status_code not in self.RETRY_STATUS:
+                break
+        
+        self.stats["failures"] += 1
+        self.breaker.record_failure()
+        self.last_elapsed_ms = (time.perf_counter() - start) * 1000
+        raise OmniParserError(f"OmniParser failed: {last_error}")
+    
+    def parse(self, image, box_threshold=0.05, iou_threshold=0.1, local_annotation=None):
+        """Parse a screenshot; returns (parsed_content, annotated PIL image)
+        
+        With local annotation (LOCAL_ANNOTATION by default) only the elements are
+        downloaded and the numbered boxes are drawn onto the local screenshot.
+        """
+        if local_annotation is None:
+            local_annotation = LOCAL_ANNOTATION
+        result = self.request(image, box_threshold, iou_threshold, return_image=not local_annotation)
+        parsed_content = result["parsed_content"]
+        print(f"✓ OmniParser found {len(parsed_content)} elements in {self.last_elapsed_ms:.0f}ms")
+        
+        if local_annotation:
+            screenshot = image.to_pil() if isinstance(image, ScreenFrame) else Image.open(image)
+            img = annotate_elements(screenshot, parsed_content)
+        else:
+            img = Image.open(io.BytesIO(base64.b64decode(result["image_base64"])))
+        save_annotated_image(img)
+        return parsed_content, img
+    
+    def warm(self):
+        """Open a pooled connection (TLS handshake included) ahead of the first parse"""
+        try:
+            self.session.head(self.url, timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f"⚠️ OmniParser warm-up failed: {e}")
+    
+    def close(self):
+        if self.session_key is None:  # Session views leave the shared pool open
+            self.session.close()
+
+
+def element_pixel_bbox(elem, width, height):
+    """(x1, y1, x2, y2) pixel bbox of an OmniParser element on a width x height screen
+    
+    Dict elements carry a normalized `bbox`; string elements embed pixel
+    coordinates as <box>x1,y1,x2,y2</box>. Returns None if there is no bbox.
+    """
+    if isinstance(elem, dict):
+        bbox = elem.get('bbox')
+        if bbox and len(bbox) == 4:
+            return (bbox[0] * width, bbox[1] * height, bbox[2] * width, bbox[3] * height)
+        return None
+    if isinstance(elem, str) and "<box>" in elem:
+        box_start = elem.find("<box>") + 5
+        box_end = elem.find("</box>")
+        x1, y1, x2, y2 = map(float, elem[box_start:box_end].split(','))
+        return (x1, y1, x2, y2)
+    return None
+
+
+class ElementStore:
+    """Parsed OmniParser elements in column form, built once per parse
+    
+    Element numbers are list positions, the labels drawn on the screenshot
+    (0-based). Boxes are float arrays in pixel and normalized coordinates with
+    precomputed centers and areas; elements without a bbox are NaN rows. A
+    uniform grid of CELL-pixel buckets answers hit-tests, nearest-element and
+    overlap queries by visiting only the cells around the query, and a
+    (type, text) index matches elements against the previous turn's store.
+    IncrementalParser placeholders keep their number but are not `present`:
+    they are not valid click targets, tracked or listed to the planner.
+    """
+    CELL = 64
+    
+    def __init__(self, elements, width, height):
+        self.elements = list(elements or [])
+        self.width, self.height = width, height
+        count = len(self.elements)
+        self.pixel = np.full((count, 4), np.nan)
+        self.boxes = []  # The same boxes as tuples, for the per-click lookup
+        self.types, self.texts = [], []
+        self.interactive = np.zeros(count, dtype=bool)
+        self.present = np.ones(count, dtype=bool)
+        for i, elem in enumerate(self.elements):
+            bbox = element_pixel_bbox(elem, width, height)
+            self.boxes.append(bbox)
+            if bbox is not None:
+                self.pixel[i] = bbox
+            if isinstance(elem, dict):
+                self.types.append(str(elem.get("type", "")))
+                self.texts.append(str(elem.get("content", "") or ""))
+                self.interactive[i] = bool(elem.get("interactivity"))
+                self.present[i] = elem.get("type") != IncrementalParser.REMOVED["type"]
+            else:
+                text = str(elem)
+                if "<box>" in text:
+                    text = text[:text.find("<box>")] + text[text.find("</box>") + 6:]
+                self.types.append("text")
+                self.texts.append(text.strip())
+        self.valid = ~np.isnan(self.pixel[:, 0])
+        scale = np.array([width, height, width, height], dtype=float) if width and height else np.full(4, np.nan)
+        self.normalized = self.pixel / scale
+        self.centers = np.column_stack(((self.pixel[:, 0] + self.pixel[:, 2]) / 2, (self.pixel[:, 1] + self.pixel[:, 3]) / 2))
+        self.areas = (self.pixel[:, 2] - self.pixel[:, 0]) * (self.pixel[:, 3] - self.pixel[:, 1])
+        self._cols = max(1, math.ceil(width / self.CELL)) if width else 1
+        self._rows = max(1, math.ceil(height / self.CELL)) if height else 1
+        self._grid = {}
+        for i in np.flatnonzero(self.valid):
+            cx1, cy1, cx2, cy2 = self._cell_range(self.pixel[i])
+            for cy in range(cy1, cy2 + 1):
+                for cx in range(cx1, cx2 + 1):
+                    self._grid.setdefault((cx, cy), []).append(i)
+        self.keys = [(kind, " ".join(text.lower().split())) for kind, text in zip(self.types, self.texts)]
+        self._by_key = {}
+        for i, key in enumerate(self.keys):
+            if self.present[i]:
+                self._by_key.setdefault(key, []).append(i)
+        self.ids = None  # Stable element IDs, filled in by ElementTracker
+    
+    def __len__(self):
+        return len(self.elements)
+    
+    def __getitem__(self, number):
+        return self.elements[number]
+    
+    def _cell_range(self, rect):
+        x1, y1, x2, y2 = rect
+        clamp = lambda v, limit: min(max(int(v // self.CELL), 0), limit - 1)
+        return clamp(x1, self._cols), clamp(y1, self._rows), clamp(x2, self._cols), clamp(y2, self._rows)
+    
+    def key(self, number):
+        """What identifies an element across parses regardless of position"""
+        return self.keys[number]
+    
+    def contains(self, number):
+        """True if `number` is the number of an element on this screen"""
+        return (isinstance(number, (int, np.integer)) and not isinstance(number, bool) and 0 <= number < len(self)
+                and bool(self.present[number]))
+    
+    def element_id(self, number):
+        """Stable ID of an element across turns, or None when untracked or out of range"""
+        if self.ids is None or not self.contains(number):
+            return None
+        return int(self.ids[number])
+    
+    def number_of(self, element_id):
+        """Current number of the element with a stable ID, or None if it is not on this screen"""
+        if self.ids is None or element_id is None or isinstance(element_id, bool):
+            return None
+        try:
+            found = np.flatnonzero((self.ids == int(element_id)) & self.present)
+        except (TypeError, ValueError):
+            return None
+        return int(found[0]) if len(found) else None
+    
+    def pixel_bbox(self, number, width=None, height=None):
+        """(x1, y1, x2, y2) in pixels, on a width x height screen if given; None without a bbox"""
+        bbox = self.boxes[number]
+        if bbox is None or ((width is None or width == self.width) and (height is None or height == self.height)):
+            return bbox
+        x1, y1, x2, y2 = self.normalized[number]
+        return (x1 * width, y1 * height, x2 * width, y2 * height)
+    
+    def center(self, number, width=None, height=None):
+        """Pixel center of an element, or None without a bbox"""
+        bbox = self.pixel_bbox(number, width, height)
+        return None if bbox is None else ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+    
+    def _candidates(self, rect):
+        cx1, cy1, cx2, cy2 = self._cell_range(rect)
+        found = set()
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                found.update(self._grid.get((cx, cy), ()))
+        return np.sort(np.fromiter(found, dtype=np.intp, count=len(found)))
+    
+    def at(self, x, y):
+        """Element numbers whose box contains the pixel (x, y), smallest box first"""
+        idx = self._candidates((x, y, x, y))
+        box = self.pixel[idx]
+        idx = idx[(box[:, 0] <= x) & (x <= box[:, 2]) & (box[:, 1] <= y) & (y <= box[:, 3])]
+        return [int(i) for i in idx[np.argsort(self.areas[idx], kind="stable")]]
+    
+    def overlapping(self, rect):
+        """Element numbers whose box intersects rect (x1, y1, x2, y2)"""
+        x1, y1, x2, y2 = rect
+        idx = self._candidates(rect)
+        box = self.pixel[idx]
+        return sorted(int(i) for i in idx[(box[:, 0] < x2) & (x1 < box[:, 2]) & (box[:, 1] < y2) & (y1 < box[:, 3])])
+    
+    def nearest(self, x, y, max_distance=None):
+        """Number of the element whose box is closest to (x, y) (0 if inside), or None
+        
+        Searches rings of grid cells outward and stops once no unvisited cell can
+        hold anything closer.
+        """
+        if not self.valid.any():
+            return None
+        col, row, _, _ = self._cell_range((x, y, x, y))
+        best, best_distance, seen = None, math.inf, set()
+        for ring in range(max(self._cols, self._rows) + 1):
+            cells = [(cx, cy) for cy in range(row - ring, row + ring + 1) for cx in range(col - ring, col + ring + 1)
+                     if max(abs(cx - col), abs(cy - row)) == ring]
+            idx = [i for cell in cells for i in self._grid.get(cell, ()) if i not in seen]
+            seen.update(idx)
+            if idx:
+                box = self.pixel[idx]
+                dx = np.maximum(np.maximum(box[:, 0] - x, x - box[:, 2]), 0)
+                dy = np.maximum(np.maximum(box[:, 1] - y, y - box[:, 3]), 0)
+                distance = np.hypot(dx, dy)
+                k = int(np.argmin(distance))
+                if distance[k] < best_distance:
+                    best, best_distance = int(idx[k]), float(distance[k])
+            if best_distance <= ring * self.CELL:
+                break
+        if max_distance is not None and best_distance > max_distance:
+            return None
+        return best
+    
+    def union(self):
+        """Pixel box around all elements, or None"""
+        if not self.valid.any():
+            return None
+        box = self.pixel[self.valid]
+        return (float(box[:, 0].min()), float(box[:, 1].min()), float(box[:, 2].max()), float(box[:, 3].max()))
+    
+    def match(self, previous):
+        """For each element, the number of the same element in `previous` (-1 if new)
+        
+        Elements pair up by (type, text); among equal candidates the one with the
+        nearest normalized center wins, so each lookup is a dict hit plus a short list.
+        """
+        matches = np.full(len(self), -1, dtype=np.intp)
+        if previous is None:
+            return matches
+        taken = set()
+        for i in np.flatnonzero(self.present):
+            candidates = [j for j in previous._by_key.get(self.key(i), ()) if j not in taken]
+            if not candidates:
+                continue
+            if len(candidates) > 1 and self.valid[i]:
+                here = (self.normalized[i, :2] + self.normalized[i, 2:]) / 2
+                there = (previous.normalized[candidates, :2] + previous.normalized[candidates, 2:]) / 2
+                distance = np.nan_to_num(np.hypot(*(there - here).T), nan=np.inf)
+                candidates = [candidates[int(np.argmin(distance))]]
+            matches[i] = candidates[0]
+            taken.add(candidates[0])
+        return matches
+    
+    def diff(self, previous):
+        """(added, removed) element counts against the previous store"""
+        matches = self.match(previous)
+        added = int(((matches < 0) & self.present).sum())
+        before = int(previous.present.sum()) if previous is not None else 0
+        return added, before - (int(self.present.sum()) - added)
+
+
+class ElementDelta:
+    """What changed between two tracked parses, in stable element IDs"""
+    def __init__(self, added, removed, moved, kept):
+        self.added = added  # IDs that are new on this screen
+        self.removed = removed  # IDs that were on the previous screen and are gone
+        self.moved = moved  # IDs whose center shifted by more than TRACK_MOVE_PX
+        self.kept = kept  # Number of elements matched to the previous screen
+    
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved)
+    
+    def summary(self):
+        return f"+{len(self.added)} / -{len(self.removed)} / {len(self.moved)} moved"
+
+
+class ElementTracker:
+    """Gives parsed elements IDs that survive re-parsing, and reports deltas
+    
+    OmniParser numbers elements afresh on every parse. Each new element is
+    scored against the previous parse's elements near it or with the same
+    (type, text) key: box IoU, text similarity and the cosine similarity of a
+    small grayscale thumbnail cut from the frame. Pairs above TRACK_MIN_SCORE
+    are matched greedily, best first; matched elements keep their ID, the rest
+    get new ones. IDs are written to `store.ids`.
+    """
+    WEIGHTS = (0.25, 0.55, 0.2)  # IoU, text, appearance
+    THUMBNAIL = 6
+    
+    def __init__(self, min_score=TRACK_MIN_SCORE, move_px=TRACK_MOVE_PX):
+        self.min_score = min_score
+        self.move_px = move_px
+        self.previous = None
+        self._embeddings = None
+        self._next_id = 1
+        self.stats = {"updates": 0, "matched": 0, "new": 0}
+    
+    def reset(self):
+        self.previous = None
+        self._embeddings = None
+    
+    def _embed(self, store, frame):
+        """Unit-length THUMBNAIL x THUMBNAIL green-channel thumbnails of every element (zeros without a frame)"""
+        size = self.THUMBNAIL
+        embeddings = np.zeros((len(store), size * size))
+        if frame is None or frame.size != (store.width, store.height) or not store.valid.any():
+            return embeddings
+        # Cell means from an integral image of a subsampled frame (about 960 columns), so a box shifted by
+        # a pixel or two still gives nearly the same thumbnail
+        stride = max(2, frame.width // 960)
+        green = frame.array[::stride, ::stride, 1]
+        integral = np.zeros((green.shape[0] + 1, green.shape[1] + 1))
+        integral[1:, 1:] = green.cumsum(axis=0, dtype=np.int64).cumsum(axis=1)
+        idx = np.flatnonzero(store.valid)
+        box = store.pixel[idx] / stride
+        steps = np.arange(size + 1) / size
+        xs = np.clip(box[:, 0:1] + (box[:, 2:3] - box[:, 0:1]) * steps, 0, green.shape[1]).astype(np.intp)
+        ys = np.clip(box[:, 1:2] + (box[:, 3:4] - box[:, 1:2]) * steps, 0, green.shape[0]).astype(np.intp)
+        xs[:, 1:] = np.maximum(xs[:, 1:], xs[:, :-1] + 1)
+        ys[:, 1:] = np.maximum(ys[:, 1:], ys[:, :-1] + 1)
+        xs, ys = np.minimum(xs, green.shape[1]), np.minimum(ys, green.shape[0])
+        y0, y1, x0, x1 = ys[:, :-1, None], ys[:, 1:, None], xs[:, None, :-1], xs[:, None, 1:]
+        sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        thumbs = (sums / np.maximum((y1 - y0) * (x1 - x0), 1)).reshape(len(idx), -1)
+        thumbs -= thumbs.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(thumbs, axis=1, keepdims=True)
+        embeddings[idx] = np.divide(thumbs, norms, out=np.zeros_like(thumbs), where=norms > 1e-6)
+        return embeddings
+    
+    def _scores(self, store, i, previous, candidates, embeddings):
+        """Match scores of element i against the `candidates` of the previous store"""
+        a, b = store.normalized[i], previous.normalized[candidates]
+        w = np.minimum(a[2], b[:, 2]) - np.maximum(a[0], b[:, 0])
+        h = np.minimum(a[3], b[:, 3]) - np.maximum(a[1], b[:, 1])
+        inter = np.where((w > 0) & (h > 0), w * h, 0.0)
+        union = (a[2] - a[0]) * (a[3] - a[1]) + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) - inter
+        iou = np.nan_to_num(inter / np.where(union > 0, union, np.nan))
+        here, there = embeddings[i], self._embeddings[candidates]
+        has_here, has_there = here.any(), there.any(axis=1)
+        look = np.where(has_there & has_here, np.maximum(there @ here, 0.0), (has_there == has_here).astype(float))
+        w_iou, w_text, w_look = self.WEIGHTS
+        scores = w_iou * iou + w_look * look
+        kind, text = store.keys[i]
+        for k, j in enumerate(candidates):
+            other_kind, other_text = previous.keys[j]
+            weight = w_text * (1.0 if other_kind == kind else 0.5)
+            if other_text == text:
+                scores[k] += weight
+            elif scores[k] + weight >= self.min_score:
+                # Only pairs that could still reach min_score pay for the edit-distance ratio
+                matcher = difflib.SequenceMatcher(None, text, other_text)
+                if scores[k] + weight * matcher.quick_ratio() >= self.min_score:
+                    scores[k] += weight * matcher.ratio()
+        # An element that jumped (no overlap) must also look the same, or any equal label would match
+        return np.where((iou == 0) & (look < 0.5), 0.0, scores)
+    
+    def update(self, store, frame=None):
+        """Assign IDs to `store` by matching it to the previous update; returns an ElementDelta"""
+        embeddings = self._embed(store, frame)
+        previous = self.previous
+        ids = np.zeros(len(store), dtype=np.int64)
+        matches = np.full(len(store), -1, dtype=np.intp)
+        if previous is not None and len(previous):
+            pairs = []
+            scale = np.array([previous.width, previous.height, previous.width, previous.height], dtype=float)
+            pad = self.move_px
+            for i in np.flatnonzero(store.present):
+                candidates = set(previous._by_key.get(store.keys[i], ()))
+                if store.valid[i]:
+                    x1, y1, x2, y2 = store.normalized[i] * scale
+                    candidates.update(previous.overlapping((x1 - pad, y1 - pad, x2 + pad, y2 + pad)))
+                if not candidates:
+                    continue
+                candidates = np.fromiter(candidates, dtype=np.intp, count=len(candidates))
+                scores = self._scores(store, i, previous, candidates, embeddings)
+                keep = scores >= self.min_score
+                pairs.extend(zip(scores[keep].tolist(), [i] * int(keep.sum()), candidates[keep].tolist()))
+            pairs.sort(key=lambda p: -p[0])
+            taken = set()
+            for score, i, j in pairs:
+                if matches[i] < 0 and j not in taken:
+                    matches[i] = j
+                    taken.add(j)
+        
+        added, moved = [], []
+        for i in np.flatnonzero(store.present):
+            j = matches[i]
+            if j < 0:
+                ids[i] = self._next_id
+                self._next_id += 1
+                added.append(int(ids[i]))
+                continue
+            ids[i] = previous.ids[j]
+            if store.valid[i] and previous.valid[j]:
+                here = store.center(i)
+                there = previous.center(j, store.width, store.height)
+                if math.hypot(here[0] - there[0], here[1] - there[1]) > self.move_px:
+                    moved.append(int(ids[i]))
+        kept = int((matches >= 0).sum())
+        removed = []
+        if previous is not None:
+            matched = set(matches[matches >= 0].tolist())
+            removed = [int(previous.ids[j]) for j in np.flatnonzero(previous.present) if j not in matched]
+        
+        store.ids = ids
+        self.previous, self._embeddings = store, embeddings
+        self.stats["updates"] += 1
+        self.stats["matched"] += kept
+        self.stats["new"] += len(added)
+        return ElementDelta(added, removed, moved, kept)
+
+
+def save_annotated_image(img):
+    """Write an annotated screenshot to disk when DEBUG_SAVE_SCREENSHOTS is set"""
+    if not DEBUG_SAVE_SCREENSHOTS:
+        return None
+    annotated_path = f"annotated_screen_{int(time.time() * 1000)}.png"
+    img.save(annotated_path)
+    print(f"✓ Annotated image saved: {annotated_path}")
+    return annotated_path
+
+
+class LabelPlacer:
+    """Places label rectangles so they do not overlap, using a coarse grid index"""
+    CELL = 64
+    
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._cells = {}
+    
+    def _cells_for(self, rect):
+        x1, y1, x2, y2 = rect
+        for cy in range(int(y1) // self.CELL, int(y2) // self.CELL + 1):
+            for cx in range(int(x1) // self.CELL, int(x2) // self.CELL + 1):
+                yield (cx, cy)
+    
+    def overlap(self, rect):
+        """Total area of `rect` covered by already placed labels"""
+        x1, y1, x2, y2 = rect
+        seen = set()
+        area = 0
+        for cell in self._cells_for(rect):
+            for other in self._cells.get(cell, ()):
+                if id(other) in seen:
+                    continue
+                seen.add(id(other))
+                w = min(x2, other[2]) - max(x1, other[0])
+                h = min(y2, other[3]) - max(y1, other[1])
+                if w > 0 and h > 0:
+                    area += w * h
+        return area
+    
+    def place(self, bbox, label_w, label_h):
+        """Pick the least-overlapping label position around an element bbox"""
+        x1, y1, x2, y2 = bbox
+        candidates = [
+            (x1, y1 - label_h),  # above, left-aligned (OmniParser's default)
+            (x1, y1),  # inside top-left
+            (x2 - label_w, y1 - label_h),  # above, right-aligned
+            (x1, y2),  # below, left-aligned
+            (x1 - label_w, y1),  # left of the box
+            (x2, y1),  # right of the box
+            (x2 - label_w, y2),  # below, right-aligned
+        ]
+        best, best_overlap = None, None
+        for lx, ly in candidates:
+            lx = min(max(0, lx), max(0, self.width - label_w))
+            ly = min(max(0, ly), max(0, self.height - label_h))
+            rect = (lx, ly, lx + label_w, ly + label_h)
+            overlap = self.overlap(rect)
+            if best is None or overlap < best_overlap:
+                best, best_overlap = rect, overlap
+            if overlap == 0:
+                break
+        for cell in self._cells_for(best):
+            self._cells.setdefault(cell, []).append(best)
+        return best
+
+
+def _label_font(image_height):
+    size = max(12, image_height // 80)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()  # Pillow < 10.1 has a single fixed-size bitmap font
+
+
+def annotate_elements(image, elements):
+    """Draw numbered element boxes onto a copy of a PIL image
+    
+    Labels are placed around each box so that they do not cover each other,
+    which keeps numbers legible when OmniParser returns dense clusters.
+    """
+    with tracer.span("annotate", elements=len(elements), width=image.width, height=image.height):
+        img = image.convert("RGB")
+        draw = ImageDraw.Draw(img)
+        font = _label_font(img.height)
+        placer = LabelPlacer(img.width, img.height)
+        palette = [(231, 76, 60), (52, 152, 219), (39, 174, 96), (155, 89, 182), (211, 84, 0), (22, 160, 133)]
+        for i, elem in enumerate(elements):
+            bbox = element_pixel_bbox(elem, img.width, img.height)
+            if bbox is None:
+                continue
+            color = palette[i % len(palette)]
+            x1, y1, x2, y2 = (int(v) for v in bbox)
+            draw.rectangle((x1, y1, x2, y2), outline=color, width=2)
+            label = str(i)
+            tx1, ty1, tx2, ty2 = draw.textbbox((0, 0), label, font=font)
+            pad = 2
+            lw, lh = tx2 - tx1 + 2 * pad, ty2 - ty1 + 2 * pad
+            lx1, ly1, lx2, ly2 = placer.place((x1, y1, x2, y2), lw, lh)
+            draw.rectangle((lx1, ly1, lx2, ly2), fill=color)
+            draw.text((lx1 + pad - tx1, ly1 + pad - ty1), label, fill=(255, 255, 255), font=font)
+        return img
+
+
+def _merge_rects(rects):
+    """Merge overlapping (x1, y1, x2, y2) rectangles until none overlap"""
+    rects = list(rects)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+class IncrementalParser:
+    """Re-parse only the parts of the screen that changed since the last parse.
+    
+    The new frame is diffed, every pixel, against a reference image of what
+    the current elements were parsed from; each changed region (padded for
+    context) is cropped and sent to OmniParser on its own, and the returned
+    elements are remapped to full-screen coordinates. Only the re-parsed
+    regions are copied into the reference, so small edits are never absorbed
+    unparsed. Elements that do not touch a change keep their numbers, and the
+    crop's copies of them are dropped; elements that changed leave a REMOVED
+    placeholder and new ones are appended, so a number never changes meaning
+    between full parses; a full parse numbers elements afresh and drops the
+    placeholders. Regions are copied into the reference only once every
+    region of the turn parsed. Falls back to a full parse on the first turn,
+    after large changes, when the frames differ but no tile is clearly dirty,
+    and every INCREMENTAL_FULL_PARSE_EVERY turns.
+    """
+    REMOVED = {"type": "removed", "bbox": None, "interactivity": False, "content": "(no longer on screen)"}
+    
+    def __init__(self, client, max_dirty_fraction=INCREMENTAL_MAX_DIRTY_FRACTION,
+                 padding=INCREMENTAL_CROP_PADDING, full_parse_every=INCREMENTAL_FULL_PARSE_EVERY):
+        self.client = client
+        self.max_dirty_fraction = max_dirty_fraction
+        self.padding = padding
+        self.full_parse_every = full_parse_every
+        self.detector = ChangeDetector(stride=1, tile_size=INCREMENTAL_TILE_SIZE,
+                                       tile_threshold=INCREMENTAL_TILE_THRESHOLD)
+        self._lock = threading.Lock()
+        self.reset()
+        self.stats = {"full": 0, "incremental": 0, "unchanged": 0, "regions": 0}
+    
+    def reset(self):
+        """Forget the last parse; the next call does a full parse"""
+        self._reference = None  # Writable BGRA copy of the pixels the current elements describe
+        self._last_elements = None
+        self._since_full = 0
+    
+    def remember(self, frame, elements):
+        """Use an externally obtained parse (e.g. a cache hit) as the new reference"""
+        with self._lock:
+            self._reference = frame.array.copy()
+            self._last_elements = list(elements)
+    
+    def _full_parse(self, frame):
+        elements, annotated_image = self.client.parse(frame)
+        self._reference = frame.array.copy()
+        self._last_elements = list(elements)
+        self._since_full = 0
+        self.stats["full"] += 1
+        return elements, annotated_image
+    
+    def _dirty_regions(self, frame, store):
+        """(numbers of the elements touching a change, crop regions), or None if a full parse is needed
+        
+        Crops cover each change plus the whole box of every element it touches,
+        padded and merged, so replaced elements are parsed in full.
+        """
+        result = self.detector.compare(self._reference, frame, find_regions=True)
+        if result.score > 0 and not result.regions:
+            print("🔄 Screen changed below the tile threshold - full OmniParser parse")
+            return None
+        stale = set()
+        for region in result.regions:
+            stale.update(store.overlapping(region))
+        p = self.padding
+        rects = list(result.regions) + [tuple(int(round(v)) for v in store.pixel[i]) for i in sorted(stale)]
+        regions = _merge_rects(
+            (max(0, x1 - p), max(0, y1 - p), min(frame.width, x2 + p), min(frame.height, y2 + p))
+            for x1, y1, x2, y2 in rects
+        )
+        area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+        if area > self.max_dirty_fraction * frame.width * frame.height:
+            print("🔄 Large screen change - full OmniParser parse")
+            return None
+        return stale, regions
+    
+    @staticmethod
+    def _duplicates_kept(bbox, crop, kept, width, height):
+        """True if a crop element is a copy of a kept element (same box, or clipped by the crop edge)"""
+        x1, y1, x2, y2 = bbox
+        cx1, cy1, cx2, cy2 = crop
+        clipped = ((x1 <= cx1 + 1 and cx1 > 0) or (y1 <= cy1 + 1 and cy1 > 0)
+                   or (x2 >= cx2 - 1 and cx2 < width) or (y2 >= cy2 - 1 and cy2 < height))
+        area = (x2 - x1) * (y2 - y1)
+        for i in kept.overlapping(bbox):
+            kx1, ky1, kx2, ky2 = kept.pixel[i]
+            inter = max(0.0, min(x2, kx2) - max(x1, kx1)) * max(0.0, min(y2, ky2) - max(y1, ky1))
+            if clipped or inter / (area + kept.areas[i] - inter) >= 0.5:
+                return True
+        return False
+    
+    def parse(self, frame):
+        """Parse `frame`, incrementally when possible; returns (elements, annotated image)"""
+        with self._lock:
+            last = self._last_elements
+            if (last is None or self._reference.shape[:2] != (frame.height, frame.width)
+                    or self._since_full >= self.full_parse_every
+                    or not all(isinstance(e, dict) for e in last)):
+                return self._full_parse(frame)
+            
+            width, height = frame.size
+            store = ElementStore(last, width, height)
+            dirty = self._dirty_regions(frame, store)
+            if dirty is None:
+                return self._full_parse(frame)
+            stale, regions = dirty
+            
+            if not regions:
+                self.stats["unchanged"] += 1
+                merged = list(last)
+            else:
+                # Elements touching an actual change are replaced; the rest keep their numbers
+                kept = ElementStore([e for i, e in enumerate(last) if i not in stale and store.valid[i]], width, height)
+                
+                new_elements = []
+                for x1, y1, x2, y2 in regions:
+                    crop = frame.crop((x1, y1, x2, y2))
+                    result = self.client.request(crop, return_image=False)
+                    cw, ch = crop.size
+                    for elem in result["parsed_content"]:
+                        if not isinstance(elem, dict) or not elem.get("bbox"):
+                            continue
+                        bx1, by1, bx2, by2 = elem["bbox"]
+                        bbox = (x1 + bx1 * cw, y1 + by1 * ch, x1 + bx2 * cw, y1 + by2 * ch)
+                        if self._duplicates_kept(bbox, (x1, y1, x2, y2), kept, width, height):
+                            continue
+                        remapped = dict(elem)
+                        remapped["bbox"] = [bbox[0] / width, bbox[1] / height, bbox[2] / width, bbox[3] / height]
+                        new_elements.append(remapped)
+                
+                # Only now that every region parsed: a failed crop leaves the reference and elements
+                # untouched, so the next call diffs (and re-parses) all of these regions again
+                for x1, y1, x2, y2 in regions:
+                    self._reference[y1:y2, x1:x2] = frame.array[y1:y2, x1:x2]
+                # Changed elements leave a placeholder so no number is reused for different content
+                merged = [dict(self.REMOVED) if i in stale else elem for i, elem in enumerate(last)]
+                merged.extend(new_elements)
+                
+                self.stats["incremental"] += 1
+                self.stats["regions"] += len(regions)
+                on_screen = sum(e.get("type") != self.REMOVED["type"] for e in merged)
+                print(f"✓ Incremental parse: {len(regions)} region(s), {len(stale)} replaced, "
+                      f"{len(new_elements)} new element(s), {on_screen} on screen")
+            
+            self._last_elements = merged
+            self._since_full += 1
+        
+        # Server annotations of the crops carry crop-local numbers, so annotate locally
+        img = annotate_elements(frame.to_pil(), merged)
+        save_annotated_image(img)
+        return merged, img
+
+
+_default_omniparser = None
+
+
+def call_omniparser(image, box_threshold=0.05, iou_threshold=0.1):
+    """Call OmniParser API and return (parsed results, annotated image path), or (None, None) on failure
+    
+    `image` may be a ScreenFrame (encoded in memory) or a path to an image file.
+    """
+    global _default_omniparser
+    if _default_omniparser is None:
+        _default_omniparser = OmniParserClient()
+    try:
+        parsed_content, img = _default_omniparser.parse(image, box_threshold, iou_threshold)
+        timestamp = int(time.time() * 1000)
+        annotated_path = f"annotated_screen_{timestamp}.png"
+        img.save(annotated_path)
+        return parsed_content, annotated_path
+    except Exception as e:
+        print(f"⚠️ Error calling OmniParser: {e}")
+        return None, None
+
+
+def compare_screenshots(img1_path, img2_path, threshold=SCREEN_CHANGE_THRESHOLD):
+    """Compare two screenshots and return if they differ significantly"""
+    try:
+        img1 = Image.open(img1_path).convert('RGB')
+        img2 = Image.open(img2_path).convert('RGB')
+        
+        # Resize to same size if different
+        if img1.size != img2.size:
+            img2 = img2.resize(img1.size)
+        
+        # Convert to numpy arrays
+        arr1 = np.array(img1)
+        arr2 = np.array(img2)
+        
+        # Calculate difference
+        diff = np.abs(arr1.astype(float) - arr2.astype(float))
+        mean_diff = np.mean(diff) / 255.0  # Normalize to 0-1
+        
+        changed = mean_diff > threshold
+        print(f"📊 Screen difference: {mean_diff*100:.2f}% (threshold: {threshold*100:.0f}%)")
+        
+        return changed, mean_diff
+    except Exception as e:
+        print(f"⚠️ Error comparing screenshots: {e}")
+        return True, 1.0  # Assume changed on error
+
+
+class ChangeResult:
+    """Outcome of a ChangeDetector comparison"""
+    def __init__(self, changed, score, regions, tile_mask, early_exit=False, elapsed_ms=0.0):
+        self.changed = changed  # True when score exceeds the detector threshold
+        self.score = score  # Mean absolute difference, normalized to 0-1 (a lower bound on early exit)
+        self.regions = regions  # Merged changed rectangles (x1, y1, x2, y2) in frame pixels
+        self.tile_mask = tile_mask  # Boolean grid of tiles whose own score exceeded tile_threshold
+        self.early_exit = early_exit
+        self.elapsed_ms = elapsed_ms
+    
+    def __repr__(self):
+        return (f"ChangeResult(changed={self.changed}, score={self.score:.4f}, "
+                f"regions={len(self.regions)}, early_exit={self.early_exit})")
+
+
+class ChangeDetector:
+    """Fast screen-change detection on in-memory uint8 frames.
+    
+    Frames are sampled every `stride` pixels and copied as packed 32-bit BGRA
+    words into preallocated scratch buffers that are reused between checks.
+    The absolute difference is computed in uint8 and reduced per tile, so the
+    changed regions can be reported; when regions are not needed the scan
+    stops as soon as the global threshold is guaranteed to be exceeded.
+    
+    Not thread-safe: give each polling thread its own detector.
+    """
+    BAND_TILE_ROWS = 4  # Tile rows processed per band before checking for early exit
+    ALPHA_MASK = np.uint32(0xFF000000)  # Alpha byte of a little-endian BGRA word
+    
+    def __init__(self, threshold=SCREEN_CHANGE_THRESHOLD, stride=CHANGE_DETECT_STRIDE,
+                 tile_size=CHANGE_TILE_SIZE, tile_threshold=CHANGE_TILE_THRESHOLD):
+        self.threshold = threshold
+        self.stride = max(1, int(stride))
+        self.tile_size = max(1, int(tile_size))
+        self.tile_threshold = tile_threshold
+        self._shape = None
+    
+    def _ensure_buffers(self, height, width):
+        """(Re)allocate scratch buffers for a sampled frame of the given size"""
+        tiles_y = -(-height // self.tile_size)
+        tiles_x = -(-width // self.tile_size)
+        if self._shape != (height, width):
+            self._shape = (height, width)
+            # Sample buffers are padded to whole tiles (padding stays zero) so edge
+            # tiles reduce with a plain reshape; difference buffers cover one band
+            padded = (tiles_y * self.tile_size, tiles_x * self.tile_size)
+            band = (self.BAND_TILE_ROWS * self.tile_size, padded[1], 4)
+            self._sample1 = np.zeros(padded, dtype=np.uint32)
+            self._sample2 = np.zeros(padded, dtype=np.uint32)
+            self._diff1 = np.empty(band, dtype=np.uint8)
+            self._diff2 = np.empty(band, dtype=np.uint8)
+        return tiles_y, tiles_x
+    
+    @staticmethod
+    def _as_words(frame):
+        """(height, width) uint32 view of a ScreenFrame or HxWx4 BGRA uint8 array"""
+        arr = frame.array if isinstance(frame, ScreenFrame) else np.ascontiguousarray(frame)
+        if arr.ndim != 3 or arr.shape[2] != 4:
+            raise ValueError(f"Expected an HxWx4 BGRA frame, got shape {arr.shape}")
+        return arr.view(np.uint32).reshape(arr.shape[0], arr.shape[1])
+    
+    def compare(self, frame1, frame2, find_regions=True):
+        """Compare two ScreenFrames (or HxWx4 BGRA arrays) and return a ChangeResult"""
+        start = time.perf_counter()
+        words1 = self._as_words(frame1)
+        words2 = self._as_words(frame2)
+        
+        if words1.shape != words2.shape:
+            # Different geometry (e.g. resolution change) always counts as changed
+            h, w = words2.shape
+            return ChangeResult(True, 1.0, [(0, 0, w, h)], None,
+                                elapsed_ms=(time.perf_counter() - start) * 1000)
+        
+        s = self.stride
+        a = words1[::s, ::s]
+        height, width = a.shape
+        tiles_y, tiles_x = self._ensure_buffers(height, width)
+        t = self.tile_size
+        
+        # Strided 4-byte copies are cheap; forcing alpha keeps it out of the score
+        np.copyto(self._sample1[:height, :width], a)
+        np.copyto(self._sample2[:height, :width], words2[::s, ::s])
+        np.bitwise_or(self._sample1, self.ALPHA_MASK, out=self._sample1)
+        np.bitwise_or(self._sample2, self.ALPHA_MASK, out=self._sample2)
+        
+        full_scale = float(height * width * 3 * 255)
+        limit = self.threshold * full_scale
+        tile_sums = np.zeros((tiles_y, tiles_x), dtype=np.int64)
+        total = 0
+        early_exit = False
+        
+        band = self.BAND_TILE_ROWS * t
+        padded_height = tiles_y * t
+        for y0 in range(0, padded_height, band):
+            y1 = min(y0 + band, padded_height)
+            rows = (y1 - y0) // t
+            b1 = self._sample1[y0:y1].view(np.uint8).reshape(y1 - y0, -1, 4)
+            b2 = self._sample2[y0:y1].view(np.uint8).reshape(y1 - y0, -1, 4)
+            d1 = self._diff1[:y1 - y0]
+            d2 = self._diff2[:y1 - y0]
+            # |a - b| in uint8 without widening: max(a, b) - min(a, b)
+            np.maximum(b1, b2, out=d1)
+            np.minimum(b1, b2, out=d2)
+            np.subtract(d1, d2, out=d1)
+            
+            row_tiles = d1.reshape(y1 - y0, tiles_x, t * 4).sum(axis=2, dtype=np.uint32)
+            band_tiles = row_tiles.reshape(rows, t, tiles_x).sum(axis=1)
+            tile_sums[y0 // t:y0 // t + rows] = band_tiles
+            total += int(band_tiles.sum())
+            
+            if not find_regions and total > limit:
+                early_exit = True
+                break
+        
+        score = total / full_scale
+        tile_mask = tile_sums / float(t * t * 3 * 255) > self.tile_threshold
+        regions = self._merge_regions(tile_mask, words1.shape[1], words1.shape[0]) if find_regions else []
+        
+        return ChangeResult(score > self.threshold, score, regions, tile_mask, early_exit,
+                            (time.perf_counter() - start) * 1000)
+    
+    def _merge_regions(self, tile_mask, frame_width, frame_height):
+        """Merge 4-connected changed tiles into bounding rectangles in frame pixels"""
+        regions = []
+        if not tile_mask.any():
+            return regions
+        
+        scale = self.tile_size * self.stride
+        seen = np.zeros_like(tile_mask)
+        for ty, tx in zip(*np.nonzero(tile_mask)):
+            if seen[ty, tx]:
+                continue
+            stack = [(ty, tx)]
+            seen[ty, tx] = True
+            y_min = y_max = ty
+            x_min = x_max = tx
+            while stack:
+                cy, cx = stack.pop()
+                y_min, y_max = min(y_min, cy), max(y_max, cy)
+                x_min, x_max = min(x_min, cx), max(x_max, cx)
+                for ny, nx in ((cy - 1, cx), (cy + 1, cx), (cy, cx - 1), (cy, cx + 1)):
+                    if (0 <= ny < tile_mask.shape[0] and 0 <= nx < tile_mask.shape[1]
+                            and tile_mask[ny, nx] and not seen[ny, nx]):
+                        seen[ny, nx] = True
+                        stack.append((ny, nx))
+            regions.append((
+                int(x_min * scale), int(y_min * scale),
+                int(min((x_max + 1) * scale, frame_width)), int(min((y_max + 1) * scale, frame_height))
+            ))
+        return regions
+
+
+class SettleDetector:
+    """Decides when the screen has settled, treating it as a time series of frame differences.
+    
+    In the "waiting" phase each poll is compared with the baseline until the
+    change starts (optionally polling only a region, with a full check every
+    FULL_CHECK_EVERY polls). In the "changing" phase consecutive full frames are
+    compared tile by tile until SETTLE_QUIET_FRAMES polls in a row show no
+    movement. Tiles that keep changing (spinners, blinking cursors, progress
+    bars) are masked once they changed in SETTLE_ANIMATION_HITS of the last
+    2 * SETTLE_ANIMATION_HITS polls, as long as they cover a small part of the screen. The poll interval
+    drops to the minimum while the screen moves and backs off while it is still.
+    
+    Pure logic with caller-supplied timestamps, so recorded frame sequences can
+    be replayed through it (see `benchmark.py settle`).
+    """
+    WAITING, CHANGING, SETTLED, TIMEOUT = "waiting", "changing", "settled", "timeout"
+    
+    def __init__(self, baseline=None, region=None, expect_change=True,
+                 change_timeout_ms=MAX_WAIT_FOR_CHANGE, settle_timeout_ms=SETTLE_MAX_MS,
+                 min_interval_ms=SETTLE_MIN_INTERVAL_MS, max_interval_ms=SETTLE_MAX_INTERVAL_MS,
+                 quiet_frames=SETTLE_QUIET_FRAMES, quiet_ms=SETTLE_QUIET_MS,
+                 quiet_fraction=SETTLE_QUIET_FRACTION, animation_hits=SETTLE_ANIMATION_HITS,
+                 animation_max_fraction=SETTLE_ANIMATION_MAX_FRACTION):
+        self.baseline = baseline
+        self.baseline_roi = None
+        self.region = None
+        if baseline is not None and region is not None:
+            self.region = region
+            self.baseline_roi = baseline.crop(region)
+        self.change_timeout_ms = change_timeout_ms
+        self.settle_timeout_ms = settle_timeout_ms
+        self.min_interval_ms = min_interval_ms
+        self.max_interval_ms = max_interval_ms
+        self.quiet_frames = quiet_frames
+        self.quiet_ms = quiet_ms
+        self.quiet_fraction = quiet_fraction
+        self.animation_hits = animation_hits
+        self.animation_max_fraction = animation_max_fraction
+        self.change_detector = ChangeDetector()
+        self.motion_detector = ChangeDetector(tile_threshold=SETTLE_TILE_THRESHOLD)
+        
+        self.state = self.WAITING if expect_change and baseline is not None else self.CHANGING
+        self.interval_ms = min_interval_ms
+        self.polls = 0
+        self.score = 0.0  # Difference from the baseline when the change was detected
+        self.frame = None  # Latest full frame
+        self.start_ms = None
+        self.change_ms = None  # When the change was first seen
+        self.last_motion_ms = None  # Last poll that still showed movement
+        self.settled_ms = None
+        self.forced = False  # Settled by SETTLE_MAX_MS rather than by quiescence
+        self._roi_poll = False
+        self._prev = None
+        self._prev_ms = None
+        self._quiet = 0
+        self._quiet_since = None
+        self._recent = deque(maxlen=2 * animation_hits)
+        self._animated = None
+    
+    @property
+    def animated_fraction(self):
+        return float(self._animated.mean()) if self._animated is not None else 0.0
+    
+    def start(self, now_ms):
+        self.start_ms = now_ms
+        if self.state == self.CHANGING:
+            self.change_ms = now_ms
+    
+    def next_region(self):
+        """Region to grab for the next poll, or None for the full screen"""
+        self._roi_poll = (self.state == self.WAITING and self.baseline_roi is not None
+                          and (self.polls + 1) % FULL_CHECK_EVERY != 0)
+        return self.region if self._roi_poll else None
+    
+    def _back_off(self):
+        self.interval_ms = min(self.max_interval_ms, self.interval_ms * 1.5)
+    
+    def feed(self, frame, now_ms):
+        """Process one poll (a region grab if next_region() asked for one); returns the state"""
+        if self.start_ms is None:
+            self.start(now_ms)
+        self.polls += 1
+        roi, self._roi_poll = self._roi_poll, False
+        if self.state == self.WAITING:
+            self._feed_waiting(frame, now_ms, roi)
+        elif self.state == self.CHANGING:
+            self._feed_changing(frame, now_ms)
+        return self.state
+    
+    def _feed_waiting(self, frame, now_ms, roi):
+        result = self.change_detector.compare(self.baseline_roi if roi else self.baseline, frame,
+                                              find_regions=False)
+        self.score = result.score
+        if not roi:
+            self.frame = frame
+        if result.changed:
+            self.state = self.CHANGING
+            self.change_ms = self.last_motion_ms = now_ms
+            self.interval_ms = self.min_interval_ms
+            if not roi:
+                self._prev, self._prev_ms = frame, now_ms
+        elif now_ms - self.start_ms >= self.change_timeout_ms:
+            self.state = self.TIMEOUT
+        else:
+            self._back_off()
+    
+    def _feed_changing(self, frame, now_ms):
+        self.frame = frame
+        prev, prev_ms = self._prev, self._prev_ms
+        self._prev, self._prev_ms = frame, now_ms
+        if prev is None:
+            moving = False
+            self._quiet_since = now_ms
+        else:
+            result = self.motion_detector.compare(prev, frame, find_regions=True)
+            mask = result.tile_mask
+            if mask is None:
+                moving = True  # Geometry changed
+            else:
+                if self._animated is None or self._animated.shape != mask.shape:
+                    self._recent.clear()
+                    self._animated = np.zeros(mask.shape, dtype=bool)
+                self._recent.append(mask)
+                if len(self._recent) >= self.animation_hits:
+                    self._animated |= np.sum(self._recent, axis=0) >= self.animation_hits
+                active = mask
+                if self._animated.mean() <= self.animation_max_fraction:
+                    active = mask & ~self._animated
+                moving = active.mean() > self.quiet_fraction
+        
+        if moving:
+            self._quiet = 0
+            self._quiet_since = None
+            self.last_motion_ms = now_ms
+            self.interval_ms = self.min_interval_ms
+        elif prev is not None:
+            self._quiet += 1
+            if self._quiet_since is None:
+                self._quiet_since = prev_ms
+            self._back_off()
+            if self._quiet >= self.quiet_frames and now_ms - self._quiet_since >= self.quiet_ms:
+                self.state = self.SETTLED
+                self.settled_ms = now_ms
+                return
+        
+        if now_ms - self.change_ms >= self.settle_timeout_ms:
+            self.state = self.SETTLED
+            self.settled_ms = now_ms
+            self.forced = True
+
+
+class ScreenWaitResult:
+    """Outcome of one ScreenWatcher.wait(): "changed", "timeout" or "error" """
+    def __init__(self, outcome, frame=None, score=0.0, error=None):
+        self.outcome = outcome
+        self.frame = frame  # Settled full frame (for "changed")
+        self.score = score
+        self.error = error
+
+
+class ScreenWatcher:
+    """Waits for the screen to change (and settle) without blocking an event loop.
+    
+    Captures and frame comparisons run on one worker thread, which keeps a
+    persistent capture session (through CaptureService); the polling loop is a
+    coroutine, so a wait is abandoned by cancelling its task. With a region
+    (monitor-relative x1, y1, x2, y2) only that area is polled, plus a
+    full-screen check every FULL_CHECK_EVERY polls.
+    """
+    def __init__(self, capture):
+        self.capture = capture
+        self.detector = ChangeDetector()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screen-watch")
+    
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+    
+    def warm(self):
+        """Open the watcher thread's capture session ahead of the first wait; returns a future"""
+        return self._executor.submit(lambda: self.capture.monitor)
+    
+    async def grab(self, region=None):
+        """Capture on the watcher thread"""
+        return await self._call(self.capture.grab, region)
+    
+    async def wait(self, baseline, region=None, expect_change=True, on_check=None):
+        """Wait for the screen to differ from `baseline`; returns a ScreenWaitResult
+        
+        With ADAPTIVE_SETTLE the screen must also stop changing; `expect_change=False`
+        only waits for it to be still. `on_check(check_count, score, remaining_ms)`
+        is called after each poll that has not seen a change yet.
+        """
+        try:
+            if ADAPTIVE_SETTLE:
+                return await self._wait_settle(baseline, region, expect_change, on_check)
+            return await self._wait_fixed(baseline, region, on_check)
+        except Exception as e:
+            return ScreenWaitResult("error", error=str(e))
+    
+    def _watch_region(self, baseline, region):
+        """Clipped region, or None when the baseline cannot be compared region by region"""
+        if baseline is None or region is None:
+            return None
+        try:
+            region = self.capture.clip_region(region)
+            if baseline.size == (self.capture.monitor["width"], self.capture.monitor["height"]):
+                return region
+        except Exception as e:
+            print(f"⚠️ Region watch unavailable, checking full screen: {e}")
+        return None
+    
+    def _poll_settle(self, settle, start_time):
+        frame = self.capture.grab(settle.next_region())
+        frame.debug_save("temp_check_screen.png")
+        if settle.baseline is None:
+            return frame, None
+        return frame, settle.feed(frame, (time.time() - start_time) * 1000)
+    
+    async def _wait_settle(self, baseline, region, expect_change, on_check):
+        """Poll with a SettleDetector until the screen settles or the wait times out"""
+        region = await self._call(self._watch_region, baseline, region)
+        settle = SettleDetector(baseline, region, expect_change)
+        start_time = time.time()
+        settle.start(0.0)
+        
+        while True:
+            await asyncio.sleep(settle.interval_ms / 1000.0)
+            frame, state = await self._call(self._poll_settle, settle, start_time)
+            if state is None:
+                # Nothing to compare against yet: this frame becomes the baseline
+                return ScreenWaitResult("changed", frame, 1.0)
+            if state == SettleDetector.SETTLED:
+                print(f"✓ Screen settled after {settle.settled_ms:.0f}ms ({settle.polls} polls"
+                      f"{', forced' if settle.forced else ''}"
+                      f"{f', {settle.animated_fraction*100:.1f}% masked as animation' if settle.animated_fraction else ''})")
+                return ScreenWaitResult("changed", settle.frame, settle.score)
+            if state == SettleDetector.TIMEOUT:
+                return ScreenWaitResult("timeout")
+            if state == SettleDetector.WAITING and on_check is not None:
+                remaining_ms = int(MAX_WAIT_FOR_CHANGE - (time.time() - start_time) * 1000)
+                on_check(settle.polls, settle.score, remaining_ms)
+    
+    def _poll_fixed(self, baseline, baseline_roi, region):
+        frame = self.capture.grab(region if baseline_roi is not None else None)
+        frame.debug_save("temp_check_screen.png")
+        if baseline is None:
+            return frame, None
+        result = self.detector.compare(baseline if baseline_roi is None else baseline_roi, frame,
+                                       find_regions=False)
+        if result.changed and baseline_roi is not None:
+            frame = self.capture.grab()  # The next baseline must be a full frame
+        return frame, result
+    
+    async def _wait_fixed(self, baseline, region, on_check):
+        """Poll every POLL_INTERVAL_MS until the screen changes or MAX_WAIT_FOR_CHANGE passes"""
+        start_time = time.time()
+        check_count = 0
+        await asyncio.sleep(INITIAL_CHECK_DELAY_MS / 1000.0)
+        region = await self._call(self._watch_region, baseline, region)
+        baseline_roi = baseline.crop(region) if region is not None else None
+        
+        while True:
+            check_count += 1
+            elapsed_ms = (time.time() - start_time) * 1000
+            if elapsed_ms > MAX_WAIT_FOR_CHANGE:
+                return ScreenWaitResult("timeout")
+            
+            use_region = baseline_roi is not None and check_count % FULL_CHECK_EVERY != 0
+            frame, result = await self._call(self._poll_fixed, baseline, baseline_roi if use_region else None,
+                                             region)
+            if result is None:
+                # Nothing to compare against yet: this frame becomes the baseline
+                return ScreenWaitResult("changed", frame, 1.0)
+            if result.changed:
+                return ScreenWaitResult("changed", frame, result.score)
+            if on_check is not None:
+                on_check(check_count, result.score, int(MAX_WAIT_FOR_CHANGE - elapsed_ms))
+            await asyncio.sleep(POLL_INTERVAL_MS / 1000.0)
+    
+    def close(self):
+        """Close the worker thread's capture session and stop the worker"""
+        self._executor.submit(self.capture.close_thread_session)
+        self._executor.shutdown(wait=True)
+
+
+class UploadImagePolicy:
+    """Prepares the annotated screenshot that is uploaded to Gemini.
+    
+    Optionally crops to the union of element bboxes, downscales to a target
+    long edge and encodes as JPEG/WebP/PNG. When the raw screenshot is
+    available the element labels are redrawn after resizing, so numbers stay
+    legible instead of being shrunk with the image.
+    """
+    MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+    
+    def __init__(self, max_long_edge=UPLOAD_MAX_LONG_EDGE, fmt=UPLOAD_FORMAT, quality=UPLOAD_QUALITY,
+                 crop_to_elements=UPLOAD_CROP_TO_ELEMENTS, crop_padding=UPLOAD_CROP_PADDING):
+        self.max_long_edge = max_long_edge
+        self.fmt = fmt.upper()
+        if self.fmt not in self.MIME_TYPES:
+            raise ValueError(f"Unsupported upload format: {fmt}")
+        self.quality = quality
+        self.crop_to_elements = crop_to_elements
+        self.crop_padding = crop_padding
+    
+    def _crop_box(self, elements, width, height):
+        """Padded union of all element bboxes, or None if there is nothing to crop to"""
+        union = ElementStore(elements, width, height).union()
+        if union is None:
+            return None
+        p = self.crop_padding
+        return (max(0, int(union[0]) - p), max(0, int(union[1]) - p),
+                min(width, int(union[2]) + p), min(height, int(union[3]) + p))
+    
+    @staticmethod
+    def _remap_elements(elements, box, width, height):
+        """Express normalized element bboxes relative to a crop box"""
+        x1, y1, x2, y2 = box
+        cw, ch = x2 - x1, y2 - y1
+        remapped = []
+        for elem in elements:
+            bbox = element_pixel_bbox(elem, width, height)
+            if bbox is None:
+                remapped.append(elem)
+                continue
+            copy = dict(elem) if isinstance(elem, dict) else {"content": elem}
+            copy["bbox"] = [(bbox[0] - x1) / cw, (bbox[1] - y1) / ch, (bbox[2] - x1) / cw, (bbox[3] - y1) / ch]
+            remapped.append(copy)
+        return remapped
+    
+    def _downscale(self, img, resample):
+        long_edge = max(img.size)
+        if self.max_long_edge and long_edge > self.max_long_edge:
+            factor = long_edge // self.max_long_edge
+            if factor >= 2:
+                # Integer box reduction is several times cheaper than a full resample
+                img = img.reduce(factor)
+            if max(img.size) > self.max_long_edge:
+                scale = self.max_long_edge / float(max(img.size))
+                img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), resample)
+        return img
+    
+    def prescale(self, screenshot):
+        """Downscale the raw screenshot before the elements are known
+        
+        Lets the resize run while OmniParser is still working. Returns None when
+        the policy needs the elements first (cropping) or labels are not redrawn.
+        """
+        if screenshot is None or self.crop_to_elements or not LOCAL_ANNOTATION:
+            return None
+        img = screenshot.to_pil() if isinstance(screenshot, ScreenFrame) else screenshot
+        return self._downscale(img, Image.BILINEAR)
+    
+    def prepare(self, annotated_image, elements=None, screenshot=None, prescaled=None):
+        """Return (content part for generate_content, stats dict)"""
+        with tracer.span("upload_prepare") as span:
+            part, stats = self._prepare(annotated_image, elements, screenshot, prescaled)
+            span.update(stats)
+        return part, stats
+    
+    def _prepare(self, annotated_image, elements, screenshot, prescaled):
+        start = time.perf_counter()
+        box = None
+        if prescaled is not None and elements is not None:
+            img, redraw = prescaled, True
+        else:
+            redraw = screenshot is not None and elements is not None and LOCAL_ANNOTATION
+            img = screenshot.to_pil() if redraw and isinstance(screenshot, ScreenFrame) else (
+                screenshot if redraw else annotated_image)
+            width, height = img.size
+            
+            box = self._crop_box(elements, width, height) if self.crop_to_elements else None
+            if box and box != (0, 0, width, height):
+                img = img.crop(box)
+                if redraw:
+                    elements = self._remap_elements(elements, box, width, height)
+            img = self._downscale(img, Image.BILINEAR if redraw else Image.LANCZOS)
+        if redraw:
+            img = annotate_elements(img, elements)
+        resize_ms = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        buf = io.BytesIO()
+        if self.fmt == "PNG":
+            img.save(buf, format="PNG", compress_level=SCREENSHOT_PNG_COMPRESS_LEVEL)
+        else:
+            img.convert("RGB").save(buf, format=self.fmt, quality=self.quality)
+        data = buf.getvalue()
+        encode_ms = (time.perf_counter() - start) * 1000
+        
+        stats = {"format": self.fmt, "width": img.width, "height": img.height, "bytes": len(data),
+                 "resize_ms": resize_ms, "encode_ms": encode_ms, "cropped": bool(box)}
+        return {"mime_type": self.MIME_TYPES[self.fmt], "data": data}, stats
+
+
+def extract_json_response(response_text):
+    """Strip markdown code fences from a model response and parse the JSON inside"""
+    with tracer.span("json_extract", chars=len(response_text)) as span:
+        if "```json" in response_text:
+            json_start = response_text.find("```json") + 7
+            json_end = response_text.find("```", json_start)
+            response_text = response_text[json_start:json_end].strip()
+        elif "```" in response_text:
+            json_start = response_text.find("```") + 3
+            json_end = response_text.find("```", json_start)
+            response_text = response_text[json_start:json_end].strip()
+    
+        try:
+            result = json.loads(response_text)
+            span["steps"] = len(result.get("steps", [])) if isinstance(result, dict) else 0
+            return result, response_text
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Could not parse JSON: {response_text}\nError: {e}")
+
+
+class TokenCounter:
+    """Token counts for planner prompts, calibrated against the model's tokenizer
+    
+    `count` is instant (characters / chars-per-token ratio). Every `every`-th
+    prompt of a kind passed to `due` is also counted with `measure` (the
+    model's count_tokens) off the critical path, and that kind's ratio follows
+    the measurements. Kinds ("full" and "compact" element lists) have their
+    own ratios because their text tokenizes differently.
+    """
+    def __init__(self, measure=None, chars_per_token=4.0, every=PROMPT_MEASURE_EVERY):
+        self.measure = measure
+        self.chars_per_token = chars_per_token
+        self.every = every
+        self.ratios = {}  # kind -> measured chars per token
+        self._seen = {}
+        self._lock = threading.Lock()
+        self.stats = {"measured": 0, "last_tokens": None, "errors": 0}
+    
+    def count(self, text, kind=None):
+        return math.ceil(len(text) / self.ratios.get(kind, self.chars_per_token))
+    
+    def due(self, kind=None):
+        """True if the next prompt of this kind should be measured"""
+        with self._lock:
+            seen = self._seen[kind] = self._seen.get(kind, 0) + 1
+            return self.measure is not None and self.every > 0 and (seen - 1) % self.every == 0
+    
+    def calibrate(self, text, kind=None):
+        """Count `text` with the tokenizer and move the kind's ratio toward the result"""
+        try:
+            tokens = self.measure(text)
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.measure = None  # Keep estimating with the current ratios
+            print(f"⚠️ Token count failed, using estimates from now on: {e}")
+            return None
+        if tokens:
+            with self._lock:
+                ratio = len(text) / tokens
+                previous = self.ratios.get(kind)
+                self.ratios[kind] = ratio if previous is None else 0.5 * (previous + ratio)
+                if self.stats["measured"] == 0:
+                    self.chars_per_token = ratio  # Better than the default for kinds not measured yet
+                self.stats["measured"] += 1
+                self.stats["last_tokens"] = tokens
+        return tokens
+
+
+class PromptContext:
+    """Per-task planner prompt: bounded history, element deltas and a token budget
+    
+    Every turn lists every element, because each planner call is stateless.
+    The first turn, every PROMPT_FULL_ELEMENTS_EVERY-th turn and turns where
+    most of the screen changed give each element as [number] #id type
+    "content"; the others shorten elements the ElementTracker kept in place to
+    [number] #id "content", mark new and moved ones and add the gone ones.
+    Completed steps beyond the last PROMPT_RECENT_STEPS are folded into one
+    summary line. If the prompt is still over PROMPT_TOKEN_BUDGET, the history
+    and then the element list are trimmed until it fits, keeping changed,
+    recently used and interactive elements.
+    """
+    TEXT_CHARS = 40
+    COMPACT_CHARS = 24
+    
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET, recent_steps=PROMPT_RECENT_STEPS,
+                 full_every=PROMPT_FULL_ELEMENTS_EVERY):
+        self.budget = budget
+        self.recent_steps = recent_steps
+        self.full_every = full_every
+        self.reset()
+    
+    def reset(self):
+        self.turns = 0
+        self._last_full = 0
+        self._known = {}  # Stable ID -> (type, text) of the last screen
+        self.last_tokens = 0
+        self.last_full = False
+    
+    @property
+    def last_kind(self):
+        return "full" if self.last_full else "compact"
+    
+    def _line(self, store, number, compact=False):
+        element_id = store.element_id(number)
+        ident = "" if element_id is None else f"#{element_id} "
+        if compact:
+            return f"[{number}] {ident}{json.dumps(store.texts[number][:self.COMPACT_CHARS], ensure_ascii=False)}"
+        text = json.dumps(store.texts[number][:self.TEXT_CHARS], ensure_ascii=False)
+        return f"[{number}] {ident}{store.types[number]} {text}"
+    
+    def _elements(self, store, delta, context, full, limit):
+        """Element section and the number of element lines it holds"""
+        if store is None:
+            return "", 0
+        changed, gone = {}, []
+        if not full:
+            changed.update((store.number_of(i), "new") for i in delta.added)
+            changed.update((store.number_of(i), "moved") for i in delta.moved)
+            gone = [f'#{i} {self._known[i][0]} {json.dumps(self._known[i][1][:self.TEXT_CHARS], ensure_ascii=False)}'
+                    for i in delta.removed if i in self._known]
+        numbers = np.flatnonzero(store.present).tolist()  # Placeholders of replaced elements are not listed
+        on_screen = len(numbers)
+        if limit < len(numbers):
+            # Keep changed, recently used and interactive elements when the budget does not fit them all
+            used = {store.number_of(step.get("element_id")) for step in (context.steps_completed[-3:] if context else [])}
+            numbers = sorted(sorted(numbers, key=lambda n: (n not in changed, n not in used,
+                                                            not store.interactive[n]))[:limit])
+        lines = [f"{self._line(store, n)} ({changed[n]})" if n in changed else self._line(store, n, compact=not full)
+                 for n in numbers]
+        gone = gone[:max(0, limit - len(lines))]
+        more = on_screen - len(numbers)
+        if full:
+            header = f"**AVAILABLE ELEMENTS** ({on_screen}):\n"
+        else:
+            header = (f"**AVAILABLE ELEMENTS** ({on_screen}; {len(delta.added)} new, {len(delta.moved)} moved, "
+                      f"{len(delta.removed)} gone since the last screenshot):\n")
+        footer = f"... {more} more elements, see the numbered screenshot\n" if more else ""
+        if gone:
+            footer += "Gone:\n" + "".join(line + "\n" for line in gone)
+        return header + "".join(line + "\n" for line in lines) + footer, len(lines) + len(gone)
+    
+    def build(self, prompt, context, store, delta, counter):
+        """The prompt text for this turn, within the token budget"""
+        self.turns += 1
+        full = (delta is None or store is None or store.ids is None or self.turns == 1
+                or self.turns - self._last_full >= self.full_every
+                or len(delta.added) + len(delta.moved) > int(store.present.sum()) / 2)
+        request = f"User request: {prompt}\n\nAnalyze the numbered screenshot and provide the next step(s) as JSON.\n"
+        recent = self.recent_steps
+        limit = len(store) if full and store is not None else len(store or []) + len(delta.removed if delta else [])
+        while True:
+            elements, listed = self._elements(store, delta, context, full, limit)
+            history = context.get_context_summary(recent) + "\n" if context and context.steps_completed else ""
+            text = elements + "\n" + history + request
+            tokens = counter.count(text, "full" if full else "compact")
+            if tokens <= self.budget:
+                break
+            if recent > 2 and context and len(context.steps_completed) > 2:
+                recent = max(2, recent // 2)
+            elif listed > 0:
+                # Drop about as many element lines as the excess takes, then check again
+                per_line = counter.count(elements, "full" if full else "compact") / listed
+                limit = max(0, listed - max(1, math.ceil((tokens - self.budget) / per_line)))
+            else:
+                break  # Nothing left to trim
+        if full:
+            self._last_full = self.turns
+        if store is not None and store.ids is not None:
+            self._known = {int(i): (store.types[n], store.texts[n]) for n, i in enumerate(store.ids)}
+        self.last_tokens, self.last_full = tokens, full
+        return text
+
+
+class PlannerClient:
+    """Long-lived Gemini planner.
+    
+    The model is configured once with SYSTEM_PROMPT as its system instruction (or
+    as cached content when PLANNER_CACHE_SYSTEM_PROMPT is set), so each turn only
+    builds the task-specific prompt, and the model's underlying connection is
+    reused between calls. Any object with a
+    `generate_content(contents)` method returning something with `.text` can be
+    passed as `model` to run offline against a stub.
+    """
+    session_key = None  # Set on per-session views, see for_session()
+    gate = None
+    limiter = None
+    
+    def __init__(self, api_key=None, model_name=MODEL_NAME, system_prompt=SYSTEM_PROMPT, model=None,
+                 upload_policy=None):
+        self.api_key = api_key if api_key is not None else API_KEY
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+        self.upload_policy = upload_policy or UploadImagePolicy()
+        self._model = model
+        self._lock = threading.Lock()
+        self.last_timings = {}
+        self.last_upload = {}
+        self.call_count = 0
+        self.tokens = TokenCounter(self._count_tokens)
+    
+    def _count_tokens(self, text):
+        model = self.model
+        if not hasattr(model, "count_tokens"):
+            return None
+        return model.count_tokens(text).total_tokens
+    
+    @property
+    def model(self):
+        """The generative model, created on first use and reused afterwards"""
+        with self._lock:
+            if self._model is None:
+                start = time.perf_counter()
+                import google.generativeai as genai  # Slow to import, so not needed until the first turn
+                genai.configure(api_key=self.api_key)
+                self._model = self._create_model()
+                print(f"✓ Gemini client ready ({(time.perf_counter() - start) * 1000:.0f}ms)")
+            return self._model
+    
+    def for_session(self, key, gate=None, limiter=None):
+        """A view of this planner for one agent session
+        
+        The view uses the same model (created now if needed) with its own call
+        count and last-turn state, and sends each request through `gate` and `limiter`.
+        """
+        self.model
+        bound = copy.copy(self)
+        bound.session_key, bound.gate, bound.limiter = key, gate, limiter
+        bound.call_count = 0
+        bound.last_timings = {}
+        bound.last_upload = {}
+        return bound
+    
+    def warm(self):
+        """Import the Gemini SDK and create the model ahead of the first turn"""
+        self.model
+    
+    def _create_model(self):
+        import google.generativeai as genai
+        if PLANNER_CACHE_SYSTEM_PROMPT:
+            try:
+                from google.generativeai import caching
+                import datetime
+                cached = caching.CachedContent.create(
+                    model=self.model_name,
+                    system_instruction=self.system_prompt,
+                    ttl=datetime.timedelta(seconds=PLANNER_CACHE_TTL_S),
+                )
+                print("✓ System prompt stored as cached content")
+                return genai.GenerativeModel.from_cached_content(cached_content=cached)
+            except Exception as e:
+                print(f"⚠️ Could not cache system prompt, using system instruction: {e}")
+        return genai.GenerativeModel(self.model_name, system_instruction=self.system_prompt)
+    
+    def build_prompt(self, prompt, context=None, store=None, delta=None):
+        """Build the per-turn prompt (the system prompt is sent as system instruction)
+        
+        `store` is the turn's ElementStore and `delta` its ElementDelta; the
+        task's PromptContext decides what of them and of the history is sent.
+        """
+        with tracer.span("prompt_build") as span:
+            prompt_context = context.prompt if context is not None else PromptContext()
+            full_prompt = prompt_context.build(prompt, context, store, delta, self.tokens)
+            span.update(chars=len(full_prompt), tokens=prompt_context.last_tokens, full_elements=prompt_context.last_full)
+        return full_prompt
+    
+    def count_prompt_tokens(self, full_prompt, kind=None):
+        """Measure a sent prompt with the model's tokenizer when a calibration is due (call off the critical path)"""
+        if self.tokens.due(kind):
+            self.tokens.calibrate(full_prompt, kind)
+    
+    def save_prompt(self, parsed_elements):
+        """Save the element list of this turn to a text file with timestamp"""
+        to_save = ""
+        for i, elem in enumerate(parsed_elements, 0):
+            if isinstance(elem, dict) and elem.get("type") == IncrementalParser.REMOVED["type"]:
+                continue
+            to_save += f"[{i}]: {elem}\n"
+        timestamp = int(time.time())
+        prompt_filename = f"gemini_prompt_{timestamp}.txt"
+        with open(prompt_filename, "w", encoding="utf-8") as f:
+            f.write("**AVAILABLE ELEMENTS**:\n\n")
+            f.write(to_save)
+        print(f"✓ Full prompt saved to {prompt_filename}")
+        return prompt_filename
+    
+    def prepare_image(self, annotated_image, parsed_elements, screenshot=None, prescaled=None):
+        """Encode the upload image per the upload policy; returns the content part"""
+        if isinstance(annotated_image, Image.Image) or annotated_image is None:
+            pil_img = annotated_image
+        else:
+            with open(annotated_image, 'rb') as f:
+                img_bytes = f.read()
+            pil_img = Image.open(io.BytesIO(img_bytes))
+        image_part, upload = self.upload_policy.prepare(pil_img, parsed_elements, screenshot, prescaled)
+        self.last_upload = upload
+        print(f"🖼️ Upload image: {upload['width']}x{upload['height']} "
+              f"{upload['format']}, {upload['bytes'] / 1024:.0f} KiB "
+              f"(encode {upload['encode_ms']:.0f}ms)")
+        return image_part
+    
+    def request(self, full_prompt, image_part):
+        """Send one prebuilt prompt and image; returns the raw response text"""
+        model = self.model
+        slot = self.gate.slot(self.session_key, self.limiter) if self.gate else nullcontext()
+        with slot, tracer.span("gemini_request", prompt_chars=len(full_prompt),
+                         image_bytes=len(image_part.get("data", b"")) if isinstance(image_part, dict) else None) as span:
+            response = model.generate_content([full_prompt, image_part])
+            text = response.text.strip()
+            span["response_chars"] = len(text)
+        with self._lock:
+            self.call_count += 1
+        return text
+    
+    def plan(self, prompt, annotated_image, parsed_elements, context=None, screenshot=None):
+        """Ask the model for the next steps; returns (parsed JSON, raw JSON text)
+        
+        `annotated_image` may be a PIL image or a path to an image file. Passing
+        the raw `screenshot` lets the upload policy redraw labels after resizing.
+        """
+        timings = {}
+        total_start = time.perf_counter()
+        
+        start = time.perf_counter()
+        image_part = self.prepare_image(annotated_image, parsed_elements, screenshot)
+        timings["image_prepare_ms"] = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        store = ElementStore(parsed_elements, *(screenshot.size if screenshot is not None else (0, 0)))
+        full_prompt = self.build_prompt(prompt, context, store)
+        self.save_prompt(parsed_elements)
+        timings["prompt_build_ms"] = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        response_text = self.request(full_prompt, image_part)
+        timings["request_ms"] = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        try:
+            return extract_json_response(response_text)
+        finally:
+            timings["parse_ms"] = (time.perf_counter() - start) * 1000
+            timings["total_ms"] = (time.perf_counter() - total_start) * 1000
+            self.last_timings = timings
+            print("⏱️ Gemini timings: " + ", ".join(f"{k[:-3]} {v:.0f}ms" for k, v in timings.items()))
+
+
+_default_planner = None
+
+
+def send_to_gemini(api_key, prompt, annotated_image, parsed_elements, context=None):
+    """Send annotated image (PIL image or path) and parsed elements to Gemini (through a shared PlannerClient)"""
+    global _default_planner
+    if _default_planner is None or _default_planner.api_key != api_key:
+        _default_planner = PlannerClient(api_key)
+    return _default_planner.plan(prompt, annotated_image, parsed_elements, context)
+
+
+class TurnResult:
+    """Outcome of one planning turn"""
+    def __init__(self, response_json, raw_response, elements, annotated_image, timings, wall_ms,
+                 latest_frame=None, drift=0.0, speculative=False, store=None, delta=None):
+        self.response_json = response_json
+        self.raw_response = raw_response
+        self.elements = elements
+        self.store = store  # ElementStore of `elements`
+        self.delta = delta  # ElementDelta against the previous turn, when tracking
+        self.annotated_image = annotated_image
+        self.timings = timings
+        self.wall_ms = wall_ms
+        self.latest_frame = latest_frame
+        self.drift = drift
+        self.speculative = speculative
+
+
+class TurnPipeline:
+    """Runs one planning turn as overlapping stages on a thread pool.
+    
+    OmniParser parsing and downscaling the screenshot for upload start together.
+    Once the elements arrive, the upload image is finished while they are
+    matched to the previous turn's (ElementTracker), and the prompt is built
+    from the resulting delta. The prompt file is written and the prompt's
+    tokens counted (when a calibration is due) while Gemini is thinking. A probe
+    keeps sampling the screen during the Gemini request, so the next stability
+    check starts from the current frame. Each stage's (start, end) offset in ms
+    is recorded in `last_timings`. With overlap=False the stages run in sequence.
+    
+    `speculate(frame)` starts parsing a settled screen before it is asked for;
+    `run` uses that parse when its own frame still matches, else discards it.
+    """
+    def __init__(self, planner, omniparser, incremental_parser=None, parse_cache=None, capture=None,
+                 overlap=PIPELINE_OVERLAP, workers=PIPELINE_WORKERS):
+        self.planner = planner
+        self.omniparser = omniparser
+        self.incremental_parser = incremental_parser
+        self.parse_cache = parse_cache
+        self.capture = capture
+        self.overlap = overlap
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="turn")
+        self._lock = threading.Lock()
+        self.last_timings = {}
+        self._speculation = None
+        self._spec_detector = ChangeDetector()
+        self.tracker = ElementTracker() if TRACK_ELEMENTS else None
+        self.speculation_stats = {"started": 0, "used": 0, "discarded": 0}
+    
+    def _timed(self, timings, t0, name, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                timings[name] = ((start - t0) * 1000, (time.perf_counter() - t0) * 1000)
+    
+    def _submit(self, timings, t0, name, fn, *args):
+        """Start a stage on the pool, or run it right away when not overlapping"""
+        if self.overlap:
+            return self.executor.submit(self._timed, timings, t0, name, fn, *args)
+        future = Future()
+        try:
+            future.set_result(self._timed(timings, t0, name, fn, *args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    def parse(self, frame, on_status=None):
+        """Elements and annotated image for `frame`: cache hit, incremental or full parse"""
+        with tracer.span("parse", size=frame.size) as span:
+            parsed_elements, annotated_image, span["source"] = self._parse(frame, on_status)
+            span["elements"] = len(parsed_elements or [])
+        return parsed_elements, annotated_image
+    
+    def _parse(self, frame, on_status):
+        signature = None
+        if self.parse_cache is not None:
+            # Reuse the last parse if the screen has not meaningfully changed
+            signature = frame_signature(frame)
+            cached = self.parse_cache.lookup(frame, signature)
+            if cached:
+                parsed_elements, annotated_image = cached
+                if self.incremental_parser is not None:
+                    self.incremental_parser.remember(frame, parsed_elements)
+                print(f"♻️ Screen unchanged - reusing cached OmniParser result ({len(parsed_elements)} elements)")
+                return parsed_elements, annotated_image, "cache"
+        
+        if on_status:
+            on_status("Analyzing Screen...", "Detecting UI elements with OmniParser")
+        if INCREMENTAL_PARSE and self.incremental_parser is not None:
+            full_before = self.incremental_parser.stats["full"]
+            parsed_elements, annotated_image = self.incremental_parser.parse(frame)
+            source = "full" if self.incremental_parser.stats["full"] > full_before else "incremental"
+        else:
+            parsed_elements, annotated_image = self.omniparser.parse(frame)
+            source = "full"
+        if self.parse_cache is not None and parsed_elements and annotated_image is not None:
+            self.parse_cache.store(frame, parsed_elements, annotated_image, signature)
+        return parsed_elements, annotated_image, source
+    
+    def speculate(self, frame):
+        """Start parsing `frame` in the background, replacing any earlier speculation"""
+        self.discard_speculation()
+        with self._lock:
+            self._speculation = (frame, self.executor.submit(self.parse, frame))
+            self.speculation_stats["started"] += 1
+    
+    def discard_speculation(self):
+        """Drop a pending speculative parse (its result may still land in the parse cache)"""
+        with self._lock:
+            if self._speculation is not None:
+                self._speculation = None
+                self.speculation_stats["discarded"] += 1
+    
+    def _take_speculation(self, frame):
+        """Future of the speculative parse if it was made on a frame matching `frame`"""
+        with self._lock:
+            speculation, self._speculation = self._speculation, None
+        if speculation is None:
+            return None
+        spec_frame, future = speculation
+        try:
+            matches = (spec_frame.size == frame.size
+                       and not self._spec_detector.compare(spec_frame, frame, find_regions=False).changed)
+        except Exception:
+            matches = False
+        with self._lock:
+            self.speculation_stats["used" if matches else "discarded"] += 1
+        if not matches:
+            print("🗑️ Screen changed since the speculative parse - discarding it")
+            return None
+        print("⚡ Using speculative OmniParser result")
+        return future
+    
+    def _speculative_parse(self, future, frame, on_status):
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"⚠️ Speculative parse failed ({e}), parsing again")
+            return self.parse(frame, on_status)
+    
+    def _probe(self, frame, stop):
+        """Sample the screen until `stop` is set; returns (latest frame, largest change score)"""
+        detector = ChangeDetector()
+        latest, drift = frame, 0.0
+        while not stop.wait(POLL_INTERVAL_MS / 1000.0):
+            try:
+                current = self.capture.grab()
+                result = detector.compare(frame, current, find_regions=False)
+            except Exception as e:
+                print(f"⚠️ Stability probe stopped: {e}")
+                break
+            latest, drift = current, max(drift, result.score)
+        return latest, drift
+    
+    def run(self, prompt, frame, context=None, on_status=None):
+        """Parse `frame`, ask the planner for the next steps and return a TurnResult"""
+        with tracer.span("turn", size=frame.size) as span:
+            result = self._run(prompt, frame, context, on_status)
+            span.update(speculative=result.speculative, drift=round(result.drift, 4),
+                        steps=len(result.response_json.get("steps", [])) if isinstance(result.response_json, dict) else 0)
+        return result
+    
+    def _run(self, prompt, frame, context, on_status):
+        t0 = time.perf_counter()
+        timings = {}
+        speculation = self._take_speculation(frame)
+        if speculation is not None:
+            parse_f = self._submit(timings, t0, "parse", self._speculative_parse, speculation, frame, on_status)
+        else:
+            parse_f = self._submit(timings, t0, "parse", self.parse, frame, on_status)
+        scale_f = self._submit(timings, t0, "upload_prescale", self.planner.upload_policy.prescale, frame)
+        
+        parsed_elements, annotated_image = parse_f.result()
+        if not parsed_elements or annotated_image is None:
+            raise Exception("OmniParser failed to process image")
+        store = ElementStore(parsed_elements, frame.width, frame.height)
+        track_f = self._submit(timings, t0, "track", self._track, store, frame)
+        save_f = self._submit(timings, t0, "prompt_save", self.planner.save_prompt, parsed_elements)
+        image_part = self._timed(timings, t0, "upload_encode", self.planner.prepare_image,
+                                 annotated_image, parsed_elements, frame, scale_f.result())
+        delta = track_f.result()
+        full_prompt = self._timed(timings, t0, "prompt_build", self.planner.build_prompt, prompt, context, store, delta)
+        
+        if on_status:
+            on_status("Thinking...", f"Found {len(parsed_elements)} elements • Asking AI for next steps")
+        stop = threading.Event()
+        probe_f = None
+        if self.overlap and self.capture is not None:
+            probe_f = self.executor.submit(self._timed, timings, t0, "stability_probe", self._probe, frame, stop)
+        try:
+            kind = context.prompt.last_kind if context is not None else None
+            tokens_f = self._submit(timings, t0, "token_count", self.planner.count_prompt_tokens, full_prompt, kind)
+            raw_response = self._timed(timings, t0, "gemini_request", self.planner.request, full_prompt, image_part)
+        finally:
+            stop.set()
+        response_json, raw_response = self._timed(timings, t0, "json_extract", extract_json_response, raw_response)
+        save_f.result()
+        tokens_f.result()
+        if delta is not None and self.tracker.stats["updates"] > 1:
+            print(f"🧩 {int(store.present.sum())} elements ({delta.summary()} since the last turn)")
+        latest_frame, drift = probe_f.result() if probe_f else (frame, 0.0)
+        
+        wall_ms = (time.perf_counter() - t0) * 1000
+        self.last_timings = timings
+        busy_ms = sum(end - start for name, (start, end) in timings.items() if name != "stability_probe")
+        print(f"⏱️ Turn {wall_ms:.0f}ms (stage total {busy_ms:.0f}ms): " + ", ".join(
+            f"{name} {start:.0f}-{end:.0f}" for name, (start, end) in sorted(timings.items(), key=lambda kv: kv[1])))
+        return TurnResult(response_json, raw_response, parsed_elements, annotated_image, timings, wall_ms,
+                          latest_frame, drift, speculative=speculation is not None, store=store, delta=delta)
+    
+    def _track(self, store, frame):
+        """Give the new elements stable IDs; returns the ElementDelta, or None when not tracking"""
+        if self.tracker is None:
+            return None
+        with tracer.span("track", elements=len(store)) as span:
+            delta = self.tracker.update(store, frame)
+            span.update(added=len(delta.added), removed=len(delta.removed), moved=len(delta.moved))
+        return delta
+    
+    def close(self):
+        self.discard_speculation()
+        self.executor.shutdown(wait=False)
+
+
+class EngineResult:
+    """What the front end should do after a batch of steps"""
+    CAPTURE, END, ASK = "capture", "end", "ask_question"
+    
+    def __init__(self, next_action, message="", executed=0, errors=0, elapsed_ms=0.0):
+        self.next_action = next_action  # CAPTURE the next screen for the planner, END or ASK the user
+        self.message = message  # End message or question
+        self.executed = executed
+        self.errors = errors
+        self.elapsed_ms = elapsed_ms
+
+
+class ActionEngine:
+    """Executes the step JSON described in SYSTEM_PROMPT without any GUI.
+    
+    Each step is a coroutine on an asyncio event loop: input goes to the input
+    backend on a worker thread, screen waits go through a ScreenWatcher, and
+    pauses (typing delays, showing an error) are asyncio sleeps, so the loop is
+    never blocked and can drive several engines at once. Run it with
+    asyncio.run() headlessly or through an EngineLoop from Qt. `ui` is any
+    object with show_status()/hide_status(); a TurnPipeline as `pipeline`
+    enables speculative parsing, and `on_event` receives a dict per step
+    ("step", "step_done", "step_error"). `stats` counts batches, steps, errors
+    and busy time for throughput measurements (see `benchmark.py engine`).
+    """
+    def __init__(self, capture, input_backend, watcher=None, ui=None, pipeline=None, on_event=None):
+        self.capture = capture
+        self.input_backend = input_backend
+        self.watcher = watcher or ScreenWatcher(capture)
+        self.ui = ui
+        self.pipeline = pipeline
+        self.on_event = on_event
+        self._input_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="input")
+        self.stats = {"batches": 0, "steps": 0, "errors": 0, "busy_s": 0.0}
+        self.handlers = {
+            "click": self._click,
+            "keyboard": self._keyboard,
+            "scroll": self._scroll,
+            "wait_and_send_image": self._wait_and_send_image,
+            "ask_question": self._ask_question,
+            "end": self._end,
+        }
+    
+    def _show_status(self, status, detail="", show_progress=True):
+        if self.ui is not None:
+            self.ui.show_status(status, detail, show_progress)
+    
+    def _hide_status(self):
+        if self.ui is not None:
+            self.ui.hide_status()
+    
+    def _emit(self, event, **data):
+        if self.on_event is not None:
+            self.on_event(dict(data, event=event))
+    
+    async def _input(self, method, *args, **kwargs):
+        """Call an input backend method on the input thread (calls stay in order)"""
+        fn = getattr(self.input_backend, method)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._input_executor, lambda: fn(*args, **kwargs))
+    
+    async def _fail(self, detail):
+        """Keep an error on screen for STEP_ERROR_PAUSE_MS, then move on"""
+        self.stats["errors"] += 1
+        self._emit("step_error", detail=detail)
+        self._show_status("Error", detail, False)
+        await asyncio.sleep(STEP_ERROR_PAUSE_MS / 1000.0)
+    
+    async def run(self, steps, elements, context):
+        """Execute one batch of steps; returns an EngineResult
+        
+        `elements` is the turn's ElementStore (a raw element list is wrapped in one).
+        """
+        if not isinstance(elements, ElementStore):
+            mon = self.capture.monitor
+            elements = ElementStore(elements, mon["width"], mon["height"])
+        start = time.perf_counter()
+        errors = self.stats["errors"]
+        executed = 0
+        result = None
+        self.stats["batches"] += 1
+        try:
+            for index, step in enumerate(steps):
+                step_type = step.get("type")
+                print(f"\n>>> Step {index + 1}/{len(steps)}: {step_type}")
+                if step_type != "wait_and_send_image" and self.pipeline is not None:
+                    # Any other step changes the screen or ends the turn, so a speculative parse is stale
+                    self.pipeline.discard_speculation()
+                handler = self.handlers.get(step_type)
+                if handler is None:
+                    print(f"⚠️ Unknown step type: {step_type}")
+                    continue
+                
+                # Spans are ended by hand so a cancelled (aborted) step is not recorded
+                description = str(step.get("description", ""))[:80]
+                span = tracer.begin(f"action:{step_type}", step=index + 1, description=description)
+                self._emit("step", index=index + 1, count=len(steps), type=step_type, description=description)
+                step_start = time.perf_counter()
+                try:
+                    result = await handler(step, elements, context, steps[index + 1:])
+                except Exception as e:
+                    tracer.end(span, outcome="error", error=str(e)[:200])
+                    raise
+                tracer.end(span)
+                self._emit("step_done", index=index + 1, type=step_type,
+                           elapsed_ms=round((time.perf_counter() - step_start) * 1000, 1))
+                executed += 1
+                self.stats["steps"] += 1
+                if result is not None:
+                    break
+            else:
+                result = self._batch_done(steps)
+        finally:
+            self.stats["busy_s"] += time.perf_counter() - start
+        
+        result.executed = executed
+        result.errors = self.stats["errors"] - errors
+        result.elapsed_ms = (time.perf_counter() - start) * 1000
+        return result
+    
+    def _batch_done(self, steps):
+        print(f"✓ All {len(steps)} steps completed")
+        last_step_type = steps[-1].get("type") if steps else None
+        if last_step_type == "wait_and_send_image":
+            print("📸 Last step was wait_and_send_image - capturing new screenshot for Gemini")
+            self._show_status("Analyzing...", "Capturing new state for AI analysis", True)
+        else:
+            # Safety: the model forgot wait_and_send_image or end, send the screen anyway
+            print("⚠️ No wait_and_send_image or end in response - sending image anyway for safety")
+            self._show_status("Continuing...", "Getting next steps from AI", True)
+        return EngineResult(EngineResult.CAPTURE)
+    
+    async def _click(self, step, elements, context, remaining):
+        elem_num = step.get("element_number")
+        by_id = elements.number_of(step.get("element_id"))
+        if by_id is not None:
+            elem_num = by_id  # Stable across re-parses, so preferred over a number read off the image
+        is_double = step.get("double_click", False)
+        desc = step.get("description", "Click action")
+        
+        if not elements.contains(elem_num):
+            print(f"⚠️ Invalid element number: {elem_num}")
+            await self._fail(f"Invalid element number: {elem_num}")
+            return None
+        
+        try:
+            action_type = "Double-clicking" if is_double else "Clicking"
+            self._show_status(f"{action_type}...", f"Element [{elem_num}]: {desc}", True)
+            print(f"🖱️ {action_type} element [{elem_num}]: {elements[elem_num]}")
+            
+            # Element coordinates are relative to the captured monitor
+            mon = self.capture.monitor
+            bbox = elements.pixel_bbox(elem_num, mon["width"], mon["height"])
+            if bbox is None:
+                raise ValueError(f"Element has no valid bbox: {elements[elem_num]}")
+            x1, y1, x2, y2 = bbox
+            click_x = mon["left"] + int((x1 + x2) / 2)
+            click_y = mon["top"] + int((y1 + y2) / 2)
+            
+            print(f"✓ Clicking at ({click_x}, {click_y})")
+            await self._input("click", click_x, click_y)
+            if is_double:
+                await self._input("click", click_x, click_y)
+        except Exception as e:
+            print(f"⚠️ Click error: {e}")
+            await self._fail(f"Click failed: {str(e)[:40]}")
+            return None
+        
+        self._record_step(step, elements, context, elem_num)
+        region = self.capture.region_around((x1, y1, x2, y2)) if WATCH_CLICK_REGION else None
+        await self._wait_for_screen(context, remaining, region)
+    
+    def _record_step(self, step, elements, context, elem_num):
+        """Add a step to the context with the stable ID of its element, and flag repeated actions"""
+        element_id = elements.element_id(elem_num)
+        if element_id is not None:
+            step = dict(step, element_id=element_id, element_text=elements.texts[elem_num][:40])
+        context.add_step_completed(step)
+        repeated = context.repeated_step()
+        if repeated is not None:
+            print(f"🔁 {LOOP_REPEAT_LIMIT} {repeated.get('type')} steps in a row on element #{element_id} - possible loop")
+            self._emit("loop", type=repeated.get("type"), element_id=element_id, repeats=LOOP_REPEAT_LIMIT)
+    
+    async def _keyboard(self, step, elements, context, remaining):
+        content = step.get("content", "")
+        self._show_status("Typing...", f"Text: {content[:30]}...", True)
+        print(f"⌨️ Typing: {content}")
+        
+        keys = {"{ENTER}": "enter", "{TAB}": "tab", "{BACKSPACE}": "backspace"}
+        try:
+            await asyncio.sleep(0.3)
+            if content in keys:
+                await self._input("press", keys[content])
+            else:
+                await self._input("write", content, interval=0.05)
+                await asyncio.sleep(0.2)
+                await self._input("press", "enter")
+            print(f"✓ Typed: {content}")
+        except Exception as e:
+            print(f"⚠️ Keyboard error: {e}")
+            await self._fail(f"Typing failed: {str(e)[:40]}")
+            return None
+        
+        elem_num = elements.number_of(step.get("element_id"))
+        self._record_step(step, elements, context, step.get("element_number") if elem_num is None else elem_num)
+        await self._wait_for_screen(context, remaining)
+    
+    async def _scroll(self, step, elements, context, remaining):
+        magnitude = step.get("magnitude", -3)
+        desc = step.get("description", "Scroll")
+        direction = "down" if magnitude < 0 else "up"
+        self._show_status(f"Scrolling {direction}...", desc, True)
+        print(f"📜 Scrolling: magnitude={magnitude}")
+        
+        try:
+            await self._input("scroll", int(magnitude * 100))
+        except Exception as e:
+            print(f"⚠️ Scroll error: {e}")
+            await self._fail(f"Scroll failed: {str(e)[:40]}")
+            return None
+        
+        context.add_step_completed(step)
+        await self._wait_for_screen(context, remaining)
+    
+    async def _wait_and_send_image(self, step, elements, context, remaining):
+        desc = step.get("description", "Waiting for screen and analyzing next state")
+        self._show_status("Waiting...", desc, True)
+        print("⏳ Waiting for screen to stabilize before capturing...")
+        context.add_step_completed(step)
+        await self._wait_for_screen(context, remaining, expect_change=False)
+    
+    async def _ask_question(self, step, elements, context, remaining):
+        context.add_step_completed(step)
+        return EngineResult(EngineResult.ASK, step.get("question", "Need more information"))
+    
+    async def _end(self, step, elements, context, remaining):
+        return EngineResult(EngineResult.END, step.get("message", "Task completed!"))
+    
+    def _on_check(self, check_count, score, remaining_ms):
+        """Progress from the watcher while the screen is unchanged"""
+        self._show_status("Monitoring...", f"Waiting for screen change ({int(remaining_ms/1000)}s left)", True)
+        print(f"⏳ Screen unchanged (check {check_count}, {score*100:.2f}%), checking again...")
+    
+    async def _wait_for_screen(self, context, remaining, region=None, expect_change=True):
+        """Wait for the screen to change (and settle) with timeout, then add the buffer delay"""
+        span = tracer.begin("settle_wait", region=region is not None, expect_change=expect_change)
+        result = await self.watcher.wait(context.last_frame, region, expect_change, on_check=self._on_check)
+        tracer.end(span, outcome=result.outcome)
+        
+        delay = SETTLE_BUFFER_MS if ADAPTIVE_SETTLE else BUFFER_DELAY_MS
+        if result.outcome == "changed":
+            if context.last_frame is None:
+                self._show_status("Ready", "Initial screen captured", True)
+            else:
+                print(f"📊 Screen difference: {result.score*100:.2f}% (threshold: {SCREEN_CHANGE_THRESHOLD*100:.0f}%)")
+                print(f"✓ Screen changed! Adding {delay}ms buffer...")
+                self._show_status("Screen changed", f"Waiting {delay}ms buffer", True)
+            result.frame.debug_save("last_stable_screen.png")
+            context.last_frame = result.frame
+        elif result.outcome == "timeout":
+            print(f"⏱️ Timeout reached ({MAX_WAIT_FOR_CHANGE}ms). Proceeding anyway...")
+            self._show_status("Proceeding...", "Screen check timeout - continuing", True)
+        else:
+            print(f"⚠️ Screen monitor error: {result.error}")
+        
+        if self._should_speculate(context, remaining):
+            self._hide_status()  # Keep the overlay out of the speculative frame
+            await asyncio.sleep(max(delay, HIDE_AND_CAPTURE_DELAY_MS) / 1000.0)
+            await self._speculate()
+        else:
+            await asyncio.sleep(delay / 1000.0)
+    
+    def _should_speculate(self, context, remaining):
+        """True when only wait_and_send_image steps remain, so this screen is what gets parsed next"""
+        return (SPECULATIVE_PARSE and self.pipeline is not None and bool(context.original_task)
+                and all(step.get("type") == "wait_and_send_image" for step in remaining))
+    
+    async def _speculate(self):
+        """Start parsing the settled screen in the background"""
+        try:
+            span = tracer.begin("capture", speculative=True)
+            frame = await self.watcher.grab()
+            tracer.end(span)
+            self.pipeline.speculate(frame)
+            print("⚡ Screen settled - parsing it speculatively")
+        except Exception as e:
+            print(f"⚠️ Speculative capture failed: {e}")
+    
+    def close(self):
+        self.watcher.close()
+        self._input_executor.shutdown(wait=False)
+
+
+class EngineLoop:
+    """An asyncio event loop on a daemon thread, for driving ActionEngines from Qt or any other thread"""
+    def __init__(self, name="action-engine"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+    
+    def submit(self, coro):
+        """Schedule a coroutine; returns a concurrent Future whose cancel() cancels the task"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def _shutdown(self):
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
+        self.loop.call_soon(self.loop.stop)
+    
+    def stop(self, timeout=2.0):
+        """Cancel pending tasks and stop the loop thread"""
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self._shutdown)
+            self._thread.join(timeout)
+
+
+class VirtualAssistant(QtWidgets.QWidget):
+    # Signals for thread-safe UI updates
+    status_signal = QtCore.pyqtSignal(str, str, bool)  # status, detail, show_progress
+    steps_finished = QtCore.pyqtSignal(object)  # Future of an ActionEngine.run()
+    
+    def __init__(self, capture=None, planner=None, omniparser=None, input_backend=None):
+        super().__init__()
+        self.context = TaskContext()
+        self._elements = None  # ElementStore of the last parse
+        self._awaiting_action = False
+        self._voice_enabled = VOICE_ENABLED
+        self._engine_future = None
+        self._voice_capture_pending = False  # Screen capture for a spoken command is scheduled
+        self._voice_hidden = False  # Window hidden for that capture and not shown again yet
+        self._voice_listening = False
+        self._voice_text = None  # Recognized command waiting for the capture to finish
+        self._voice_failed = False  # Recognition failed while the capture was pending
+        self.voice_confirm_timer = QtCore.QTimer(self)
+        self.voice_confirm_timer.setSingleShot(True)
+        self.voice_confirm_timer.timeout.connect(self.on_enter)
+        self.planner = planner or PlannerClient()
+        self.omniparser = omniparser or OmniParserClient()
+        self.input_backend = input_backend or PyAutoGuiBackend()
+        self.parse_cache = ParseCache()
+        self.incremental_parser = IncrementalParser(self.omniparser)
+        
+        # One long-lived capture service; steps and screen waits run on the action engine's loop thread
+        self.capture = capture or CaptureService()
+        self.pipeline = TurnPipeline(self.planner, self.omniparser, self.incremental_parser,
+                                     self.parse_cache, self.capture)
+        self.engine_loop = EngineLoop()
+        self.engine = ActionEngine(self.capture, self.input_backend, ui=self, pipeline=self.pipeline)
+        self.steps_finished.connect(self._on_steps_finished)
+        
+        # Create status overlay
+        self.status_overlay = StatusOverlay()
+        self.status_signal.connect(self._update_status_overlay)
+        
+        # Create voice indicator
+        self.voice_indicator = VoiceIndicator()
+        
+        # Create voice recognition thread
+        self.voice_thread = None
+        
+        self.init_ui()
+        # Voice input and client warm-up start from start_background_work() once the window is up
     
     def init_ui(self):
         self.setWindowTitle("AI Assistant with OmniParser")
@@ -769,6 +4244,8 @@ class VirtualAssistant(QtWidgets.QWidget):
         self.input = QtWidgets.QLineEdit()
         self.input.setPlaceholderText('Type or say: "Hey Vision, play lata mangeshkar songs"')
         self.input.returnPressed.connect(self.on_enter)
+        self.input.textEdited.connect(self._on_input_edited)
+        QtWidgets.QShortcut(QtGui.QKeySequence(QtCore.Qt.Key_Escape), self, self.cancel_voice_command)
 
         # Voice activation button
         voice_input_layout = QtWidgets.QHBoxLayout()
@@ -825,6 +4302,39 @@ class VirtualAssistant(QtWidgets.QWidget):
         y = 40
         self.setGeometry(x, y, w, h)
     
+    def start_background_work(self):
+        """Called once the window is shown: pre-warm the clients and start voice input"""
+        self.prewarm()
+        if self._voice_enabled:
+            self.start_voice_recognition()
+    
+    def prewarm(self):
+        """Create the Gemini model, open an OmniParser connection and a capture session in parallel
+        
+        Returns {name: future}; a summary is printed when all are done.
+        """
+        start = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prewarm")
+        futures = {"planner": pool.submit(self.planner.warm),
+                   "omniparser": pool.submit(self.omniparser.warm),
+                   "capture": self.engine.watcher.warm()}
+        pool.shutdown(wait=False)
+        pending = [len(futures)]
+        lock = threading.Lock()
+        
+        def on_done(_):
+            with lock:
+                pending[0] -= 1
+                if pending[0]:
+                    return
+            failed = [name for name, future in futures.items() if future.exception() is not None]
+            print(f"🔥 Pre-warmed {', '.join(futures)} in {(time.perf_counter() - start) * 1000:.0f}ms"
+                  + (f" ({', '.join(failed)} failed)" if failed else ""))
+        
+        for future in futures.values():
+            future.add_done_callback(on_done)
+        return futures
+    
     def start_voice_recognition(self):
         """Start voice recognition thread"""
         if self.voice_thread is None or not self.voice_thread.isRunning():
@@ -873,23 +4383,98 @@ class VirtualAssistant(QtWidgets.QWidget):
             # Trigger manual listening
             self.voice_thread.is_listening_for_command = True
             print("🎤 Manual voice activation triggered")
+            self.prepare_voice_task()
+    
+    def prepare_voice_task(self):
+        """Capture the screen and start parsing it while the command is spoken
+        
+        The window is hidden for the capture and the parse runs as the pipeline's
+        speculation, so the turn that starts when the text arrives picks it up if
+        the screen has not changed in the meantime.
+        """
+        if (not VOICE_PREPARE_ON_WAKE or not self.input.isEnabled() or self._engine_future is not None
+                or self._voice_capture_pending):
+            return
+        self.voice_confirm_timer.stop()
+        self._voice_capture_pending = True
+        self._voice_failed = False
+        self._voice_hidden = True
+        self.voice_indicator.hide()
+        self.hide()
+        QtCore.QTimer.singleShot(HIDE_AND_CAPTURE_DELAY_MS, self._capture_for_voice)
+    
+    def _capture_for_voice(self):
+        try:
+            self.pipeline.speculate(self.capture.grab())
+            print("⚡ Parsing the screen while the command is spoken")
+        except Exception as e:
+            print(f"⚠️ Screen capture for the voice command failed: {e}")
+        self._voice_capture_pending = False
+        if self._voice_listening:
+            self.voice_indicator.show_listening()
+        if self._voice_text is not None:
+            self._confirm_voice_command(self._voice_text)
+        elif self._voice_failed:
+            self._restore_after_voice()
+    
+    def _confirm_voice_command(self, text):
+        """Show the recognized command and start it after VOICE_CONFIRM_MS unless edited or cancelled"""
+        self._voice_text = None
+        self.input.setText(text)
+        if VOICE_CONFIRM_MS <= 0:
+            self.on_enter()
+            return
+        self._voice_hidden = False
+        self.show()
+        self.activateWindow()
+        self.input.setFocus()
+        self.update_status(f"Starting in {VOICE_CONFIRM_MS / 1000:.1f}s - Enter to start now, Esc to cancel, "
+                           "or edit the text")
+        self.voice_confirm_timer.start(VOICE_CONFIRM_MS)
+    
+    def cancel_voice_command(self):
+        """Esc: drop a voice command that is waiting for confirmation"""
+        if not self.voice_confirm_timer.isActive():
+            return
+        self.voice_confirm_timer.stop()
+        self.pipeline.discard_speculation()
+        self.input.clear()
+        self.update_status("Voice command cancelled - Ready (or say 'Hey Vision')")
+        print("✗ Voice command cancelled")
+    
+    def _on_input_edited(self, _text):
+        if self.voice_confirm_timer.isActive():
+            self.voice_confirm_timer.stop()
+            self.update_status("Press Enter to start the edited task")
+    
+    def _restore_after_voice(self):
+        """Show the window again when a prepared voice command produced no text"""
+        if self._voice_hidden and not self._voice_capture_pending and self._voice_text is None:
+            self._voice_hidden = False
+            self.pipeline.discard_speculation()
+            if self.input.isEnabled():
+                self.show()
+                self.input.setFocus()
             
     @QtCore.pyqtSlot()
     def on_wake_word_detected(self):
         """Called when wake word is detected"""
         print("✓ Wake word detected - ready for command")
         # Don't show indicator yet, wait for listening_started
+        self.prepare_voice_task()
     
     @QtCore.pyqtSlot()
     def on_listening_started(self):
         """Called when listening for command starts"""
-        if self.input.isEnabled():
+        self._voice_listening = True
+        if self.input.isEnabled() and not self._voice_capture_pending:  # Kept out of the prepared capture
             self.voice_indicator.show_listening()
             print("🎤 Voice indicator shown")
     
     @QtCore.pyqtSlot()
     def on_listening_stopped(self):
         """Called when listening stops"""
+        self._voice_listening = False
         self.voice_indicator.hide()
         print("🎤 Voice indicator hidden")
     
@@ -898,9 +4483,10 @@ class VirtualAssistant(QtWidgets.QWidget):
         """Called when voice text is recognized"""
         if self.input.isEnabled():
             print(f"✓ Voice command: {text}")
-            self.input.setText(text)
-            # Automatically submit
-            QtCore.QTimer.singleShot(2000, self.on_enter)
+            if self._voice_capture_pending:
+                self._voice_text = text  # Confirmed once the capture is done
+            else:
+                self._confirm_voice_command(text)
     
     @QtCore.pyqtSlot(str)
     def on_voice_error(self, error_msg):
@@ -908,6 +4494,8 @@ class VirtualAssistant(QtWidgets.QWidget):
         print(f"⚠️ Voice error: {error_msg}")
         # Don't show error to user, just hide indicator
         self.voice_indicator.hide()
+        self._voice_failed = self._voice_capture_pending
+        self._restore_after_voice()
     
     @QtCore.pyqtSlot(str, str, bool)
     def _update_status_overlay(self, status, detail, show_progress):
@@ -928,6 +4516,13 @@ class VirtualAssistant(QtWidgets.QWidget):
         )
     
     def on_abort(self):
+        if self._engine_future is not None:
+            self._engine_future.cancel()
+            self._engine_future = None
+        self.pipeline.discard_speculation()
+        print(f"📊 {self.parse_cache.task_summary()}")
+        print(f"📊 Speculative parses: {self.pipeline.speculation_stats}")
+        tracer.finish_task("aborted")
         self.context.reset()
         self.hide_status()
         status_text = "Task aborted - Ready for new task"
@@ -955,21 +4550,25 @@ class VirtualAssistant(QtWidgets.QWidget):
             self.button_panel.show()
     
     def on_enter(self):
+        self.voice_confirm_timer.stop()
         user_input = self.input.text().strip()
         if not user_input:
             return
         
         if not self.context.original_task:
             self.context.original_task = user_input
+            self.parse_cache.start_task()
+            tracer.start_task(user_input)
             self.update_status(f"Task: {user_input}")
         else:
             self.context.add_user_message(user_input)
         
         self.input.clear()
         self.input.setDisabled(True)
+        delay = HIDE_AND_CAPTURE_DELAY_MS if self.isVisible() else 0  # Already hidden for a voice capture
+        self._voice_hidden = False
         self.hide()
-        QtCore.QTimer.singleShot(HIDE_AND_CAPTURE_DELAY_MS, 
-                                lambda: self.capture_and_process(user_input))
+        QtCore.QTimer.singleShot(delay, lambda: self.capture_and_process(user_input))
     
     def capture_and_process(self, prompt):
         """Capture screenshot and process with OmniParser"""
@@ -977,38 +4576,27 @@ class VirtualAssistant(QtWidgets.QWidget):
         self.hide_status()
         time.sleep(0.1)  # Ensure UI is hidden
         
-        with mss.mss() as sct:
-            monitor = sct.monitors[1]
-            img = sct.grab(monitor)
-            pil_img = Image.frombytes("RGB", img.size, img.rgb)
-            
-            screenshot_path = "current_screen.png"
-            pil_img.save(screenshot_path)
-            self.context.last_screenshot_path = screenshot_path
-            print(f"📸 Screenshot saved: {screenshot_path}")
+        with tracer.span("capture"):
+            frame = self.capture.grab()
+        self.context.last_frame = frame
+        frame.debug_save("current_screen.png")
 
         self.show_status("Processing...", "Analyzing screenshot with OmniParser")
 
         threading.Thread(target=self._process_with_omniparser, 
-                        args=(prompt, screenshot_path), daemon=True).start()
+                        args=(prompt, frame), daemon=True).start()
     
-    def _process_with_omniparser(self, prompt, screenshot_path):
+    def _process_with_omniparser(self, prompt, frame):
         """Process screenshot with OmniParser then send to Gemini"""
         try:
-            # Call OmniParser
-            self.show_status("Analyzing Screen...", "Detecting UI elements with OmniParser")
-            parsed_elements, annotated_path = call_omniparser(screenshot_path)
-            
-            if not parsed_elements or not annotated_path:
-                raise Exception("OmniParser failed to process image")
-            
-            self._parsed_elements = parsed_elements
-            self.show_status("Thinking...", f"Found {len(parsed_elements)} elements • Asking AI for next steps")
-            
-            # Send to Gemini
-            response_json, raw_response = send_to_gemini(
-                API_KEY, prompt, annotated_path, parsed_elements, self.context
-            )
+            # Parse, upload preparation and prompt assembly overlap; see TurnPipeline
+            turn = self.pipeline.run(prompt, frame, self.context, on_status=self.show_status)
+            self._elements = turn.store
+            response_json, raw_response = turn.response_json, turn.raw_response
+            if turn.drift >= SCREEN_CHANGE_THRESHOLD:
+                # Compare the next actions against what is on screen now, not the parsed frame
+                print(f"⚠️ Screen changed by {turn.drift*100:.1f}% while planning")
+                self.context.last_frame = turn.latest_frame
             print("\n===== RAW LLM RESPONSE =====\n" + raw_response + "\n===========================\n")
             timestamp = int(time.time())
             prompt_filename = f"gemini_response_{timestamp}.txt"
@@ -1050,245 +4638,44 @@ class VirtualAssistant(QtWidgets.QWidget):
     
     @QtCore.pyqtSlot(list)
     def _execute_steps(self, steps):
-        self._pending_steps = steps
-        self._current_step_index = 0
-        self._execute_next_step()
-    
-    def _execute_next_step(self):
-        if self._current_step_index >= len(self._pending_steps):
-            print(f"✓ All {len(self._pending_steps)} steps completed")
-            
-            # Check the last step to determine what to do next
-            last_step = self._pending_steps[-1] if self._pending_steps else None
-            last_step_type = last_step.get("type") if last_step else None
-            
-            # If last step was wait_and_send_image, capture and send to Gemini
-            if last_step_type == "wait_and_send_image":
-                print("📸 Last step was wait_and_send_image - capturing new screenshot for Gemini")
-                self.show_status("Analyzing...", "Capturing new state for AI analysis", True)
-                QtCore.QTimer.singleShot(HIDE_AND_CAPTURE_DELAY_MS, 
-                                        lambda: self.capture_and_process(self.context.original_task))
-                return
-            
-            # If last step was end or ask_question, we're done (handled in their execute methods)
-            if last_step_type in ["end", "ask_question"]:
-                self.hide_status()
-                return
-            
-            # Safety: If Gemini forgot to add wait_and_send_image or end, send image anyway
-            print("⚠️ No wait_and_send_image or end in response - sending image anyway for safety")
-            self.show_status("Continuing...", "Getting next steps from AI", True)
-            QtCore.QTimer.singleShot(HIDE_AND_CAPTURE_DELAY_MS, 
-                                    lambda: self.capture_and_process(self.context.original_task))
-            return
-        
-        step = self._pending_steps[self._current_step_index]
-        step_type = step.get("type")
-        
-        print(f"\n>>> Step {self._current_step_index + 1}/{len(self._pending_steps)}: {step_type}")
-        
-        if step_type == "click":
-            self._execute_click(step)
-        elif step_type == "keyboard":
-            self._execute_keyboard(step)
-        elif step_type == "scroll":
-            self._execute_scroll(step)
-        elif step_type == "wait_and_send_image":
-            self._execute_wait_and_send_image(step)
-        elif step_type == "ask_question":
-            self._execute_ask_question(step)
-        elif step_type == "end":
-            self._execute_end(step)
-        else:
-            print(f"⚠️ Unknown step type: {step_type}")
-            self._current_step_index += 1
-            self._execute_next_step()
-    
-    def _execute_click(self, step):
-        elem_num = step.get("element_number")
-        is_double = step.get("double_click", False)
-        desc = step.get("description", "Click action")
-
-        if elem_num is None or elem_num < 1 or elem_num > len(self._parsed_elements):
-            print(f"⚠️ Invalid element number: {elem_num}")
-            self.show_status("Error", f"Invalid element number: {elem_num}", False)
-            time.sleep(2)
-            self._current_step_index += 1
-            self._execute_next_step()
-            return
-
-        elem = self._parsed_elements[elem_num]
-        action_type = "Double-clicking" if is_double else "Clicking"
-        self.show_status(f"{action_type}...", f"Element [{elem_num}]: {desc}", True)
-        print(f"🖱️ {action_type} element [{elem_num}]: {elem}")
-
-        try:
-            # Support both string and dict element formats
-            if isinstance(elem, dict):
-                bbox = elem.get('bbox')
-                if bbox and len(bbox) == 4:
-                    screen = pyautogui.size()
-                    x1 = int(bbox[0] * screen[0])
-                    y1 = int(bbox[1] * screen[1])
-                    x2 = int(bbox[2] * screen[0])
-                    y2 = int(bbox[3] * screen[1])
-                    click_x = int((x1 + x2) / 2)
-                    click_y = int((y1 + y2) / 2)
-                else:
-                    raise ValueError("Element dict missing valid bbox")
-            elif isinstance(elem, str):
-                box_start = elem.find("<box>") + 5
-                box_end = elem.find("</box>")
-                coords_str = elem[box_start:box_end]
-                x1, y1, x2, y2 = map(float, coords_str.split(','))
-                click_x = int((x1 + x2) / 2)
-                click_y = int((y1 + y2) / 2)
-            else:
-                raise ValueError("Element is neither dict nor str")
-
-            print(f"✓ Clicking at ({click_x}, {click_y})")
-
-            if is_double:
-                pyautogui.click(click_x, click_y)
-                pyautogui.click(click_x, click_y)
-            else:
-                pyautogui.click(click_x, click_y)
-
-            self.context.add_step_completed(step)
-            self._current_step_index += 1
-            self._wait_for_screen_change()
-
-        except Exception as e:
-            print(f"⚠️ Click error: {e}")
-            self.show_status("Error", f"Click failed: {str(e)[:40]}", False)
-            time.sleep(2)
-            self._current_step_index += 1
-            self._execute_next_step()
-    
-    def _execute_keyboard(self, step):
-        content = step.get("content", "")
-        desc = step.get("description", "Type text")
-        
-        self.show_status("Typing...", f"Text: {content[:30]}...", True)
-        print(f"⌨️ Typing: {content}")
-        
-        try:
-            time.sleep(0.3)
-            if content == "{ENTER}":
-                pyautogui.press('enter')
-            elif content == "{TAB}":
-                pyautogui.press('tab')
-            elif content == "{BACKSPACE}":
-                pyautogui.press('backspace')
-            else:
-                pyautogui.write(content, interval=0.05)
-                time.sleep(0.2)
-                pyautogui.press('enter')
-            
-            print(f"✓ Typed: {content}")
-            self.context.add_step_completed(step)
-            self._current_step_index += 1
-            self._wait_for_screen_change()
-            
-        except Exception as e:
-            print(f"⚠️ Keyboard error: {e}")
-            self.show_status("Error", f"Typing failed: {str(e)[:40]}", False)
-            time.sleep(2)
-            self._current_step_index += 1
-            self._execute_next_step()
+        """Run the steps on the action engine; the result arrives in _on_steps_finished"""
+        future = self.engine_loop.submit(self.engine.run(steps, self._elements, self.context))
+        self._engine_future = future
+        future.add_done_callback(self.steps_finished.emit)
     
-    def _execute_scroll(self, step):
-        magnitude = step.get("magnitude", -3)
-        desc = step.get("description", "Scroll")
-        direction = "down" if magnitude < 0 else "up"
-        
-        self.show_status(f"Scrolling {direction}...", desc, True)
-        print(f"📜 Scrolling: magnitude={magnitude}")
-        
+    def _on_steps_finished(self, future):
+        if future is not self._engine_future or future.cancelled():
+            return  # Aborted
+        self._engine_future = None
         try:
-            pyautogui.scroll(int(magnitude * 100))
-            self.context.add_step_completed(step)
-            self._current_step_index += 1
-            self._wait_for_screen_change()
-            
+            result = future.result()
         except Exception as e:
-            print(f"⚠️ Scroll error: {e}")
-            self.show_status("Error", f"Scroll failed: {str(e)[:40]}", False)
-            time.sleep(2)
-            self._current_step_index += 1
-            self._execute_next_step()
-    
-    def _execute_wait_and_send_image(self, step):
-        desc = step.get("description", "Waiting for screen and analyzing next state")
-        self.show_status("Waiting...", desc, True)
-        print("⏳ Waiting for screen to stabilize before capturing...")
-        self.context.add_step_completed(step)
-        self._current_step_index += 1
-        self._wait_for_screen_change()
-    
-    def _wait_for_screen_change(self):
-        """Wait for screen to change with timeout, then add buffer delay"""
-        start_time = time.time()
-        check_count = 0
-        
-        def check_change():
-            nonlocal check_count
-            check_count += 1
-            elapsed_ms = (time.time() - start_time) * 1000
-            
-            if elapsed_ms > MAX_WAIT_FOR_CHANGE:
-                print(f"⏱️ Timeout reached ({MAX_WAIT_FOR_CHANGE}ms). Proceeding anyway...")
-                self.show_status("Proceeding...", "Screen check timeout - continuing", True)
-                QtCore.QTimer.singleShot(BUFFER_DELAY_MS, self._execute_next_step)
-                return
-            
-            with mss.mss() as sct:
-                monitor = sct.monitors[1]
-                img = sct.grab(monitor)
-                pil_img = Image.frombytes("RGB", img.size, img.rgb)
-                new_path = "temp_check_screen.png"
-                pil_img.save(new_path)
-            
-            if self.context.last_screenshot_path and os.path.exists(self.context.last_screenshot_path):
-                changed, diff = compare_screenshots(self.context.last_screenshot_path, new_path)
-                
-                if changed:
-                    print(f"✓ Screen changed! Adding {BUFFER_DELAY_MS}ms buffer...")
-                    self.show_status("Screen changed", f"Waiting {BUFFER_DELAY_MS}ms buffer", True)
-                    
-                    stable_path = "last_stable_screen.png"
-                    pil_img.save(stable_path)
-                    self.context.last_screenshot_path = stable_path
-                    
-                    QtCore.QTimer.singleShot(BUFFER_DELAY_MS, self._execute_next_step)
-                else:
-                    remaining_ms = MAX_WAIT_FOR_CHANGE - elapsed_ms
-                    self.show_status("Monitoring...", f"Waiting for screen change ({int(remaining_ms/1000)}s left)", True)
-                    print(f"⏳ Screen unchanged (check {check_count}), checking again...")
-                    QtCore.QTimer.singleShot(200, check_change)
-            else:
-                stable_path = "last_stable_screen.png"
-                pil_img.save(stable_path)
-                self.context.last_screenshot_path = stable_path
-                self.show_status("Ready", "Initial screen captured", True)
-                QtCore.QTimer.singleShot(BUFFER_DELAY_MS, self._execute_next_step)
+            print(f"⚠️ Step execution error: {e}")
+            self._show_error(f"Step execution failed: {e}")
+            return
         
-        QtCore.QTimer.singleShot(300, check_change)
+        if result.next_action == EngineResult.END:
+            self._execute_end(result.message)
+        elif result.next_action == EngineResult.ASK:
+            self._execute_ask_question(result.message)
+        else:
+            QtCore.QTimer.singleShot(HIDE_AND_CAPTURE_DELAY_MS, 
+                                    lambda: self.capture_and_process(self.context.original_task))
     
-    def _execute_ask_question(self, step):
-        question = step.get("question", "Need more information")
+    def _execute_ask_question(self, question):
         self.hide_status()
         self.update_status(f"Question: {question}")
-        self.context.add_step_completed(step)
         self.show()
         self.input.setDisabled(False)
         self.input.setPlaceholderText(f"Answer: {question}")
         self.input.setFocus()
     
-    def _execute_end(self, step):
-        message = step.get("message", "Task completed!")
+    def _execute_end(self, message):
+        print(f"📊 {self.parse_cache.task_summary()}")
+        print(f"📊 Speculative parses: {self.pipeline.speculation_stats}")
+        tracer.finish_task("completed")
         self.hide_status()
-        QtWidgets.QMessageBox.information(self, "Task Complete", message)
+        self.show_message("Task Complete", message)
         self.context.reset()
         status_text = "Ready - Enter a new task"
         if self._voice_enabled:
@@ -1301,10 +4688,17 @@ class VirtualAssistant(QtWidgets.QWidget):
         self.input.setDisabled(False)
         self.input.setFocus()
     
+    def show_message(self, title, text, warning=False):
+        """Modal message to the user (overridden by headless front ends)"""
+        if warning:
+            QtWidgets.QMessageBox.warning(self, title, text)
+        else:
+            QtWidgets.QMessageBox.information(self, title, text)
+    
     @QtCore.pyqtSlot(str)
     def _show_error(self, msg):
         self.hide_status()
-        QtWidgets.QMessageBox.warning(self, "Error", f"{msg}")
+        self.show_message("Error", f"{msg}", warning=True)
         self.show()
         self.input.setDisabled(False)
         self.input.setFocus()
@@ -1312,15 +4706,453 @@ class VirtualAssistant(QtWidgets.QWidget):
     def closeEvent(self, event):
         """Clean up when closing"""
         self.stop_voice_recognition()
+        if self.context.original_task:
+            tracer.finish_task("closed")
+        self.engine_loop.stop()
+        self.engine.close()
+        self.capture.close()
+        self.pipeline.close()
+        self.omniparser.close()
         event.accept()
 
 
+class AgentSession:
+    """One agent on one display with no windows: capture, parse, plan and act until the task ends.
+    
+    The headless counterpart of VirtualAssistant, run by the daemon once per
+    display. Statuses, turns and steps are reported as event dicts to the
+    `on_event` callback given to run_task().
+    """
+    def __init__(self, display=None, capture=None, planner=None, omniparser=None, input_backend=None):
+        self.display = display
+        self.capture = capture or CaptureService(display=display)
+        if input_backend is None:
+            input_backend = XdotoolBackend(display) if display else PyAutoGuiBackend()
+        self.input_backend = input_backend
+        self.planner = planner or PlannerClient()
+        self.omniparser = omniparser or OmniParserClient()
+        self.parse_cache = ParseCache()
+        self.incremental_parser = IncrementalParser(self.omniparser)
+        self.pipeline = TurnPipeline(self.planner, self.omniparser, self.incremental_parser,
+                                     self.parse_cache, self.capture)
+        self.engine = ActionEngine(self.capture, self.input_backend, ui=self, pipeline=self.pipeline,
+                                   on_event=self._emit)
+        self._on_event = None
+    
+    def _emit(self, event):
+        if self._on_event is not None:
+            self._on_event(event)
+    
+    def show_status(self, status, detail="", show_progress=True):
+        self._emit({"event": "status", "status": status, "detail": detail})
+    
+    def hide_status(self):
+        pass
+    
+    async def run_task(self, task, on_event=None, max_turns=DAEMON_MAX_TURNS):
+        """Run `task` until the planner ends it or asks a question; returns (outcome, message)
+        
+        outcome is "completed", "question" or "error".
+        """
+        self._on_event = on_event
+        context = TaskContext()
+        context.original_task = task
+        self.parse_cache.start_task()
+        loop = asyncio.get_running_loop()
+        try:
+            for turn in range(1, max_turns + 1):
+                frame = await self.engine.watcher.grab()
+                context.last_frame = frame
+                result = await loop.run_in_executor(None, self.pipeline.run, task, frame, context, self.show_status)
+                if result.drift >= SCREEN_CHANGE_THRESHOLD:
+                    context.last_frame = result.latest_frame
+                
+                steps = result.response_json.get("steps") if isinstance(result.response_json, dict) else None
+                if not isinstance(steps, list) or not steps:
+                    return "error", "Invalid response format from AI"
+                self._emit({"event": "turn", "turn": turn, "elements": len(result.elements),
+                            "wall_ms": round(result.wall_ms, 1), "steps": steps})
+                outcome = await self.engine.run(steps, result.store, context)
+                if outcome.next_action == EngineResult.END:
+                    return "completed", outcome.message
+                if outcome.next_action == EngineResult.ASK:
+                    return "question", outcome.message
+            return "error", f"No end step after {max_turns} turns"
+        finally:
+            self.pipeline.discard_speculation()
+            self._on_event = None
+    
+    def close(self):
+        self.engine.close()
+        self.pipeline.close()
+        self.omniparser.close()
+        self.capture.close()
+
+
+class SessionPool:
+    """Builds agent sessions that share one pooled OmniParser client and one planner.
+    
+    Each session has its own display, capture session, input backend, parse
+    cache and action engine. Requests to the shared services go through a
+    FairGate per service (at most SHARED_*_MAX_INFLIGHT at once, free slots
+    handed out round-robin across sessions) and a per-session RateLimiter when
+    SESSION_*_RPM is set.
+    """
+    def __init__(self, omniparser=None, planner=None, omniparser_inflight=SHARED_OMNIPARSER_MAX_INFLIGHT,
+                 planner_inflight=SHARED_PLANNER_MAX_INFLIGHT, omniparser_rpm=SESSION_OMNIPARSER_RPM,
+                 planner_rpm=SESSION_PLANNER_RPM):
+        self.omniparser = omniparser or OmniParserClient(pool_size=omniparser_inflight)
+        self.planner = planner or PlannerClient()
+        self.omniparser_gate = FairGate("omniparser", omniparser_inflight)
+        self.planner_gate = FairGate("planner", planner_inflight)
+        self.omniparser_rpm = omniparser_rpm
+        self.planner_rpm = planner_rpm
+        self.sessions = []
+    
+    def create_session(self, display=None, capture=None, input_backend=None):
+        key = display or f"session-{len(self.sessions) + 1}"
+        omniparser = self.omniparser.for_session(
+            key, self.omniparser_gate, RateLimiter(self.omniparser_rpm) if self.omniparser_rpm else None)
+        planner = self.planner.for_session(
+            key, self.planner_gate, RateLimiter(self.planner_rpm) if self.planner_rpm else None)
+        session = AgentSession(display, capture=capture, planner=planner, omniparser=omniparser,
+                               input_backend=input_backend)
+        self.sessions.append(session)
+        return session
+    
+    def stats(self):
+        """Per-gate queueing stats and per-session call counts"""
+        return {
+            "omniparser": dict(self.omniparser_gate.stats),
+            "planner": dict(self.planner_gate.stats),
+            "sessions": {session.planner.session_key: {"planner_calls": session.planner.call_count,
+                                                       "omniparser_calls": session.omniparser.stats["calls"]}
+                         for session in self.sessions},
+        }
+    
+    def close(self):
+        self.omniparser.close()
+
+
+class DaemonTask:
+    """A task submitted to the daemon, with its event history and live event subscribers"""
+    FINISHED = ("completed", "question", "error", "cancelled")
+    
+    def __init__(self, task_id, text, loop):
+        self.id = task_id
+        self.text = text
+        self.status = "queued"
+        self.message = ""
+        self.display = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.events = deque(maxlen=DAEMON_EVENT_HISTORY)
+        self.subscribers = set()
+        self.runner = None
+        self._loop = loop
+    
+    @property
+    def done(self):
+        return self.status in self.FINISHED
+    
+    def emit(self, event):
+        """Record an event and pass it to streaming clients; safe to call from any thread"""
+        event = dict(event, task=self.id, t=round(time.time(), 3))
+        self._loop.call_soon_threadsafe(self._publish, event)
+    
+    def _publish(self, event):
+        self.events.append(event)
+        for subscriber in self.subscribers:
+            subscriber.put_nowait(event)
+    
+    def summary(self):
+        return {"id": self.id, "task": self.text, "status": self.status, "message": self.message,
+                "display": self.display, "created": self.created, "started": self.started,
+                "finished": self.finished, "events": len(self.events)}
+
+
+class TaskDaemon:
+    """Runs headless agents and accepts tasks over a local HTTP API.
+    
+    One worker per display (DAEMON_DISPLAYS, capped at `concurrency`) takes
+    tasks from a FIFO queue and runs them with its own AgentSession, so tasks
+    on different displays run in parallel and the rest wait their turn.
+    Sessions come from a SessionPool unless `session_factory` is given. No
+    overlay, voice indicator, button panel or microphone is created. The API is
+    HTTP/1.1 over TCP or a Unix socket, one request per connection:
+    
+        POST   /tasks              {"task": "..."} -> the queued task
+        GET    /tasks              all tasks
+        GET    /tasks/<id>         one task
+        GET    /tasks/<id>/events  newline-delimited JSON events, ending with a "done" event
+        DELETE /tasks/<id>         cancel a queued or running task
+        GET    /health
+    
+    Spans of all tasks go to one trace, written whenever the daemon becomes idle.
+    """
+    def __init__(self, displays=None, concurrency=DAEMON_CONCURRENCY, session_factory=None):
+        displays = list(displays if displays is not None else DAEMON_DISPLAYS) or [None]
+        if concurrency > len(displays):
+            print(f"⚠️ {len(displays)} display(s) available, running {len(displays)} task(s) at once")
+        self.displays = displays[:max(1, concurrency)]
+        self.pool = None
+        if session_factory is None:
+            self.pool = SessionPool()
+            session_factory = self.pool.create_session
+        self.session_factory = session_factory
+        self.tasks = OrderedDict()
+        self.sessions = []
+        self.address = None
+        self.loop = None
+        self.queue = None
+        self._workers = []
+        self._server = None
+        self._running = 0
+    
+    async def start(self, listen=DAEMON_LISTEN, socket_path=None):
+        """Create the sessions, start the workers and listen; returns the address"""
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        for display in self.displays:
+            session = self.session_factory(display)
+            self.sessions.append(session)
+            self._workers.append(asyncio.ensure_future(self._worker(session)))
+        
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)  # Left over from a daemon that was killed
+            self._server = await asyncio.start_unix_server(self._handle, path=socket_path)
+            self.address = socket_path
+        else:
+            host, _, port = listen.rpartition(":")
+            self._server = await asyncio.start_server(self._handle, host or "127.0.0.1", int(port))
+            host, port = self._server.sockets[0].getsockname()[:2]
+            self.address = f"http://{host}:{port}"
+        print(f"🛰️ Daemon listening on {self.address} with {len(self.sessions)} worker(s) on "
+              + ", ".join(display or "the current display" for display in self.displays))
+        return self.address
+    
+    async def serve_forever(self):
+        await self._server.serve_forever()
+    
+    async def stop(self):
+        """Stop listening, cancel running tasks and close the sessions"""
+        self._server.close()
+        await self._server.wait_closed()
+        for task in self.tasks.values():
+            if task.runner is not None and not task.done:
+                task.runner.cancel()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        for session in self.sessions:
+            session.close()
+        if self.pool is not None:
+            self.pool.close()
+    
+    def submit(self, text):
+        """Queue a task; returns its DaemonTask"""
+        task = DaemonTask(uuid.uuid4().hex[:12], text, self.loop)
+        self.tasks[task.id] = task
+        self.queue.put_nowait(task)
+        task.emit({"event": "queued", "position": self.queue.qsize()})
+        print(f"🛰️ Task {task.id} queued: {text}")
+        return task
+    
+    def cancel(self, task):
+        """Cancel a queued or running task; returns False if it had already finished"""
+        if task.done:
+            return False
+        if task.runner is not None:
+            task.runner.cancel()  # The worker records the cancellation
+        else:
+            self._finish(task, "cancelled", "Cancelled before it started")
+        return True
+    
+    def _finish(self, task, status, message):
+        task.status = status
+        task.message = message
+        task.finished = time.time()
+        task.emit({"event": "done", "status": status, "message": message})
+        print(f"🛰️ Task {task.id} {status}: {message}")
+        finished = [t for t in self.tasks.values() if t.done]
+        for old in finished[:max(0, len(finished) - DAEMON_TASK_HISTORY)]:
+            del self.tasks[old.id]
+    
+    async def _worker(self, session):
+        while True:
+            task = await self.queue.get()
+            if task.done:
+                continue  # Cancelled while queued
+            task.status = "running"
+            task.display = session.display
+            task.started = time.time()
+            task.emit({"event": "started", "display": session.display})
+            if self._running == 0:
+                tracer.start_task(task.text)
+            self._running += 1
+            task.runner = asyncio.ensure_future(session.run_task(task.text, task.emit))
+            try:
+                await asyncio.wait([task.runner])
+            finally:
+                self._running -= 1
+            
+            if task.runner.cancelled():
+                status, message = "cancelled", "Cancelled"
+            elif task.runner.exception() is not None:
+                status, message = "error", str(task.runner.exception())
+            else:
+                status, message = task.runner.result()
+            self._finish(task, status, message)
+            if self._running == 0:
+                tracer.finish_task(status)
+    
+    async def _handle(self, reader, writer):
+        """Serve one request per connection"""
+        try:
+            method, path, body = await self._read_request(reader)
+            await self._route(method, path, body, writer)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # Client went away
+        except Exception as e:
+            self._send_json(writer, 400, {"error": str(e)})
+        finally:
+            writer.close()
+    
+    @staticmethod
+    async def _read_request(reader):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) < 2:
+            raise ValueError("Bad request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        body = await reader.readexactly(length) if length else b""
+        path = request_line[1].split("?")[0].rstrip("/") or "/"
+        return request_line[0].upper(), path, body
+    
+    @staticmethod
+    def _send_json(writer, status, payload):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + body)
+    
+    async def _route(self, method, path, body, writer):
+        parts = path.strip("/").split("/")
+        if path == "/health":
+            self._send_json(writer, 200, {"status": "ok", "workers": len(self.sessions),
+                                          "running": self._running, "queued": self.queue.qsize(),
+                                          "shared": self.pool.stats() if self.pool else None})
+            return
+        if parts[0] != "tasks" or len(parts) > 3:
+            self._send_json(writer, 404, {"error": "not found"})
+            return
+        
+        if len(parts) == 1:
+            if method == "POST":
+                payload = json.loads(body or b"{}")
+                text = str(payload.get("task", "")).strip() if isinstance(payload, dict) else ""
+                if not text:
+                    self._send_json(writer, 400, {"error": "missing task"})
+                    return
+                self._send_json(writer, 202, self.submit(text).summary())
+            elif method == "GET":
+                self._send_json(writer, 200, {"tasks": [task.summary() for task in self.tasks.values()]})
+            else:
+                self._send_json(writer, 405, {"error": "method not allowed"})
+            return
+        
+        task = self.tasks.get(parts[1])
+        if task is None:
+            self._send_json(writer, 404, {"error": "no such task"})
+        elif len(parts) == 3 and parts[2] == "events" and method == "GET":
+            await self._stream_events(task, writer)
+        elif len(parts) == 3:
+            self._send_json(writer, 404, {"error": "not found"})
+        elif method == "GET":
+            self._send_json(writer, 200, task.summary())
+        elif method == "DELETE":
+            if self.cancel(task):
+                self._send_json(writer, 202, task.summary())
+            else:
+                self._send_json(writer, 409, {"error": f"task already {task.status}"})
+        else:
+            self._send_json(writer, 405, {"error": "method not allowed"})
+    
+    async def _stream_events(self, task, writer):
+        """Send the task's events so far, then live ones, one JSON object per line"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        queue = asyncio.Queue()
+        history = list(task.events)
+        task.subscribers.add(queue)
+        try:
+            for event in history:
+                writer.write(json.dumps(event, default=str).encode("utf-8") + b"\n")
+                if event["event"] == "done":
+                    return
+            await writer.drain()
+            while True:
+                event = await queue.get()
+                writer.write(json.dumps(event, default=str).encode("utf-8") + b"\n")
+                await writer.drain()
+                if event["event"] == "done":
+                    return
+        finally:
+            task.subscribers.discard(queue)
+
+
+def run_daemon(listen=DAEMON_LISTEN, socket_path=None, displays=None, concurrency=DAEMON_CONCURRENCY):
+    """Serve the task API until the process is stopped"""
+    async def serve():
+        daemon = TaskDaemon(displays, concurrency)
+        await daemon.start(listen, socket_path)
+        try:
+            await daemon.serve_forever()
+        finally:
+            await daemon.stop()
+    
+    asyncio.run(serve())
+
+
 def main():
-    app = QtWidgets.QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="AI assistant with OmniParser screen understanding")
+    parser.add_argument("--daemon", action="store_true",
+                        help="run headless agents behind a local task API (no windows, no microphone)")
+    parser.add_argument("--listen", default=DAEMON_LISTEN, help="host:port of the daemon's HTTP API")
+    parser.add_argument("--socket", help="serve the daemon API on this Unix socket instead")
+    parser.add_argument("--displays", help="comma-separated X displays for daemon agents, e.g. :1,:2")
+    parser.add_argument("--concurrency", type=int, help="daemon tasks run at once (default: one per display)")
+    parser.add_argument("--enroll-wake-word", action="store_true",
+                        help=f"record the wake word {WAKE_WORD_ENROLL_SAMPLES} times for local detection")
+    parser.add_argument("--trace", action="store_true",
+                        help=f"write a Chrome trace per task to {TRACE_DIR}/ (keeps the newest {TRACE_KEEP})")
+    args, qt_args = parser.parse_known_args()
+    if args.trace:
+        tracer.enabled = True
+    if args.enroll_wake_word:
+        enroll_wake_word()
+        return
+    if args.daemon:
+        displays = args.displays.split(",") if args.displays else list(DAEMON_DISPLAYS)
+        concurrency = args.concurrency or (len(displays) if args.displays else DAEMON_CONCURRENCY)
+        run_daemon(args.listen, args.socket, displays, concurrency)
+        return
+    
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
     app.setQuitOnLastWindowClosed(False)
     assistant = VirtualAssistant()
     assistant.show()
     assistant.input.setFocus()
+    QtCore.QTimer.singleShot(0, assistant.start_background_work)
     sys.exit(app.exec_())
 
 
@@ -0,0 +1,2100 @@
+"""
+Benchmarks for the Virtual Assistant screen pipeline.
+
+Usage:
+python benchmark.py capture [--width 3840 --height 2160 --iterations 20] [--live]
+python benchmark.py change [--width 3840 --height 2160 --iterations 50]
+python benchmark.py gui-latency [--width 3840 --height 2160 --duration 5]
+python benchmark.py planner [--calls 20 --latency-ms 0]
+python benchmark.py omniparser [--calls 20 --latency-ms 50 --fail-rate 0.2] [--url URL]
+python benchmark.py annotate [--width 3840 --height 2160 --turns 10 --elements 120]
+python benchmark.py upload [--width 3840 --height 2160 --elements 120 --mbps 20]
+python benchmark.py pipeline [--turns 5 --parse-ms 800 --gemini-ms 1500 --mbps 20 --wait-ms 1000]
+python benchmark.py settle [--frames DIR ...]
+python benchmark.py record-frames --out DIR [--duration 5 --interval-ms 40]
+python benchmark.py trace-summary [traces/*.json]
+python benchmark.py engine [--engines 4 --batches 3 --errors 0]
+python benchmark.py daemon [--tasks 4 --concurrency 2]
+python benchmark.py sessions [--sessions 1 2 4 8 --tasks-per-session 2 --inflight 4]
+python benchmark.py startup [--runs 5 --budget-ms 400]
+python benchmark.py wake-word [--fixtures DIR --threshold 0.06]
+python benchmark.py voice [--fixtures DIR --commands 9] [--realtime]
+python benchmark.py voice-task [--tasks 3 --parse-ms 800 --speech-ms 2500]
+python benchmark.py elements [--elements 50 200 1000 --queries 2000]
+python benchmark.py tracking [--elements 40 150 500 --turns 20 --churn 3]
+python benchmark.py prompt [--turns 200 --elements 150 --budget 2000]
+python benchmark.py agent [--tasks 3 --parse-ms 300 --gemini-ms 800] [--frames DIR] [--responses DIR]
+"""
+import argparse
+import asyncio
+import bisect
+import contextlib
+import glob
+import io
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import requests
+from PIL import Image
+
+import app
+from omniparser_stub import OmniParserStubServer, canned_elements
+
+
+def synthetic_screen(width, height, seed=0):
+    """Build a desktop-like test image: flat panels, a few widgets and a noisy photo area"""
+    rng = np.random.default_rng(seed)
+    arr = np.empty((height, width, 3), dtype=np.uint8)
+    arr[:] = (236, 239, 244)
+    arr[: height // 20] = (45, 52, 64)  # title bar
+    arr[height - height // 25:] = (30, 30, 30)  # taskbar
+    for _ in range(40):
+        x = int(rng.integers(0, width - 200))
+        y = int(rng.integers(height // 20, height - 200))
+        w = int(rng.integers(60, 400))
+        h = int(rng.integers(20, 120))
+        arr[y:y + h, x:x + w] = rng.integers(0, 255, 3, dtype=np.uint8)
+    # Photo-like region, the expensive part for PNG
+    ph, pw = height // 4, width // 4
+    arr[height // 3:height // 3 + ph, width // 2:width // 2 + pw] = rng.integers(0, 255, (ph, pw, 3), dtype=np.uint8)
+    return Image.fromarray(arr, "RGB")
+
+
+def mutate_screen(img, seed):
+    """Return a copy of `img` with a small dialog-sized region changed"""
+    rng = np.random.default_rng(seed)
+    arr = np.array(img)
+    h, w = arr.shape[:2]
+    x = int(rng.integers(0, w - w // 8))
+    y = int(rng.integers(0, h - h // 8))
+    arr[y:y + h // 8, x:x + w // 8] = rng.integers(0, 255, 3, dtype=np.uint8)
+    return Image.fromarray(arr, "RGB")
+
+
+def report(name, samples_ms):
+    """Print mean/p50/p95 for a list of millisecond samples"""
+    samples = sorted(samples_ms)
+    p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+    print(f"{name:<32} mean {statistics.mean(samples):8.2f} ms   "
+          f"p50 {statistics.median(samples):8.2f} ms   p95 {p95:8.2f} ms")
+    return statistics.mean(samples)
+
+
+def bench_capture(args):
+    """Per-poll latency: legacy PNG round-trip through disk vs in-memory ScreenFrame"""
+    if args.live:
+        import mss
+        sct = mss.mss()
+        monitor = sct.monitors[1]
+        grab = lambda i: sct.grab(monitor)
+        first = grab(0)
+        size = first.size
+    else:
+        base = synthetic_screen(args.width, args.height)
+        shots = [base, mutate_screen(base, 1)]
+        raw = [img.convert("RGBA").tobytes("raw", "BGRA") for img in shots]
+        grab = lambda i: raw[i % 2]
+        size = base.size
+
+    def to_frame(shot):
+        if args.live:
+            return app.ScreenFrame.from_mss(shot)
+        return app.ScreenFrame(shot, size[0], size[1])
+
+    def to_pil_legacy(shot):
+        if args.live:
+            return Image.frombytes("RGB", shot.size, shot.rgb)
+        return Image.frombuffer("RGB", size, shot, "raw", "BGRX", 0, 1).copy()
+
+    print(f"Screen {size[0]}x{size[1]}, {args.iterations} iterations ({'live' if args.live else 'synthetic'})")
+    tmpdir = tempfile.mkdtemp(prefix="va_bench_")
+    stable_path = os.path.join(tmpdir, "last_stable_screen.png")
+    check_path = os.path.join(tmpdir, "temp_check_screen.png")
+    to_pil_legacy(grab(0)).save(stable_path)
+
+    legacy = []
+    for i in range(args.iterations):
+        start = time.perf_counter()
+        to_pil_legacy(grab(i)).save(check_path)
+        app.compare_screenshots(stable_path, check_path)
+        legacy.append((time.perf_counter() - start) * 1000)
+
+    last = to_frame(grab(0))
+    detector = app.ChangeDetector()
+    in_memory = []
+    for i in range(args.iterations):
+        start = time.perf_counter()
+        frame = to_frame(grab(i))
+        detector.compare(last, frame, find_regions=False)
+        in_memory.append((time.perf_counter() - start) * 1000)
+
+    upload = []
+    for i in range(max(1, args.iterations // 4)):
+        frame = to_frame(grab(i))
+        start = time.perf_counter()
+        frame.encode("PNG")
+        upload.append((time.perf_counter() - start) * 1000)
+
+    print()
+    legacy_mean = report("legacy poll (save + reload)", legacy)
+    memory_mean = report("in-memory poll", in_memory)
+    report("PNG encode for upload", upload)
+    print(f"\nSpeedup per poll: {legacy_mean / memory_mean:.1f}x")
+
+    if args.live:
+        # Grab cost alone: a new mss session per grab vs the persistent CaptureService
+        import mss
+        fresh, persistent, region = [], [], []
+        service = app.CaptureService()
+        roi = service.region_around((size[0] // 2 - 50, size[1] // 2 - 20, size[0] // 2 + 50, size[1] // 2 + 20))
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            with mss.mss() as fresh_sct:
+                fresh_sct.grab(fresh_sct.monitors[1])
+            fresh.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            service.grab()
+            persistent.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            service.grab(roi)
+            region.append((time.perf_counter() - start) * 1000)
+        service.close()
+        print()
+        report("grab, new mss session", fresh)
+        report("grab, CaptureService", persistent)
+        report(f"grab, {roi[2] - roi[0]}x{roi[3] - roi[1]} region", region)
+
+
+def legacy_compare_arrays(arr1, arr2, threshold=app.SCREEN_CHANGE_THRESHOLD):
+    """The original compare_screenshots math (float64, full resolution) on decoded arrays"""
+    diff = np.abs(arr1.astype(float) - arr2.astype(float))
+    mean_diff = np.mean(diff) / 255.0
+    return mean_diff > threshold, mean_diff
+
+
+def bench_change(args):
+    """Per-check cost of compare_screenshots vs ChangeDetector"""
+    base = synthetic_screen(args.width, args.height)
+    changed = mutate_screen(base, 1)
+    frame_a = app.ScreenFrame.from_pil(base)
+    frame_b = app.ScreenFrame.from_pil(changed)
+    frame_same = app.ScreenFrame.from_pil(base)
+    print(f"Screen {args.width}x{args.height}, {args.iterations} iterations")
+
+    tmpdir = tempfile.mkdtemp(prefix="va_bench_")
+    path_a = os.path.join(tmpdir, "a.png")
+    path_b = os.path.join(tmpdir, "b.png")
+    base.save(path_a)
+    changed.save(path_b)
+
+    def timed(fn, iterations):
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    rgb_a, rgb_b = np.array(base), np.array(changed)
+    detector = app.ChangeDetector()
+    results = [
+        ("compare_screenshots (disk)", timed(lambda: app.compare_screenshots(path_a, path_b), max(1, args.iterations // 10))),
+        ("legacy math, in memory", timed(lambda: legacy_compare_arrays(rgb_a, rgb_b), max(1, args.iterations // 5))),
+        ("ChangeDetector + regions", timed(lambda: detector.compare(frame_a, frame_b), args.iterations)),
+        ("ChangeDetector, unchanged", timed(lambda: detector.compare(frame_a, frame_same, find_regions=False), args.iterations)),
+    ]
+    big = app.ChangeDetector()
+    big_change = app.ScreenFrame.from_pil(Image.new("RGB", base.size, (0, 0, 0)))
+    results.append(("ChangeDetector, early exit", timed(lambda: big.compare(frame_a, big_change, find_regions=False), args.iterations)))
+
+    print()
+    for name, samples in results:
+        report(name, samples)
+
+    result = detector.compare(frame_a, frame_b)
+    _, legacy_score = legacy_compare_arrays(rgb_a, rgb_b)
+    print(f"\nScore: legacy {legacy_score*100:.3f}%  detector {result.score*100:.3f}%")
+    print(f"Changed regions: {result.regions}")
+
+
+class StaticCapture:
+    """CaptureService stand-in that serves copies of a fixed frame (content never changes)"""
+    def __init__(self, frame):
+        self.frame = frame
+        self.monitor = {"left": 0, "top": 0, "width": frame.width, "height": frame.height}
+
+    def clip_region(self, region):
+        x1, y1, x2, y2 = (int(round(v)) for v in region)
+        return (max(0, x1), max(0, y1), min(x2, self.frame.width), min(y2, self.frame.height))
+
+    def grab(self, region=None):
+        # Copy the buffer like a real grab does
+        if region is not None:
+            return self.frame.crop(self.clip_region(region))
+        return app.ScreenFrame(bytearray(self.frame.bgra), self.frame.width, self.frame.height)
+
+    def close_thread_session(self):
+        pass
+
+
+class StubProcess:
+    """omniparser_stub.py running as a subprocess on a free local port"""
+
+    def __init__(self, **options):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "omniparser_stub.py"),
+               "--port", str(port), "--quiet"]
+        for key, value in options.items():
+            cmd += [f"--{key.replace('_', '-')}", str(value)]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+        self.url = f"http://127.0.0.1:{port}/process"
+        deadline = time.time() + 10
+        while True:
+            try:
+                requests.get(self.url.replace("/process", "/health"), timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.time() > deadline or self.proc.poll() is not None:
+                    self.stop()
+                    raise RuntimeError("OmniParser stub did not start")
+                time.sleep(0.05)
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait(5)
+
+
+def measure_event_loop_latency(qapp, duration_s, interval_ms=10):
+    """Run the Qt event loop for `duration_s` and return how late each timer tick fired (ms)"""
+    from PyQt5 import QtCore
+
+    lateness = []
+    last = [time.perf_counter()]
+
+    def tick():
+        now = time.perf_counter()
+        lateness.append(max(0.0, (now - last[0]) * 1000 - interval_ms))
+        last[0] = now
+
+    timer = QtCore.QTimer()
+    timer.setTimerType(QtCore.Qt.PreciseTimer)
+    timer.timeout.connect(tick)
+    loop = QtCore.QEventLoop()
+    QtCore.QTimer.singleShot(int(duration_s * 1000), loop.quit)
+    last[0] = time.perf_counter()
+    timer.start(interval_ms)
+    loop.exec_()
+    timer.stop()
+    return lateness
+
+
+def bench_gui_latency(args):
+    """Event-loop latency while the screen is being monitored, GUI-thread polling vs ScreenWatcher"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5 import QtCore, QtWidgets
+
+    qapp = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    base = synthetic_screen(args.width, args.height)
+    baseline = app.ScreenFrame.from_pil(base)
+    capture = StaticCapture(baseline)
+    grab = capture.grab
+    print(f"Screen {args.width}x{args.height}, {args.duration}s per scenario, 10ms probe timer")
+
+    results = [("idle", measure_event_loop_latency(qapp, args.duration))]
+
+    # Legacy: grab, PNG save and compare_screenshots on the GUI thread every poll
+    tmpdir = tempfile.mkdtemp(prefix="va_bench_")
+    stable_path = os.path.join(tmpdir, "last_stable_screen.png")
+    check_path = os.path.join(tmpdir, "temp_check_screen.png")
+    base.save(stable_path)
+
+    def legacy_poll():
+        grab().to_pil().save(check_path)
+        app.compare_screenshots(stable_path, check_path)
+
+    legacy_timer = QtCore.QTimer()
+    legacy_timer.timeout.connect(legacy_poll)
+    legacy_timer.start(app.POLL_INTERVAL_MS)
+    results.append(("GUI-thread polling (legacy)", measure_event_loop_latency(qapp, args.duration)))
+    legacy_timer.stop()
+
+    # Worker: ScreenWatcher polls on the engine loop thread and does all image work on its own thread
+    loop = app.EngineLoop()
+    watcher = app.ScreenWatcher(capture)
+    checks = [0]
+
+    async def watch_forever():
+        while True:
+            await watcher.wait(baseline, on_check=lambda *a: checks.__setitem__(0, checks[0] + 1))
+
+    future = loop.submit(watch_forever())
+    results.append(("ScreenWatcher", measure_event_loop_latency(qapp, args.duration)))
+    future.cancel()
+    loop.stop()
+    watcher.close()
+
+    print()
+    for name, samples in results:
+        samples = sorted(samples)
+        p95 = samples[int(0.95 * (len(samples) - 1))]
+        print(f"{name:<30} ticks {len(samples):5d}   p50 {statistics.median(samples):7.2f} ms   "
+              f"p95 {p95:7.2f} ms   max {samples[-1]:7.2f} ms")
+    print(f"\nScreen watcher completed {checks[0]} checks")
+
+
+class ScriptedResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class ScriptedTokenCount:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+
+def count_text_tokens(text):
+    """Rough subword count: words split into 4-character pieces, plus punctuation"""
+    return sum(max(1, -(-len(piece) // 4)) if piece[0].isalnum() else 1
+               for piece in re.findall(r"\w+|[^\w\s]", text))
+
+
+class ScriptedPlannerModel:
+    """Offline stand-in for genai.GenerativeModel that replays canned responses"""
+    DEFAULT_RESPONSE = '```json\n{"steps": [{"type": "wait_and_send_image", "description": "Wait"}]}\n```'
+
+    def __init__(self, responses=None, latency_ms=0.0):
+        self.responses = list(responses or [self.DEFAULT_RESPONSE])
+        self.latency_ms = latency_ms
+        self.calls = []
+
+    def generate_content(self, contents):
+        self.calls.append(contents)
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        return ScriptedResponse(self.responses[(len(self.calls) - 1) % len(self.responses)])
+
+    def count_tokens(self, contents):
+        """Word-piece count standing in for the Gemini tokenizer"""
+        text = contents if isinstance(contents, str) else " ".join(c for c in contents if isinstance(c, str))
+        return ScriptedTokenCount(count_text_tokens(text))
+
+
+def bench_planner(args):
+    """Per-call planner overhead: client rebuilt every turn vs a long-lived PlannerClient"""
+    tmpdir = tempfile.mkdtemp(prefix="va_bench_")
+    image_path = os.path.join(tmpdir, "annotated.png")
+    synthetic_screen(1920, 1080).save(image_path)
+    elements = [{"type": "icon", "bbox": [0.1, 0.1, 0.2, 0.2], "content": f"Item {i}"} for i in range(60)]
+    cwd = os.getcwd()
+    os.chdir(tmpdir)  # save_prompt writes gemini_prompt_*.txt
+    try:
+        import google.generativeai as genai
+
+        rebuild = []
+        for _ in range(args.calls):
+            start = time.perf_counter()
+            genai.configure(api_key="offline")
+            genai.GenerativeModel(app.MODEL_NAME)
+            client = app.PlannerClient(api_key="offline", model=ScriptedPlannerModel(latency_ms=args.latency_ms))
+            client.plan("open chrome", image_path, elements)
+            rebuild.append((time.perf_counter() - start) * 1000)
+
+        model = ScriptedPlannerModel(latency_ms=args.latency_ms)
+        client = app.PlannerClient(api_key="offline", model=model)
+        reused = []
+        stages = {}
+        for _ in range(args.calls):
+            start = time.perf_counter()
+            client.plan("open chrome", image_path, elements)
+            reused.append((time.perf_counter() - start) * 1000)
+            for key, value in client.last_timings.items():
+                stages.setdefault(key, []).append(value)
+    finally:
+        os.chdir(cwd)
+
+    prompt_chars = len(model.calls[-1][0])
+    print()
+    report("client rebuilt per call", rebuild)
+    report("long-lived PlannerClient", reused)
+    print()
+    for key, values in stages.items():
+        report(f"  {key}", values)
+    print(f"\nPer-turn prompt: {prompt_chars} chars (the {len(app.SYSTEM_PROMPT)}-char system prompt is the model's system instruction)")
+
+
+def bench_omniparser(args):
+    """OmniParser request latency and failure handling: bare requests.post vs OmniParserClient"""
+    import requests
+
+    server = None
+    url = args.url
+    if url is None:
+        server = OmniParserStubServer(latency_ms=args.latency_ms).start()
+        url = server.url
+    frame = app.ScreenFrame.from_pil(synthetic_screen(1920, 1080))
+    payload = frame.encode("PNG")
+    print(f"Endpoint {url}, {len(payload) / 1024:.0f} KiB upload, {args.calls} calls")
+    data = {"box_threshold": 0.05, "iou_threshold": 0.1}
+
+    bare = []
+    for _ in range(args.calls):
+        start = time.perf_counter()
+        requests.post(url, files={"image": ("screen.png", payload, "image/png")}, data=data, timeout=30).json()
+        bare.append((time.perf_counter() - start) * 1000)
+
+    client = app.OmniParserClient(url)
+    pooled = []
+    for _ in range(args.calls):
+        start = time.perf_counter()
+        client.request(frame)
+        pooled.append((time.perf_counter() - start) * 1000)
+    client.close()
+
+    print()
+    report("requests.post per call", bare)
+    report("OmniParserClient (pooled)", pooled)
+
+    if server is None:
+        return
+
+    # Transient failures: the stub answers a fraction of requests with 503
+    server.fail_rate = args.fail_rate
+    client = app.OmniParserClient(url, backoff_s=0.01, breaker=app.CircuitBreaker(threshold=args.calls + 1))
+    ok = 0
+    for _ in range(args.calls):
+        try:
+            client.request(frame)
+            ok += 1
+        except app.OmniParserError:
+            pass
+    bare_ok = sum(
+        requests.post(url, files={"image": ("screen.png", payload, "image/png")}, data=data).status_code == 200
+        for _ in range(args.calls)
+    )
+    print(f"\nWith {args.fail_rate:.0%} injected 503s: bare success {bare_ok}/{args.calls}, "
+          f"client success {ok}/{args.calls} ({client.stats['retries']} retries)")
+    client.close()
+    server.stop()
+
+    # Dead server: the breaker turns repeated multi-second failures into instant rejections
+    client = app.OmniParserClient(url, connect_timeout=1, max_retries=1, backoff_s=0.01)
+    dead = []
+    for _ in range(6):
+        start = time.perf_counter()
+        kind = "ok"
+        try:
+            client.request(frame)
+        except app.OmniParserError as e:
+            kind = "rejected" if isinstance(e, app.CircuitOpenError) else "failed"
+        dead.append((kind, (time.perf_counter() - start) * 1000))
+    print("Server down: " + ", ".join(f"{kind} {ms:.0f}ms" for kind, ms in dead)
+          + f" (breaker {client.breaker.state})")
+    client.close()
+
+
+def bench_annotate(args):
+    """Bytes transferred and latency per turn: server-annotated image vs local annotation"""
+    server = OmniParserStubServer(latency_ms=args.latency_ms, elements=args.elements).start()
+    frame = app.ScreenFrame.from_pil(synthetic_screen(args.width, args.height))
+    frame.encode("PNG")  # Upload encoding is the same for both modes
+    print(f"Screen {args.width}x{args.height}, {args.elements} elements, {args.turns} turns, "
+          f"stub latency {args.latency_ms:.0f}ms")
+
+    rows = []
+    for name, local in (("server image_base64", False), ("local annotation", True)):
+        client = app.OmniParserClient(server.url)
+        samples = []
+        for _ in range(args.turns):
+            start = time.perf_counter()
+            _, img = client.parse(frame, local_annotation=local)
+            img.load()  # PIL decodes lazily; the planner would pay this cost otherwise
+            samples.append((time.perf_counter() - start) * 1000)
+        rows.append((name, samples, client.stats["bytes_sent"] / args.turns, client.stats["bytes_received"] / args.turns))
+        client.close()
+    server.stop()
+
+    print()
+    for name, samples, sent, received in rows:
+        mean = report(name, samples)
+        transfer_ms = (sent + received) * 8 / (args.mbps * 1e6) * 1000
+        print(f"{'':<32} sent {sent / 1024:8.0f} KiB   received {received / 1024:8.1f} KiB per turn   "
+              f"~{mean + transfer_ms:.0f}ms per turn at {args.mbps:g} Mbit/s")
+
+    start = time.perf_counter()
+    app.annotate_elements(frame.to_pil(), server.elements)
+    print(f"\nannotate_elements alone: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+def bench_upload(args):
+    """Encoded size and encode time of the Gemini upload across long-edge/format settings"""
+    frame = app.ScreenFrame.from_pil(synthetic_screen(args.width, args.height))
+    elements = canned_elements(args.elements)
+    annotated = app.annotate_elements(frame.to_pil(), elements)
+    print(f"Screen {args.width}x{args.height}, {args.elements} elements, modelled link {args.mbps:g} Mbit/s\n")
+    print(f"{'policy':<30} {'size':>11} {'KiB':>8} {'prep ms':>8} {'encode ms':>10} {'upload ms':>10}")
+
+    for long_edge in (0, 2560, 1920, 1280):
+        for fmt in ("PNG", "JPEG", "WEBP"):
+            for crop in ((False, True) if args.crop else (False,)):
+                policy = app.UploadImagePolicy(long_edge, fmt, args.quality, crop_to_elements=crop)
+                _, stats = policy.prepare(annotated, elements, frame)
+                name = f"{long_edge or 'full'} {fmt}{' crop' if crop else ''}"
+                upload_ms = stats["bytes"] * 8 / (args.mbps * 1e6) * 1000
+                print(f"{name:<30} {stats['width']:>5}x{stats['height']:<5} {stats['bytes'] / 1024:8.0f} "
+                      f"{stats['resize_ms']:8.1f} {stats['encode_ms']:10.1f} {upload_ms:10.0f}")
+
+
+def bench_pipeline(args):
+    """Wall-clock per turn and stage timings: sequential stages vs TurnPipeline overlap"""
+    # The stub runs in its own process so its request handling does not compete for our GIL
+    server = StubProcess(latency_ms=args.parse_ms, elements=args.elements, mbps=args.mbps)
+    base = synthetic_screen(args.width, args.height)
+    capture = StaticCapture(app.ScreenFrame.from_pil(base))
+    print(f"Screen {args.width}x{args.height}, {args.elements} elements, OmniParser {args.parse_ms:.0f}ms "
+          f"over {args.mbps:g} Mbit/s, Gemini {args.gemini_ms:.0f}ms, {args.turns} turns")
+    tmpdir = tempfile.mkdtemp(prefix="va_bench_")
+    cwd = os.getcwd()
+    os.chdir(tmpdir)  # save_prompt writes gemini_prompt_*.txt
+    app.tracer.enabled = bool(args.trace_dir)
+    rows = []
+    try:
+        for name, overlap, stream, speculate in (
+                ("sequential", False, False, False), ("pipelined", True, False, False),
+                ("pipelined + streamed upload", True, True, False),
+                ("pipelined + streamed + speculative parse", True, True, True)):
+            client = app.OmniParserClient(server.url, stream_upload=stream)
+            planner = app.PlannerClient(api_key="offline", model=ScriptedPlannerModel(latency_ms=args.gemini_ms))
+            pipeline = app.TurnPipeline(planner, client, capture=capture, overlap=overlap)
+            app.tracer.start_task(f"benchmark pipeline: {name}")
+            walls, stages = [], {}
+            for turn in range(args.turns):
+                # A fresh frame each turn, so nothing is served from encode caches
+                frame = app.ScreenFrame.from_pil(mutate_screen(base, turn))
+                if speculate:
+                    # Parse starts when the screen settles; wait_and_send_image waits before asking for it
+                    pipeline.speculate(frame)
+                time.sleep(args.wait_ms / 1000.0)
+                result = pipeline.run("open chrome", frame)
+                walls.append(result.wall_ms)
+                for stage, (start, end) in result.timings.items():
+                    stages.setdefault(stage, []).append(end - start)
+            rows.append((name, walls, stages))
+            if args.trace_dir:
+                app.tracer.trace_dir = os.path.join(cwd, args.trace_dir)
+                app.tracer.finish_task("completed")
+            pipeline.close()
+            client.close()
+    finally:
+        os.chdir(cwd)
+        server.stop()
+
+    for name, walls, stages in rows:
+        print()
+        report(f"{name} (wall)", walls)
+        for stage, values in sorted(stages.items()):
+            report(f"  {stage}", values)
+
+
+def settle_scenarios(width, height):
+    """Synthetic frame sequences: (name, [(t_ms, PIL image)], expectation dict)"""
+    base = synthetic_screen(width, height, seed=0)
+    page = synthetic_screen(width, height, seed=5)
+    blank = Image.new("RGB", (width, height), (255, 255, 255))
+    page_arr = np.array(page)
+
+    def partial(rows):
+        arr = np.array(blank)
+        arr[:rows] = page_arr[:rows]
+        return Image.fromarray(arr, "RGB")
+
+    def spinner(img, step, box=40):
+        arr = np.array(img)
+        x, y = width // 2, height // 2
+        arr[y:y + box, x:x + box] = (230, 230, 230)
+        q = step % 4
+        qx, qy = x + (q % 2) * box // 2, y + (q // 2) * box // 2
+        arr[qy:qy + box // 2, qx:qx + box // 2] = (20, 90, 200)
+        return Image.fromarray(arr, "RGB")
+
+    def video(img, step, w=width // 3, h=height // 3):
+        arr = np.array(img)
+        rng = np.random.default_rng(step)
+        arr[height // 4:height // 4 + h, width // 4:width // 4 + w] = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+        return Image.fromarray(arr, "RGB")
+
+    bands = 8
+    slow = [(0, base), (300, blank)] + [(300 + 150 * (i + 1), partial(height * (i + 1) // bands)) for i in range(bands)]
+    return [
+        ("fast UI", [(0, base), (80, page)], {"expect_change": True, "content_done_ms": 80, "outcome": "settled"}),
+        ("late response", [(0, base), (1200, blank), (1400, page)],
+         {"expect_change": True, "content_done_ms": 1400, "outcome": "settled"}),
+        ("slow page load", slow, {"expect_change": True, "content_done_ms": 1500, "outcome": "settled"}),
+        ("spinner after load", [(0, base), (100, blank), (400, page)]
+         + [(400 + 60 * i, spinner(page, i)) for i in range(1, 150)],
+         {"expect_change": True, "content_done_ms": 400, "outcome": "settled"}),
+        ("video keeps playing", [(0, base)] + [(200 + 40 * i, video(page, i)) for i in range(0, 250)],
+         {"expect_change": True, "content_done_ms": 200, "outcome": "forced"}),
+        ("nothing happens", [(0, base)], {"expect_change": True, "content_done_ms": 0, "outcome": "timeout"}),
+        ("already still", [(0, base)], {"expect_change": False, "content_done_ms": 0, "outcome": "settled"}),
+    ]
+
+
+def load_recorded_sequence(directory):
+    """Frames saved by `record-frames` (<t_ms>.png) plus expected.json, if present"""
+    paths = sorted(glob.glob(os.path.join(directory, "*.png")),
+                   key=lambda p: float(os.path.splitext(os.path.basename(p))[0]))
+    frames = [(float(os.path.splitext(os.path.basename(p))[0]), Image.open(p).convert("RGB")) for p in paths]
+    expected = {"expect_change": True, "content_done_ms": None, "outcome": "settled"}
+    manifest = os.path.join(directory, "expected.json")
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            expected.update(json.load(f))
+    return os.path.basename(os.path.normpath(directory)), frames, expected
+
+
+class ReplayScreen:
+    """Serves the recorded frame that was on screen at a given time"""
+    def __init__(self, frames):
+        self.times = [t for t, _ in frames]
+        self.frames = [app.ScreenFrame.from_pil(img) for _, img in frames]
+
+    def at(self, t_ms, region=None):
+        frame = self.frames[max(0, bisect.bisect_right(self.times, t_ms) - 1)]
+        return frame.crop(region) if region is not None else frame
+
+
+def replay_settle(screen, expect_change, region=None):
+    """Drive a SettleDetector through a recording; returns (outcome, time ms, polls)"""
+    settle = app.SettleDetector(screen.at(0), region, expect_change)
+    now = 0.0
+    settle.start(now)
+    while True:
+        now += settle.interval_ms
+        state = settle.feed(screen.at(now, settle.next_region()), now)
+        if state == app.SettleDetector.SETTLED:
+            return ("forced" if settle.forced else "settled"), now, settle.polls
+        if state == app.SettleDetector.TIMEOUT:
+            return "timeout", now, settle.polls
+
+
+def replay_legacy(screen):
+    """The fixed-delay policy: first check after INITIAL_CHECK_DELAY_MS, then POLL_INTERVAL_MS, then BUFFER_DELAY_MS"""
+    detector = app.ChangeDetector()
+    baseline = screen.at(0)
+    now, polls = app.INITIAL_CHECK_DELAY_MS, 0
+    while now <= app.MAX_WAIT_FOR_CHANGE:
+        polls += 1
+        if detector.compare(baseline, screen.at(now), find_regions=False).changed:
+            return "settled", now + app.BUFFER_DELAY_MS, polls
+        now += app.POLL_INTERVAL_MS
+    return "timeout", now + app.BUFFER_DELAY_MS, polls
+
+
+def bench_settle(args):
+    """Replay frame sequences through the settle detector and the legacy fixed delays"""
+    if args.frames:
+        sequences = [load_recorded_sequence(d) for d in args.frames]
+    else:
+        sequences = settle_scenarios(args.width, args.height)
+    print(f"{'scenario':<22} {'legacy ms':>10} {'':<11} {'settle ms':>10} {'polls':>6} {'outcome':<9} result")
+    failures = 0
+    for name, frames, expected in sequences:
+        screen = ReplayScreen(frames)
+        done = expected.get("content_done_ms")
+        outcome, t, polls = replay_settle(screen, expected.get("expect_change", True))
+        if expected.get("expect_change", True):
+            _, legacy_t, _ = replay_legacy(screen)
+            legacy = f"{legacy_t:10.0f} {'mid-render' if done and legacy_t < done else '':<11}"
+        else:
+            legacy = f"{app.MAX_WAIT_FOR_CHANGE + app.BUFFER_DELAY_MS:10.0f} {'':<11}"
+
+        ok = outcome == expected.get("outcome", "settled")
+        if ok and outcome == "settled" and done is not None:
+            # Must not capture mid-render, and should not lag far behind the last change
+            ok = done <= t <= done + args.max_lag_ms + app.SETTLE_QUIET_MS
+        failures += not ok
+        print(f"{name:<22} {legacy} {t:10.0f} {polls:6d} {outcome:<9} {'ok' if ok else 'FAIL'}")
+    print(f"\n{len(sequences) - failures}/{len(sequences)} scenarios passed")
+    if failures:
+        sys.exit(1)
+
+
+def bench_record_frames(args):
+    """Record a live frame sequence for `settle --frames` (perform the UI action while it runs)"""
+    os.makedirs(args.out, exist_ok=True)
+    capture = app.CaptureService()
+    print(f"Recording {args.duration:.1f}s to {args.out} ...")
+    start = time.perf_counter()
+    count = 0
+    while time.perf_counter() - start < args.duration:
+        t_ms = (time.perf_counter() - start) * 1000
+        frame = capture.grab()
+        frame.save(os.path.join(args.out, f"{t_ms:08.0f}.png"))
+        count += 1
+        time.sleep(max(0.0, args.interval_ms / 1000.0 - ((time.perf_counter() - start) * 1000 - t_ms) / 1000.0))
+    capture.close()
+    with open(os.path.join(args.out, "expected.json"), "w") as f:
+        json.dump({"expect_change": True, "content_done_ms": None, "outcome": "settled"}, f, indent=2)
+    print(f"Saved {count} frames; edit expected.json to set content_done_ms")
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def bench_trace_summary(args):
+    """p50/p95 per stage across trace files written by the tracer"""
+    paths = []
+    for pattern in args.paths or [os.path.join(app.TRACE_DIR, "trace_*.json")]:
+        paths.extend(sorted(glob.glob(pattern)) or ([pattern] if os.path.exists(pattern) else []))
+    summarize_traces(paths)
+
+
+def summarize_traces(paths):
+    if not paths:
+        print("No trace files found")
+        return
+    spans, outcomes, tasks = {}, {}, []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            trace = json.load(f)
+        events = [e for e in trace.get("traceEvents", []) if e.get("ph") == "X"]
+        if not events:
+            continue
+        tasks.append((trace.get("metadata", {}).get("outcome", "?"),
+                      (max(e["ts"] + e["dur"] for e in events) - min(e["ts"] for e in events)) / 1000))
+        for e in events:
+            name = e["name"]
+            spans.setdefault(name, []).append(e["dur"] / 1000)
+            outcome = e.get("args", {}).get("outcome", "ok")
+            if outcome != "ok":
+                outcomes.setdefault(name, {}).setdefault(outcome, 0)
+                outcomes[name][outcome] += 1
+
+    print(f"{len(tasks)} task(s) from {len(paths)} file(s); outcomes: "
+          + ", ".join(f"{o} {sum(1 for t in tasks if t[0] == o)}" for o in sorted({t[0] for t in tasks})))
+    if tasks:
+        walls = sorted(t[1] for t in tasks)
+        print(f"task duration  p50 {percentile(walls, 0.5):.0f} ms   p95 {percentile(walls, 0.95):.0f} ms\n")
+    print(f"{'stage':<26} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'total s':>9}  other outcomes")
+    for name, values in sorted(spans.items(), key=lambda kv: -sum(kv[1])):
+        values.sort()
+        other = ", ".join(f"{k} {v}" for k, v in sorted(outcomes.get(name, {}).items()))
+        print(f"{name:<26} {len(values):6d} {percentile(values, 0.5):9.1f} {percentile(values, 0.95):9.1f} "
+              f"{values[-1]:9.1f} {sum(values) / 1000:9.2f}  {other}")
+
+
+class FakeScreen(StaticCapture):
+    """Capture stand-in serving a sequence of recorded frames; advance() moves to the next one"""
+    def __init__(self, frames):
+        super().__init__(frames[0])
+        self.frames = frames
+        self.index = 0
+
+    def region_around(self, bbox, padding=app.CLICK_REGION_PADDING):
+        x1, y1, x2, y2 = bbox
+        return self.clip_region((x1 - padding, y1 - padding, x2 + padding, y2 + padding))
+
+    def advance(self, action=None):
+        self.index = (self.index + 1) % len(self.frames)
+        self.frame = self.frames[self.index]
+
+    def close(self):
+        pass
+
+
+AGENT_SCRIPT = [
+    {"steps": [{"type": "click", "element_number": 3, "description": "Open the browser"},
+               {"type": "wait_and_send_image", "description": "Wait for the browser"}]},
+    {"steps": [{"type": "keyboard", "content": "lata mangeshkar songs", "description": "Search"},
+               {"type": "wait_and_send_image", "description": "Wait for results"}]},
+    {"steps": [{"type": "scroll", "magnitude": -3, "description": "Scroll results"},
+               {"type": "click", "element_number": 7, "double_click": True, "description": "Play"},
+               {"type": "wait_and_send_image", "description": "Check playback"}]},
+    {"steps": [{"type": "end", "message": "Playing"}]},
+]
+
+
+ENGINE_BATCH = [
+    {"type": "click", "element_number": 3, "description": "Open"},
+    {"type": "keyboard", "content": "hello", "description": "Type"},
+    {"type": "scroll", "magnitude": -3, "description": "Scroll"},
+    {"type": "wait_and_send_image", "description": "Check"},
+]
+
+
+async def run_engines(count, batches, frames, elements, error_steps):
+    """Run `count` engines on the current loop; returns (wall s, engines, max loop lag ms)"""
+    engines = []
+    for _ in range(count):
+        screen = FakeScreen(frames)
+        engine = app.ActionEngine(screen, app.NullInputBackend(on_action=screen.advance))
+        context = app.TaskContext()
+        context.last_frame = screen.grab()
+        engines.append((engine, context))
+    steps = ENGINE_BATCH + [{"type": "click", "element_number": 0, "description": "Invalid"}] * error_steps
+
+    async def drive(engine, context):
+        for _ in range(batches):
+            await engine.run(steps, elements, context)
+
+    lag = [0.0]
+
+    async def probe(interval=0.01):
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(interval)
+            lag[0] = max(lag[0], (time.perf_counter() - t - interval) * 1000)
+
+    probe_task = asyncio.ensure_future(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(drive(engine, context) for engine, context in engines))
+    wall = time.perf_counter() - start
+    probe_task.cancel()
+    for engine, _ in engines:
+        engine.close()
+    return wall, [engine for engine, _ in engines], lag[0]
+
+
+def bench_engine(args):
+    """ActionEngine step throughput: one engine vs several sharing one asyncio loop"""
+    app.tracer.enabled = False
+    app.STEP_ERROR_PAUSE_MS = args.error_pause_ms
+    frames = [app.ScreenFrame.from_pil(synthetic_screen(args.width, args.height, seed=i)) for i in range(6)]
+    elements = canned_elements(40)
+    print(f"Screen {args.width}x{args.height}, {args.batches} batches of {len(ENGINE_BATCH) + args.errors} steps "
+          f"per engine ({args.errors} failing, {args.error_pause_ms:.0f}ms error pause)\n")
+    for count in sorted({1, args.engines}):
+        with contextlib.redirect_stdout(io.StringIO()):  # Engines print every step
+            wall, engines, lag = asyncio.run(run_engines(count, args.batches, frames, elements, args.errors))
+        steps = sum(engine.stats["steps"] for engine in engines)
+        busy = sum(engine.stats["busy_s"] for engine in engines)
+        print(f"{count:2d} engine(s): {steps:4d} steps in {wall:6.2f}s = {steps / wall:6.2f} steps/s, "
+              f"{busy / wall:4.1f}x concurrency, {sum(e.stats['errors'] for e in engines)} errors, "
+              f"max loop lag {lag:.1f} ms")
+
+
+def stream_task(base_url, task_id, session=None):
+    """Read a task's event stream until its "done" event; returns the events"""
+    events = []
+    with (session or requests).get(f"{base_url}/tasks/{task_id}/events", stream=True, timeout=300) as response:
+        for line in response.iter_lines():
+            if line:
+                events.append(json.loads(line))
+    return events
+
+
+def bench_daemon(args):
+    """Tasks through the daemon's HTTP API: queued tasks, streamed events, 1 vs N concurrent displays"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    frames = [app.ScreenFrame.from_pil(synthetic_screen(args.width, args.height, seed=i)) for i in range(6)]
+    responses = [json.dumps(turn) for turn in AGENT_SCRIPT]
+    server = StubProcess(latency_ms=args.parse_ms, elements=args.elements)
+    tmpdir = tempfile.mkdtemp(prefix="va_daemon_")
+    cwd = os.getcwd()
+    os.chdir(tmpdir)  # Sessions write gemini_prompt_* files
+    app.tracer.trace_dir = os.path.join(tmpdir, "traces")
+
+    def session_factory(display):
+        screen = FakeScreen(frames)
+        planner = app.PlannerClient(api_key="offline", model=ScriptedPlannerModel(responses, args.gemini_ms))
+        return app.AgentSession(display, capture=screen, planner=planner,
+                                omniparser=app.OmniParserClient(server.url),
+                                input_backend=app.NullInputBackend(on_action=screen.advance))
+
+    print(f"{args.tasks} tasks of {len(AGENT_SCRIPT)} turns, OmniParser {args.parse_ms:.0f}ms, "
+          f"Gemini {args.gemini_ms:.0f}ms\n")
+    try:
+        for concurrency in sorted({1, args.concurrency}):
+            daemon = app.TaskDaemon([f":{i + 1}" for i in range(concurrency)], concurrency, session_factory)
+            loop = app.EngineLoop(name="daemon")
+            with contextlib.redirect_stdout(io.StringIO()):
+                base_url = loop.submit(daemon.start("127.0.0.1:0")).result(30)
+                start = time.perf_counter()
+                ids = [requests.post(f"{base_url}/tasks", json={"task": f"task {i}"}, timeout=10).json()["id"]
+                       for i in range(args.tasks)]
+                with ThreadPoolExecutor(len(ids)) as pool:
+                    streams = list(pool.map(lambda task_id: stream_task(base_url, task_id), ids))
+                wall = time.perf_counter() - start
+                loop.submit(daemon.stop()).result(30)
+            loop.stop()
+
+            outcomes = {}
+            for events in streams:
+                status = events[-1]["status"] if events and events[-1]["event"] == "done" else "no done event"
+                outcomes[status] = outcomes.get(status, 0) + 1
+            latencies = sorted(events[-1]["t"] - events[0]["t"] for events in streams)
+            first_step = statistics.median(
+                next(e["t"] for e in events if e["event"] == "step") - events[0]["t"] for events in streams)
+            print(f"{concurrency} display(s): {args.tasks} tasks in {wall:6.2f}s = {args.tasks / wall * 60:5.1f} tasks/min, "
+                  f"latency p50 {statistics.median(latencies):5.2f}s max {latencies[-1]:5.2f}s, "
+                  f"first step p50 {first_step:5.2f}s, {sum(map(len, streams))} events, {outcomes}")
+            if outcomes.get("completed", 0) != args.tasks:
+                sys.exit(1)
+    finally:
+        server.stop()
+        os.chdir(cwd)
+
+
+class PerTaskScriptedModel(ScriptedPlannerModel):
+    """One scripted model shared by many sessions; replays the script separately for each task"""
+
+    def __init__(self, responses=None, latency_ms=0.0):
+        super().__init__(responses, latency_ms)
+        self.turns = {}
+
+    def generate_content(self, contents):
+        task = next((line for line in contents[0].splitlines() if line.startswith("User request:")), "")
+        self.calls.append(contents)
+        turn = self.turns[task] = self.turns.get(task, -1) + 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        return ScriptedResponse(self.responses[turn % len(self.responses)])
+
+
+async def run_daemon_tasks(daemon, count):
+    """Queue `count` tasks on a daemon (no HTTP) and wait for all of them; returns (wall s, tasks)"""
+    await daemon.start("127.0.0.1:0")
+    start = time.perf_counter()
+    tasks = [daemon.submit(f"task {i}") for i in range(count)]
+    while not all(task.done for task in tasks):
+        await asyncio.sleep(0.05)
+    wall = time.perf_counter() - start
+    await daemon.stop()
+    return wall, tasks
+
+
+def bench_sessions(args):
+    """Throughput vs number of agent sessions sharing one OmniParser client and one planner"""
+    frames = [app.ScreenFrame.from_pil(synthetic_screen(args.width, args.height, seed=i)) for i in range(6)]
+    responses = [json.dumps(turn) for turn in AGENT_SCRIPT]
+    server = StubProcess(latency_ms=args.parse_ms, elements=args.elements)
+    tmpdir = tempfile.mkdtemp(prefix="va_sessions_")
+    cwd = os.getcwd()
+    os.chdir(tmpdir)  # Sessions write gemini_prompt_* files
+    app.tracer.enabled = False
+    print(f"{args.tasks_per_session} tasks of {len(AGENT_SCRIPT)} turns per session, OmniParser {args.parse_ms:.0f}ms, "
+          f"Gemini {args.gemini_ms:.0f}ms, {args.inflight} shared requests in flight per service, "
+          f"per-session limits {args.omniparser_rpm or '-'} / {args.planner_rpm or '-'} rpm\n")
+
+    failed = False
+    base_rate = None
+    try:
+        for count in args.sessions:
+            model = PerTaskScriptedModel(responses, args.gemini_ms)
+            pool = app.SessionPool(app.OmniParserClient(server.url, pool_size=args.inflight),
+                                   app.PlannerClient(api_key="offline", model=model),
+                                   args.inflight, args.inflight, args.omniparser_rpm, args.planner_rpm)
+
+            def session_factory(display):
+                screen = FakeScreen(frames)
+                return pool.create_session(display, capture=screen,
+                                           input_backend=app.NullInputBackend(on_action=screen.advance))
+
+            daemon = app.TaskDaemon([f":{i + 1}" for i in range(count)], count, session_factory)
+            with contextlib.redirect_stdout(io.StringIO()):
+                wall, tasks = asyncio.run(run_daemon_tasks(daemon, count * args.tasks_per_session))
+            stats = pool.stats()
+            pool.close()
+
+            rate = len(model.calls) / wall * 60
+            base_rate = base_rate or rate / count
+            calls = [s["planner_calls"] for s in stats["sessions"].values()]
+            gates = ", ".join(f"{name} queued {g['queued']}/{g['calls']} max wait {g['max_wait_s'] * 1000:.0f}ms"
+                              for name, g in ((n, stats[n]) for n in ("omniparser", "planner")))
+            completed = sum(task.status == "completed" for task in tasks)
+            failed |= completed != len(tasks)
+            print(f"{count:2d} session(s): {completed}/{len(tasks)} tasks in {wall:6.1f}s, {rate:6.1f} turns/min "
+                  f"(x{rate / base_rate:4.1f}, {rate / base_rate / count * 100:3.0f}% efficiency), "
+                  f"turns per session {min(calls)}-{max(calls)}; {gates}")
+    finally:
+        server.stop()
+        os.chdir(cwd)
+    if failed:
+        sys.exit(1)
+
+
+STARTUP_PROBE = r"""
+import json, os, sys, time
+t0 = time.perf_counter()
+import app
+t_import = time.perf_counter()
+from PyQt5 import QtWidgets
+qapp = QtWidgets.QApplication([])
+app.VOICE_ENABLED = False
+assistant = app.VirtualAssistant()
+assistant.show()
+assistant.input.setFocus()
+qapp.processEvents()
+t_shown = time.perf_counter()
+heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+assistant.omniparser.url = OMNIPARSER_URL
+futures = assistant.prewarm()
+failed = [name for name, future in futures.items() if future.exception(timeout=60) is not None]
+t_warm = time.perf_counter()
+print(json.dumps({"import_ms": (t_import - t0) * 1000, "window_ms": (t_shown - t0) * 1000,
+                  "warm_ms": (t_warm - t_shown) * 1000, "heavy": heavy, "warm_failed": failed}))
+sys.stdout.flush()
+os._exit(0)
+"""
+HEAVY_MODULES = ("google.generativeai", "speech_recognition", "pyautogui")
+
+
+def import_times(env):
+    """(total ms, [(cumulative ms, module)] for app's direct imports) from `python -X importtime`"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], env=env,
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    total, children = 0.0, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.strip() == "app":
+            total = int(cumulative) / 1000
+        elif name.startswith("   ") and not name.startswith("    "):
+            children.append((int(cumulative) / 1000, name.strip()))
+    return total, sorted(children, reverse=True)
+
+
+def bench_startup(args):
+    """Time to the input window and import cost per module, run in fresh interpreters"""
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    server = StubProcess()
+    probe = f"HEAVY_MODULES = {HEAVY_MODULES!r}\nOMNIPARSER_URL = {server.url!r}\n" + STARTUP_PROBE
+    tmpdir = tempfile.mkdtemp(prefix="va_startup_")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get("PYTHONPATH")]))
+    runs = []
+    try:
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, "-c", probe], env=env, cwd=tmpdir,
+                                    capture_output=True, text=True, timeout=120)
+            process_ms = (time.perf_counter() - start) * 1000
+            lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+            if result.returncode or not lines:
+                raise SystemExit(f"Startup probe failed:\n{result.stdout}\n{result.stderr}")
+            runs.append(dict(json.loads(lines[-1]), process_ms=process_ms))
+    finally:
+        server.stop()
+
+    total, children = import_times(env)
+    print(f"import app: {total:.0f} ms (-X importtime), slowest direct imports:")
+    for cumulative, name in children[:args.top]:
+        print(f"  {cumulative:8.1f} ms  {name}")
+    print()
+    for key, label in (("import_ms", "import app"), ("window_ms", "window shown"),
+                       ("warm_ms", "pre-warm (after window)"), ("process_ms", "process incl. interpreter")):
+        values = sorted(run[key] for run in runs)
+        print(f"{label:<28} median {statistics.median(values):7.0f} ms   min {values[0]:7.0f} ms   "
+              f"max {values[-1]:7.0f} ms")
+    heavy = sorted({name for run in runs for name in run["heavy"]})
+    failed = sorted({name for run in runs for name in run["warm_failed"]})
+    print(f"\nLoaded before the window: {', '.join(heavy) or 'none of ' + ', '.join(HEAVY_MODULES)}")
+    if failed:
+        print(f"Pre-warm failed: {', '.join(failed)}")
+    window_ms = statistics.median(run["window_ms"] for run in runs)
+    if heavy or (args.budget_ms and window_ms > args.budget_ms):
+        print(f"❌ Startup regression (budget {args.budget_ms:.0f} ms)")
+        sys.exit(1)
+
+
+# (duration s, (F1, F2) at start, (F1, F2) at end, voicing 0-1, (noise band Hz, noise level) or None)
+PHONES = {
+    "h": (0.06, (500, 1800), (500, 1800), 0.0, ((1000, 4000), 0.3)),
+    "ey": (0.22, (530, 1840), (300, 2300), 1.0, None),
+    "v": (0.06, (250, 1400), (250, 1400), 0.4, ((2000, 6000), 0.1)),
+    "ih": (0.09, (300, 2300), (350, 2100), 1.0, None),
+    "zh": (0.12, (300, 1800), (300, 1800), 0.3, ((2000, 5000), 0.4)),
+    "ax": (0.08, (500, 1500), (500, 1500), 1.0, None),
+    "n": (0.10, (250, 1000), (250, 1000), 0.5, None),
+    "d": (0.03, (300, 1700), (300, 1700), 0.3, ((500, 5000), 0.6)),
+    "dh": (0.05, (300, 1600), (300, 1600), 0.4, ((3000, 6000), 0.2)),
+    "eh": (0.20, (600, 1900), (550, 1700), 1.0, None),
+    "ow": (0.20, (450, 800), (350, 900), 1.0, None),
+    "p": (0.04, (400, 1000), (400, 1000), 0.0, ((300, 3000), 0.5)),
+    "k": (0.05, (400, 1800), (400, 1800), 0.0, ((1500, 3500), 0.6)),
+    "r": (0.08, (400, 1200), (450, 1300), 1.0, None),
+    "m": (0.09, (250, 900), (250, 900), 0.5, None),
+    "l": (0.07, (350, 1000), (400, 1200), 1.0, None),
+    "uw": (0.16, (300, 2200), (320, 900), 1.0, None),
+    "z": (0.09, (300, 1600), (300, 1600), 0.3, ((3500, 7000), 0.4)),
+}
+WAKE_PHONES = ["h", "ey", "v", "ih", "zh", "ax", "n"]
+DISTRACTORS = {
+    "hey there": ["h", "ey", "dh", "eh", "r"],
+    "division": ["d", "ih", "v", "ih", "zh", "ax", "n"],
+    "open chrome": ["ow", "p", "ax", "n", "k", "r", "ow", "m"],
+    "play music": ["p", "l", "ey", "m", "uw", "z", "ih", "k"],
+}
+
+
+def synth_speech(phones, rng, rate=16000, f0=120.0, tempo=1.0, formant_scale=1.0, level=6000.0):
+    """Crude formant synthesis of a phone sequence, enough to give words distinct spectra"""
+    parts = []
+    for name in phones:
+        duration, start, end, voicing, noise = PHONES[name]
+        n = int(duration / tempo * rate)
+        t = np.linspace(0, 1, n)
+        formants = [(np.interp(t, [0, 1], [a, b]) * formant_scale, bw)
+                    for (a, b), bw in zip(zip(start, end), (80, 120))] + [(np.full(n, 2500 * formant_scale), 200)]
+        pitch = f0 * (1 + 0.03 * np.sin(2 * np.pi * rng.uniform(2, 5) * t * duration)) * (1 - 0.1 * t)
+        phase = 2 * np.pi * np.cumsum(pitch) / rate
+        segment = np.zeros(n)
+        if voicing:
+            for k in range(1, int(5000 / f0)):
+                envelope = sum(1 / (1 + ((k * pitch - freq) / bw) ** 2) for freq, bw in formants)
+                segment += voicing * envelope / k * np.sin(k * phase)
+        if noise:
+            (lo, hi), amount = noise
+            spectrum = np.fft.rfft(rng.standard_normal(n))
+            freqs = np.fft.rfftfreq(n, 1 / rate)
+            spectrum[(freqs < lo) | (freqs > hi)] = 0
+            segment += amount * np.fft.irfft(spectrum, n) / (np.std(np.fft.irfft(spectrum, n)) + 1e-9)
+        parts.append(segment)
+    audio = np.concatenate(parts)
+    ramp = min(len(audio) // 2, int(0.01 * rate))
+    audio[:ramp] *= np.linspace(0, 1, ramp)
+    audio[-ramp:] *= np.linspace(1, 0, ramp)
+    return audio / (np.abs(audio).max() + 1e-9) * level
+
+
+def write_wav(path, samples, rate=16000):
+    import wave
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(np.clip(samples, -32768, 32767).astype(np.int16).tobytes())
+
+
+def write_wake_templates(directory, rng, rate=16000, snr_db=20):
+    """Three enrollment recordings of the synthetic speaker in directory/templates"""
+    os.makedirs(os.path.join(directory, "templates"), exist_ok=True)
+    for i, tempo in enumerate((0.95, 1.0, 1.05)):
+        word = synth_speech(WAKE_PHONES, rng, rate, f0=120 * rng.uniform(0.97, 1.03), tempo=tempo)
+        recording = np.concatenate([np.zeros(int(0.3 * rate)), word, np.zeros(int(0.3 * rate))])
+        noise = np.sqrt(np.mean(word ** 2)) / 10 ** (snr_db / 20)
+        write_wav(os.path.join(directory, "templates", f"wake_{i}.wav"),
+                  recording + rng.normal(0, noise, len(recording)), rate)
+
+
+def make_wake_fixtures(directory, rate=16000, occurrences=12, distractors=12, snr_db=20, seed=0):
+    """Write templates/*.wav, stream.wav and labels.json (wake-word end times) for a synthetic speaker"""
+    rng = np.random.default_rng(seed)
+    write_wake_templates(directory, rng, rate, snr_db)
+    items = ["wake"] * occurrences + [rng.choice(list(DISTRACTORS)) for _ in range(distractors)]
+    rng.shuffle(items)
+    pieces, wake_ends, position = [], [], 0
+    for item in items:
+        gap = np.zeros(int(rng.uniform(0.6, 2.0) * rate))
+        phones = WAKE_PHONES if item == "wake" else DISTRACTORS[item]
+        word = synth_speech(phones, rng, rate, f0=120 * rng.uniform(0.9, 1.1), tempo=rng.uniform(0.85, 1.15),
+                            formant_scale=rng.uniform(0.97, 1.03), level=rng.uniform(3000, 9000))
+        pieces += [gap, word]
+        position += len(gap) + len(word)
+        if item == "wake":
+            wake_ends.append(position / rate)
+    pieces.append(np.zeros(rate))
+    stream = np.concatenate(pieces)
+    speech = np.concatenate(pieces[1::2])
+    stream += rng.normal(0, np.sqrt(np.mean(speech ** 2)) / 10 ** (snr_db / 20), len(stream))
+    write_wav(os.path.join(directory, "stream.wav"), stream, rate)
+    with open(os.path.join(directory, "labels.json"), "w") as f:
+        json.dump({"wake_ends": wake_ends, "items": list(items)}, f)
+
+
+def run_wake_stream(detector, samples, chunk=1024):
+    """Feed samples in microphone-sized chunks; returns (hit times, CPU seconds)"""
+    data = samples.astype(np.int16).tobytes()
+    hits = []
+    detector.reset()
+    cpu = time.process_time()
+    for start in range(0, len(data), chunk * 2):
+        hit = detector.feed(data[start:start + chunk * 2])
+        if hit is not None:
+            hits.append(hit)
+    return hits, time.process_time() - cpu
+
+
+def bench_wake_word(args):
+    """Local wake-word detection on WAV fixtures: hits, false wakes, latency and CPU"""
+    directory = args.fixtures or tempfile.mkdtemp(prefix="va_wake_")
+    if not os.path.exists(os.path.join(directory, "stream.wav")):
+        make_wake_fixtures(directory, snr_db=args.snr_db)
+        print(f"Synthesized fixtures in {directory}")
+    with open(os.path.join(directory, "labels.json")) as f:
+        wake_ends = json.load(f)["wake_ends"]
+    rate = app.MIC_SAMPLE_RATE
+    stream = app.WakeWordDetector.read_wav(os.path.join(directory, "stream.wav"), rate)
+    duration = len(stream) / rate
+    threshold = args.threshold or app.WAKE_WORD_THRESHOLD
+    print(f"{duration:.0f}s of audio, {len(wake_ends)} wake words, threshold {threshold}\n")
+
+    failed = False
+    for label, gated in (("gated", True), ("always analysing", False)):
+        detector = app.WakeWordDetector.from_directory(os.path.join(directory, "templates"), rate,
+                                                       threshold=threshold)
+        if not gated:
+            detector.vad.ratio, detector.vad.min_rms = 0.0, 0.0
+        hits, cpu = run_wake_stream(detector, stream)
+        latencies, unmatched = [], list(hits)
+        for end in wake_ends:
+            match = next((hit for hit in unmatched if end - 0.3 <= hit <= end + 1.0), None)
+            if match is not None:
+                unmatched.remove(match)
+                latencies.append((match - end) * 1000)
+        stats = detector.stats
+        print(f"{label}:")
+        print(f"  detected {len(latencies)}/{len(wake_ends)}, false wakes {len(unmatched)}")
+        if latencies:
+            latencies.sort()
+            print(f"  latency after word end: p50 {statistics.median(latencies):.0f} ms, "
+                  f"max {latencies[-1]:.0f} ms")
+        print(f"  CPU {cpu / duration * 100:.2f}% of one core "
+              f"({stats['analysed'] / stats['hops'] * 100:.0f}% of hops analysed)")
+        if gated:
+            print(f"  speech-recognition requests: {stats['segments']} transcribing every utterance, "
+                  f"{len(hits)} with local spotting (only after a hit)")
+            failed = len(latencies) < args.min_recall * len(wake_ends) or len(unmatched) > args.max_false_wakes
+        print()
+    if failed:
+        print("❌ Wake-word detection below target")
+        sys.exit(1)
+
+
+COMMAND_PHONES = {"open chrome": DISTRACTORS["open chrome"], "play music": DISTRACTORS["play music"]}
+
+
+def make_voice_fixtures(directory, rate=16000, commands=9, snr_db=20, seed=0):
+    """Write templates/*.wav, commands.wav and commands.json: wake word + command with varying pauses
+    
+    Every third command follows the wake word in one breath (80 ms), the others
+    after 0.4 s or 1 s; "hey there" and "division" are spoken in between.
+    """
+    rng = np.random.default_rng(seed)
+    write_wake_templates(directory, rng, rate, snr_db)
+    speak = lambda phones: synth_speech(phones, rng, rate, f0=120 * rng.uniform(0.9, 1.1),
+                                        tempo=rng.uniform(0.9, 1.1), level=rng.uniform(4000, 8000))
+    pieces, words, expected = [np.zeros(int(2 * rate))], [], []
+    position = len(pieces[0])
+
+    def add(audio, text=None):
+        nonlocal position
+        if text:
+            words.append({"text": text, "start": position / rate, "end": (position + len(audio)) / rate})
+        pieces.append(audio)
+        position += len(audio)
+
+    for i in range(commands):
+        command = list(COMMAND_PHONES)[i % len(COMMAND_PHONES)]
+        add(speak(WAKE_PHONES), "hey vision")
+        pause = (0.08, 0.4, 1.0)[i % 3]
+        add(np.zeros(int(pause * rate)))
+        add(speak(COMMAND_PHONES[command]), command)
+        expected.append({"text": command, "end": position / rate, "pause_s": pause})
+        add(np.zeros(int(rng.uniform(2.5, 3.5) * rate)))
+        if i % 2:
+            distractor = ("hey there", "division")[i // 2 % 2]
+            add(speak(DISTRACTORS[distractor]), distractor)
+            add(np.zeros(int(rng.uniform(2.0, 3.0) * rate)))
+    stream = np.concatenate(pieces)
+    speech = np.concatenate([piece for piece in pieces if np.any(piece)])
+    stream += rng.normal(0, np.sqrt(np.mean(speech ** 2)) / 10 ** (snr_db / 20), len(stream))
+    write_wav(os.path.join(directory, "commands.wav"), stream, rate)
+    with open(os.path.join(directory, "commands.json"), "w") as f:
+        json.dump({"words": words, "commands": expected}, f)
+
+
+class WavMicrophone:
+    """Stands in for speech_recognition.Microphone, playing a WAV file as the input stream"""
+    SAMPLE_WIDTH = 2
+
+    def __init__(self, path, chunk=1024, realtime=False):
+        self.SAMPLE_RATE = app.MIC_SAMPLE_RATE
+        self.CHUNK = chunk
+        self.realtime = realtime
+        self.data = app.WakeWordDetector.read_wav(path, self.SAMPLE_RATE).tobytes()
+        self.position = 0
+        self.stream = self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def read(self, size):
+        chunk = self.data[self.position:self.position + size * self.SAMPLE_WIDTH]
+        self.position += len(chunk)
+        if self.realtime:
+            time.sleep(len(chunk) / self.SAMPLE_WIDTH / self.SAMPLE_RATE)
+        return chunk
+
+    @property
+    def time_s(self):
+        return self.position / self.SAMPLE_WIDTH / self.SAMPLE_RATE
+
+
+class LabelRecognizer:
+    """Fake speech recognition: the labelled words whose midpoint falls inside the slice"""
+
+    def __init__(self, words):
+        self.words = words
+        self.calls = 0
+
+    def __call__(self, pcm, start_s, end_s):
+        import speech_recognition as sr
+        self.calls += 1
+        heard = [w["text"] for w in self.words if start_s <= (w["start"] + w["end"]) / 2 <= end_s]
+        if not heard:
+            raise sr.UnknownValueError()
+        return " ".join(heard)
+
+
+def bench_voice(args):
+    """Wake word + command on a recorded stream through VoiceRecognitionThread and a fake microphone"""
+    directory = args.fixtures or tempfile.mkdtemp(prefix="va_voice_")
+    if not os.path.exists(os.path.join(directory, "commands.wav")):
+        make_voice_fixtures(directory, commands=args.commands)
+        print(f"Synthesized fixtures in {directory}")
+    with open(os.path.join(directory, "commands.json")) as f:
+        labels = json.load(f)
+    expected = labels["commands"]
+    app.MIC_CALIBRATION_FILE = ""
+
+    failed = False
+    for label, templates in (("local wake word", os.path.join(directory, "templates")),
+                             ("transcribed wake word", "")):
+        app.WAKE_WORD_TEMPLATE_DIR = templates
+        microphone = WavMicrophone(os.path.join(directory, "commands.wav"), realtime=args.realtime)
+        recognizer = LabelRecognizer(labels["words"])
+        thread = app.VoiceRecognitionThread(microphone, recognizer)
+        heard = []
+        thread.text_recognized.connect(lambda text: heard.append((text, microphone.time_s)))
+        with contextlib.redirect_stdout(io.StringIO()):
+            cpu = time.process_time()
+            thread.run()
+            cpu = time.process_time() - cpu
+
+        correct, latencies, by_pause = 0, [], {}
+        remaining = list(heard)
+        for command in expected:
+            match = next((h for h in remaining if h[0] == command["text"] and h[1] >= command["end"]), None)
+            ok = match is not None
+            if ok:
+                remaining.remove(match)
+                correct += 1
+                latencies.append((match[1] - command["end"]) * 1000)
+            by_pause.setdefault(command["pause_s"], []).append(ok)
+        print(f"{label}:")
+        print(f"  commands recognized {correct}/{len(expected)}, unexpected {len(remaining)}"
+              + (f" ({', '.join(repr(text) for text, _ in remaining)})" if remaining else ""))
+        for pause, results in sorted(by_pause.items()):
+            print(f"    {pause * 1000:4.0f} ms after the wake word: {sum(results)}/{len(results)}")
+        if latencies:
+            print(f"  text after the command ends: p50 {statistics.median(latencies):.0f} ms "
+                  f"(SILENCE_DURATION {app.SILENCE_DURATION * 1000:.0f} ms)")
+        print(f"  {recognizer.calls} speech-recognition requests, CPU "
+              f"{cpu / microphone.time_s * 100:.2f}% of one core\n")
+        failed = failed or correct < len(expected) or bool(remaining)
+    if failed:
+        print("❌ Commands lost or misheard")
+        sys.exit(1)
+
+
+class TimedPlannerModel(ScriptedPlannerModel):
+    """Scripted model that records when each request starts"""
+
+    def __init__(self, responses=None, latency_ms=0.0):
+        super().__init__(responses, latency_ms)
+        self.started = []
+
+    def generate_content(self, contents):
+        self.started.append(time.perf_counter())
+        return super().generate_content(contents)
+
+
+def bench_voice_task(args):
+    """Spoken command to planner request: fixed 2 s delay vs parsing while the command is spoken"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5 import QtCore, QtWidgets
+
+    app.VOICE_ENABLED = False
+    app.tracer.enabled = False
+    qapp = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    server = StubProcess(latency_ms=args.parse_ms, elements=args.elements)
+    tmpdir = tempfile.mkdtemp(prefix="va_voice_task_")
+    cwd = os.getcwd()
+    os.chdir(tmpdir)
+    frames = [app.ScreenFrame.from_pil(synthetic_screen(args.width, args.height, seed=i)) for i in range(args.tasks)]
+    modes = [("fixed 2 s delay (before)", False, 2000), ("parse on wake, 1 s confirmation", True, 1000),
+             ("parse on wake, no confirmation", True, 0)]
+    print(f"OmniParser {args.parse_ms:.0f}ms, command spoken and transcribed in {args.speech_ms:.0f}ms, "
+          f"{args.tasks} tasks per mode\n")
+    try:
+        for label, prepare, confirm_ms in modes:
+            app.VOICE_PREPARE_ON_WAKE, app.VOICE_CONFIRM_MS = prepare, confirm_ms
+            model = TimedPlannerModel([json.dumps({"steps": [{"type": "end", "message": "Done"}]})],
+                                      latency_ms=args.gemini_ms)
+            client = app.OmniParserClient(server.url)
+            finished = []
+
+            class HeadlessAssistant(app.VirtualAssistant):
+                def show_message(self, title, text, warning=False):
+                    finished.append((title, time.perf_counter()))
+                    QtCore.QTimer.singleShot(0, next_task)
+
+            screen = StaticCapture(frames[0])
+            assistant = HeadlessAssistant(capture=screen, omniparser=client,
+                                          planner=app.PlannerClient(api_key="offline", model=model),
+                                          input_backend=app.NullInputBackend())
+            assistant.show()
+            text_at = []
+
+            def speak():
+                screen.frame = frames[len(text_at)]  # A new screen each time, so the parse cache cannot help
+                assistant.on_wake_word_detected()
+                assistant.on_listening_started()
+                QtCore.QTimer.singleShot(int(args.speech_ms), recognized)
+
+            def recognized():
+                assistant.on_listening_stopped()
+                text_at.append(time.perf_counter())
+                assistant.on_voice_text_recognized("play lata mangeshkar songs")
+
+            def next_task():
+                if len(text_at) >= args.tasks:
+                    qapp.quit()
+                    return
+                QtCore.QTimer.singleShot(300, speak)
+
+            QtCore.QTimer.singleShot(0, next_task)
+            QtCore.QTimer.singleShot(int(args.timeout * 1000), qapp.quit)
+            with contextlib.redirect_stdout(io.StringIO()):
+                qapp.exec_()
+            stats = dict(assistant.pipeline.speculation_stats)
+            assistant.engine_loop.stop()
+            assistant.engine.close()
+            assistant.pipeline.close()
+            assistant.hide()
+            client.close()
+
+            done = [t for title, t in finished if title == "Task Complete"]
+            to_request = sorted((start - text) * 1000 for text, start in zip(text_at, model.started))
+            to_done = sorted((end - text) * 1000 for text, end in zip(text_at, done))
+            print(f"{label}:")
+            if len(done) < args.tasks:
+                print(f"  only {len(done)}/{args.tasks} tasks completed\n")
+                continue
+            print(f"  text -> planner request: p50 {statistics.median(to_request):6.0f} ms   "
+                  f"text -> task done: p50 {statistics.median(to_done):6.0f} ms")
+            print(f"  prepared parses used {stats['used']}/{stats['started']}\n")
+    finally:
+        server.stop()
+        os.chdir(cwd)
+
+
+def bench_elements(args):
+    """Element lookups per turn: ElementStore vs scanning the raw parsed_elements list"""
+    width, height = args.width, args.height
+    rng = np.random.default_rng(0)
+
+    def per_op_us(fn, queries):
+        start = time.perf_counter()
+        for q in queries:
+            fn(q)
+        return (time.perf_counter() - start) / len(queries) * 1e6
+
+    def scan_at(elements, x, y):
+        hits = []
+        for i, elem in enumerate(elements):
+            bbox = app.element_pixel_bbox(elem, width, height)
+            if bbox and bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]:
+                hits.append(i)
+        return hits
+
+    def scan_overlapping(elements, rect):
+        boxes = [app.element_pixel_bbox(e, width, height) for e in elements]
+        return [i for i, b in enumerate(boxes)
+                if b and b[0] < rect[2] and rect[0] < b[2] and b[1] < rect[3] and rect[1] < b[3]]
+
+    def scan_nearest(elements, x, y):
+        best, best_distance = None, float("inf")
+        for i, elem in enumerate(elements):
+            b = app.element_pixel_bbox(elem, width, height)
+            if b:
+                d = ((max(b[0] - x, x - b[2], 0)) ** 2 + (max(b[1] - y, y - b[3], 0)) ** 2) ** 0.5
+                if d < best_distance:
+                    best, best_distance = i, d
+        return best
+
+    def scan_match(current, previous):
+        # Naive pairing: every element against every previous one, by type and text
+        def key(e):
+            return (e.get("type"), e.get("content")) if isinstance(e, dict) else ("text", e)
+        keys = [key(e) for e in previous]
+        return [next((j for j, k in enumerate(keys) if k == key(e)), -1) for e in current]
+
+    print(f"Screen {width}x{height}, {args.queries} queries per operation (us per call)\n")
+    print(f"{'elements':>8} {'build ms':>9} {'op':<12} {'list scan':>10} {'store':>9} {'speedup':>8}")
+    for count in args.elements:
+        elements = canned_elements(count)
+        # A few OmniParser string entries with inline <box> tags, as the API sometimes returns
+        for i in range(0, count, 10):
+            x1, y1, x2, y2 = elements[i]["bbox"]
+            elements[i] = f"Text {i}<box>{x1 * width:.0f},{y1 * height:.0f},{x2 * width:.0f},{y2 * height:.0f}</box>"
+        start = time.perf_counter()
+        store = app.ElementStore(elements, width, height)
+        build_ms = (time.perf_counter() - start) * 1000
+        moved = [dict(e, bbox=[v + 0.002 for v in e["bbox"]]) if isinstance(e, dict) else e for e in elements]
+        rng.shuffle(moved)
+        previous = app.ElementStore(moved, width, height)
+
+        numbers = rng.integers(0, count, args.queries).tolist()
+        points = list(zip(rng.uniform(0, width, args.queries), rng.uniform(0, height, args.queries)))
+        rects = [(x, y, x + 200, y + 120) for x, y in points]
+        rows = [
+            ("click bbox", per_op_us(lambda n: app.element_pixel_bbox(elements[n], width, height), numbers),
+             per_op_us(lambda n: store.pixel_bbox(n, width, height), numbers)),
+            ("at", per_op_us(lambda p: scan_at(elements, *p), points), per_op_us(lambda p: store.at(*p), points)),
+            ("overlapping", per_op_us(lambda r: scan_overlapping(elements, r), rects),
+             per_op_us(store.overlapping, rects)),
+            ("nearest", per_op_us(lambda p: scan_nearest(elements, *p), points),
+             per_op_us(lambda p: store.nearest(*p), points)),
+        ]
+        match_runs = max(1, args.queries // 100)
+        rows.append(("match", per_op_us(lambda _: scan_match(elements, moved), range(match_runs)),
+                     per_op_us(lambda _: store.match(previous), range(match_runs))))
+        for i, (name, scan_us, store_us) in enumerate(rows):
+            lead = f"{count:>8} {build_ms:>9.2f}" if i == 0 else f"{'':>8} {'':>9}"
+            print(f"{lead} {name:<12} {scan_us:>10.1f} {store_us:>9.1f} {scan_us / store_us:>7.1f}x")
+
+        # Same answers as the scans, so the store is a drop-in replacement
+        assert all(store.at(*p) == sorted(scan_at(elements, *p), key=lambda i: store.areas[i]) for p in points[:50])
+        assert all(store.overlapping(r) == scan_overlapping(elements, r) for r in rects[:50])
+        assert all(store.contains(n) for n in (0, count - 1)) and not store.contains(count)
+        assert store.diff(previous) == (0, 0)
+
+
+class TrackedScreen:
+    """Synthetic UI for element tracking: elements drift, scroll, appear and vanish between parses
+
+    Elements sit in the cells of a layout grid (about 70% full) and keep a true identity with
+    its own texture. `step()` scrolls the lower part of the grid and replaces a few elements;
+    `parse()` returns what OmniParser would report (jittered boxes, occasional caption noise,
+    arbitrary order) plus the rendered frame and the identity behind each returned element.
+    """
+    LABELS = ["Search", "Edit", "Open", "Save", "Settings", "Close", "Share", "More", "Back", "Next"]
+
+    def __init__(self, count, width, height, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.width, self.height = width, height
+        cells = int(count / 0.7)
+        self.cols = max(2, int(round((cells * 2) ** 0.5)))  # Cells about four times wider than tall on 16:9
+        self.rows = max(5, -(-cells // self.cols))
+        self.scroll_from = self.rows * 2 // 5  # Rows below this scroll
+        self.cells = {}  # (row, col) -> identity
+        self.elements = {}
+        self._next = 0
+        free = [(r, c) for r in range(self.rows) for c in range(self.cols)]
+        for k in self.rng.permutation(len(free))[:count]:
+            self._add(free[k])
+
+    def _add(self, cell):
+        rng = self.rng
+        kind = ["icon", "text", "button", "input"][self._next % 4]
+        # Half the labels come from a small vocabulary, so equal texts are common (several "Edit" buttons)
+        text = str(rng.choice(self.LABELS)) if rng.random() < 0.5 else f"{kind} item {self._next} {rng.integers(1000)}"
+        self.elements[self._next] = {"type": kind, "text": text, "cell": cell, "fill": rng.uniform(0.4, 0.9),
+                                     "texture": rng.integers(0, 255, (4, 6), dtype=np.uint8)}
+        self.cells[cell] = self._next
+        self._next += 1
+
+    def _free_cells(self, rows):
+        return [(r, c) for r in rows for c in range(self.cols) if (r, c) not in self.cells]
+
+    def bbox(self, elem):
+        row, col = elem["cell"]
+        cw, ch = 0.98 / self.cols, 0.9 / self.rows
+        x1, y1 = 0.01 + col * cw, 0.05 + row * ch
+        return [x1, y1 + ch * 0.15, x1 + cw * elem["fill"], y1 + ch * 0.85]
+
+    def step(self, churn, scroll_rows):
+        """Advance one turn; returns the identities that moved"""
+        rng = self.rng
+        moved = set()
+        if scroll_rows:
+            for (row, col), uid in sorted(self.cells.items()):
+                if row < self.scroll_from:
+                    continue
+                del self.cells[(row, col)]
+                if row - scroll_rows < self.scroll_from:
+                    del self.elements[uid]
+                    continue
+                self.elements[uid]["cell"] = (row - scroll_rows, col)
+                self.cells[(row - scroll_rows, col)] = uid
+                moved.add(uid)
+            fresh = self._free_cells(range(self.rows - scroll_rows, self.rows))
+            for k in rng.permutation(len(fresh))[:int(len(fresh) * 0.7)]:
+                self._add(fresh[k])
+        for uid in rng.choice(list(self.elements), size=min(churn, len(self.elements)), replace=False):
+            del self.cells[self.elements.pop(int(uid))["cell"]]
+        free = self._free_cells(range(self.rows))
+        for k in rng.permutation(len(free))[:churn]:
+            self._add(free[k])
+        return moved & set(self.elements)
+
+    def parse(self):
+        rng = self.rng
+        arr = np.full((self.height, self.width, 3), 236, dtype=np.uint8)
+        order = rng.permutation(list(self.elements))
+        parsed, truth = [], []
+        for uid in order:
+            elem = self.elements[int(uid)]
+            bbox = self.bbox(elem)
+            x1, y1, x2, y2 = (int(v * d) for v, d in zip(bbox, (self.width, self.height) * 2))
+            tile = Image.fromarray(elem["texture"]).resize((max(1, x2 - x1), max(1, y2 - y1)), Image.NEAREST)
+            arr[y1:y2, x1:x2] = np.array(tile)[:, :, None]
+            jitter = rng.normal(0, 0.0008, 4)
+            text = elem["text"]
+            if elem["type"] == "icon" and rng.random() < 0.2:
+                text = text + " icon"  # Icon captions are not stable between parses
+            parsed.append({"type": elem["type"], "bbox": [float(v) for v in np.array(bbox) + jitter],
+                           "interactivity": elem["type"] != "text", "content": text})
+            truth.append(int(uid))
+        return parsed, truth, app.ScreenFrame.from_pil(Image.fromarray(arr, "RGB"))
+
+
+def bench_tracking(args):
+    """Stable IDs across re-parses: how often an element keeps its ID vs its OmniParser number"""
+    print(f"Screen {args.width}x{args.height}, {args.turns} turns, {args.churn} elements replaced per turn, "
+          f"scroll every {args.scroll_every} turns\n")
+    print(f"{'elements':>8} {'number kept':>12} {'ID kept':>8} {'false match':>12} {'moved found':>12} "
+          f"{'moved wrong':>12} {'ms/turn':>8}")
+    failed = False
+    for count in args.elements:
+        screen = TrackedScreen(count, args.width, args.height, seed=count)
+        tracker = app.ElementTracker()
+        previous = None
+        kept_number = kept_id = survivors = false_match = new = 0
+        moved_found = moved_true = moved_wrong = 0
+        samples = []
+        for turn in range(args.turns):
+            moved = set()
+            if turn:
+                scroll = args.scroll_rows if args.scroll_every and turn % args.scroll_every == 0 else 0
+                moved = screen.step(args.churn, scroll)
+            parsed, truth, frame = screen.parse()
+            store = app.ElementStore(parsed, frame.width, frame.height)
+            start = time.perf_counter()
+            delta = tracker.update(store, frame)
+            samples.append((time.perf_counter() - start) * 1000)
+            current = {uid: (number, int(store.ids[number])) for number, uid in enumerate(truth)}
+            if previous is not None:
+                old_ids = {element_id for _, element_id in previous.values()}
+                for uid, (number, element_id) in current.items():
+                    if uid in previous:
+                        survivors += 1
+                        kept_number += previous[uid][0] == number
+                        kept_id += previous[uid][1] == element_id
+                    else:
+                        new += 1
+                        false_match += element_id in old_ids
+                reported = set(delta.moved)
+                truly_moved = {current[uid][1] for uid in moved if uid in previous}
+                moved_true += len(truly_moved)
+                moved_found += len(truly_moved & reported)
+                moved_wrong += len(reported - truly_moved)
+            previous = current
+        id_rate = kept_id / max(1, survivors)
+        print(f"{count:>8} {kept_number / max(1, survivors):>12.1%} {id_rate:>8.1%} "
+              f"{false_match / max(1, new):>12.1%} {moved_found / max(1, moved_true):>12.1%} "
+              f"{moved_wrong:>12} {statistics.median(samples):>8.1f}")
+        failed = failed or id_rate < args.min_kept
+    if failed:
+        print(f"\n❌ ID retention below {args.min_kept:.0%}")
+        sys.exit(1)
+
+
+def full_prompt_text(prompt, context, store):
+    """Prompt without PromptContext: the whole element list and every completed step, each turn"""
+    text = f"**AVAILABLE ELEMENTS** ({len(store)}):\n"
+    text += "".join(f"[{n}] #{store.element_id(n)} {store.types[n]} {json.dumps(store.texts[n][:40])}\n"
+                    for n in range(len(store)))
+    text += "\n" + context.get_context_summary() + "\n"
+    return text + f"User request: {prompt}\n\nAnalyze the numbered screenshot and provide the next step(s) as JSON.\n"
+
+
+def bench_prompt(args):
+    """Planner prompt tokens over a long synthetic task: full list + every step vs PromptContext"""
+    app.tracer.enabled = False
+    planner = app.PlannerClient(api_key="offline", model=ScriptedPlannerModel())
+    screen = TrackedScreen(args.elements, args.width, args.height, seed=1)
+    tracker = app.ElementTracker()
+    context = app.TaskContext()
+    context.original_task = task = "find the quarterly report in the shared drive and email it to the finance team"
+    context.prompt.budget = args.budget
+    rng = np.random.default_rng(1)
+    rows, build_ms, estimate_error = [], [], []
+    print(f"{args.turns} turns, {args.elements} elements, {args.churn} replaced per turn, "
+          f"scroll every {args.scroll_every} turns, budget {args.budget} tokens\n")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for turn in range(1, args.turns + 1):
+            if turn > 1:
+                screen.step(args.churn, 2 if args.scroll_every and turn % args.scroll_every == 0 else 0)
+            parsed, _, frame = screen.parse()
+            store = app.ElementStore(parsed, frame.width, frame.height)
+            delta = tracker.update(store, frame)
+            start = time.perf_counter()
+            text = planner.build_prompt(task, context, store, delta)
+            build_ms.append((time.perf_counter() - start) * 1000)
+            planner.count_prompt_tokens(text, context.prompt.last_kind)
+            measured = count_text_tokens(text)
+            if planner.tokens.stats["measured"]:
+                estimate_error.append(context.prompt.last_tokens / measured - 1)
+            rows.append((turn, count_text_tokens(full_prompt_text(task, context, store)), measured,
+                         context.prompt.last_full))
+
+            # The "model" clicks an element, sometimes types into it, then asks for the next screen
+            number = int(rng.integers(len(store)))
+            step = {"type": "click", "element_number": number, "description": f"Open {store.texts[number][:30]}"}
+            context.add_step_completed(dict(step, element_id=store.element_id(number), element_text=store.texts[number][:40]))
+            if rng.random() < 0.3:
+                context.add_step_completed({"type": "keyboard", "content": "quarterly report", "element_number": number,
+                                            "description": "Type the search query", "element_id": store.element_id(number),
+                                            "element_text": store.texts[number][:40]})
+            context.add_step_completed({"type": "wait_and_send_image", "description": "Wait for the page"})
+            if turn % 50 == 0:
+                context.add_user_message("use the newest version of the report")
+
+    print(f"{'turn':>6} {'full list + all steps':>22} {'PromptContext':>14}")
+    checkpoints = sorted({1, 2, 5, 10, 25, 50, 100, 200, 500, args.turns} & set(range(1, args.turns + 1)))
+    for turn, full, delta_tokens, was_full in rows:
+        if turn in checkpoints:
+            print(f"{turn:>6} {full:>22} {delta_tokens:>14}{'  (full details)' if was_full else ''}")
+
+    # Full-detail and compact turns differ in size, so each kind is compared with itself
+    growing = []
+    for kind in (True, False):
+        half = [tokens for turn, _, tokens, was_full in rows if was_full == kind and turn > args.turns // 2]
+        quarter = [tokens for turn, _, tokens, was_full in rows
+                   if was_full == kind and args.turns // 4 < turn <= args.turns // 2]
+        if half and quarter and statistics.mean(half) > statistics.mean(quarter) * 1.1:
+            growing.append("full-detail" if kind else "compact")
+    slope = np.polyfit([r[0] for r in rows if r[0] > args.turns // 4], [r[2] for r in rows if r[0] > args.turns // 4], 1)[0]
+    peak = max(r[2] for r in rows)
+    print(f"\nPromptContext: p50 {statistics.median(r[2] for r in rows):.0f} tokens, max {peak}, "
+          f"trend {slope:+.2f} tokens/turn after turn {args.turns // 4}; "
+          f"full list + all steps grows {np.polyfit([r[0] for r in rows], [r[1] for r in rows], 1)[0]:+.1f} tokens/turn")
+    print(f"build p50 {statistics.median(build_ms):.2f}ms, token estimate error p50 "
+          f"{statistics.median(estimate_error) * 100:+.1f}% after calibration ({planner.tokens.stats['measured']} measurements)")
+    if peak > args.budget * 1.1 or growing:
+        print(f"❌ Prompt size is not flat within the budget{' (' + ', '.join(growing) + ' turns grow)' if growing else ''}")
+        sys.exit(1)
+
+
+def load_agent_script(directory):
+    """Raw model responses (gemini_response_*.txt) in the order they were written"""
+    paths = sorted(glob.glob(os.path.join(directory, "gemini_response_*.txt")))
+    if not paths:
+        raise SystemExit(f"No gemini_response_*.txt files in {directory}")
+    responses = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            responses.append(f.read())
+    return responses
+
+
+def rss_mb():
+    """Current resident set size (Linux), in MiB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return float("nan")
+
+
+def bench_agent(args):
+    """Run whole tasks through VirtualAssistant headlessly: fake screen, OmniParser stub, scripted LLM"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5 import QtCore, QtWidgets
+    import resource
+
+    app.VOICE_ENABLED = False
+    if args.frames:
+        paths = sorted(glob.glob(os.path.join(args.frames, "*.png")))
+        frames = [app.ScreenFrame.from_pil(Image.open(p).convert("RGB")) for p in paths]
+    else:
+        frames = [app.ScreenFrame.from_pil(synthetic_screen(args.width, args.height, seed=i)) for i in range(6)]
+    responses = load_agent_script(args.responses) if args.responses else [
+        json.dumps(turn) for turn in AGENT_SCRIPT]
+
+    qapp = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    server = StubProcess(latency_ms=args.parse_ms, elements=args.elements)
+    tmpdir = tempfile.mkdtemp(prefix="va_agent_")
+    cwd = os.getcwd()
+    os.chdir(tmpdir)  # The assistant writes gemini_prompt_*/gemini_response_* files
+    app.tracer.enabled = True  # The stage table below is built from the traces
+    app.tracer.trace_dir = os.path.join(tmpdir, "traces")
+
+    screen = FakeScreen(frames)
+    model = ScriptedPlannerModel(responses, latency_ms=args.gemini_ms)
+    planner = app.PlannerClient(api_key="offline", model=model)
+    client = app.OmniParserClient(server.url)
+    backend = app.NullInputBackend(on_action=screen.advance)
+    finished = []
+
+    class HeadlessAssistant(app.VirtualAssistant):
+        def show_message(self, title, text, warning=False):
+            finished.append((title, text, time.perf_counter()))
+            QtCore.QTimer.singleShot(0, next_task)
+
+    assistant = HeadlessAssistant(capture=screen, planner=planner, omniparser=client, input_backend=backend)
+    rss_start = rss_mb()
+    state = {"tasks": 0, "start": time.perf_counter(), "rss": [rss_start]}
+
+    def next_task():
+        state["rss"].append(rss_mb())
+        if state["tasks"] >= args.tasks:
+            qapp.quit()
+            return
+        state["tasks"] += 1
+        if assistant.context.original_task:
+            assistant.on_abort()  # An error left the previous task open
+        assistant.input.setDisabled(False)
+        assistant.input.setText(f"task {state['tasks']}: play lata mangeshkar songs")
+        assistant.on_enter()
+
+    QtCore.QTimer.singleShot(0, next_task)
+    QtCore.QTimer.singleShot(int(args.timeout * 1000), qapp.quit)
+    qapp.exec_()
+    elapsed = time.perf_counter() - state["start"]
+
+    assistant.engine_loop.stop()
+    assistant.engine.close()
+    assistant.pipeline.close()
+    client.close()
+    server.stop()
+    os.chdir(cwd)
+
+    completed = sum(1 for title, _, _ in finished if title == "Task Complete")
+    turns = planner.call_count
+    print(f"\nScreen {frames[0].width}x{frames[0].height}, OmniParser {args.parse_ms:.0f}ms, "
+          f"Gemini {args.gemini_ms:.0f}ms, {len(responses)} scripted responses")
+    print(f"Tasks completed {completed}/{args.tasks} ({len(finished) - completed} errors) in {elapsed:.1f}s")
+    print(f"Turns {turns}, {turns / elapsed * 60:.1f} turns/min, {len(backend.actions)} input actions")
+    print(f"Memory: RSS start {rss_start:.0f} MiB, end {state['rss'][-1]:.0f} MiB, "
+          f"peak {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB\n")
+    summarize_traces(sorted(glob.glob(os.path.join(app.tracer.trace_dir, "trace_*.json"))))
+    if completed < args.tasks:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("capture", help="screenshot polling latency, disk vs in-memory")
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--iterations", type=int, default=20)
+    p.add_argument("--live", action="store_true", help="grab the real screen with mss instead of a synthetic frame")
+    p.set_defaults(func=bench_capture)
+
+    p = sub.add_parser("change", help="screen-change detection cost, compare_screenshots vs ChangeDetector")
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--iterations", type=int, default=50)
+    p.set_defaults(func=bench_change)
+
+    p = sub.add_parser("gui-latency", help="Qt event-loop latency while monitoring the screen")
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--duration", type=float, default=5.0)
+    p.set_defaults(func=bench_gui_latency)
+
+    p = sub.add_parser("planner", help="planner client overhead against a local stub model")
+    p.add_argument("--calls", type=int, default=20)
+    p.add_argument("--latency-ms", type=float, default=0.0, help="simulated model latency")
+    p.set_defaults(func=bench_planner)
+
+    p = sub.add_parser("omniparser", help="OmniParser client latency, retries and circuit breaker")
+    p.add_argument("--calls", type=int, default=20)
+    p.add_argument("--latency-ms", type=float, default=50.0, help="stub server latency")
+    p.add_argument("--fail-rate", type=float, default=0.2, help="fraction of stub requests that fail")
+    p.add_argument("--url", help="benchmark a real OmniParser endpoint instead of the local stub")
+    p.set_defaults(func=bench_omniparser)
+
+    p = sub.add_parser("annotate", help="per-turn bytes and latency, server vs local annotation")
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--turns", type=int, default=10)
+    p.add_argument("--elements", type=int, default=120)
+    p.add_argument("--latency-ms", type=float, default=0.0, help="stub server latency")
+    p.add_argument("--mbps", type=float, default=20.0, help="link bandwidth used to model transfer time")
+    p.set_defaults(func=bench_annotate)
+
+    p = sub.add_parser("upload", help="Gemini upload size and encode time per downscale/format policy")
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--elements", type=int, default=120)
+    p.add_argument("--quality", type=int, default=app.UPLOAD_QUALITY)
+    p.add_argument("--crop", action="store_true", help="also measure cropping to the element union")
+    p.add_argument("--mbps", type=float, default=20.0, help="link bandwidth used to model upload time")
+    p.set_defaults(func=bench_upload)
+
+    p = sub.add_parser("pipeline", help="per-turn wall clock, sequential vs overlapped stages")
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--turns", type=int, default=5)
+    p.add_argument("--elements", type=int, default=120)
+    p.add_argument("--parse-ms", type=float, default=800.0, help="stub OmniParser latency")
+    p.add_argument("--gemini-ms", type=float, default=1500.0, help="scripted Gemini latency")
+    p.add_argument("--mbps", type=float, default=20.0, help="modelled upload bandwidth to OmniParser")
+    p.add_argument("--trace-dir", help="also write one Chrome trace per configuration here")
+    p.add_argument("--wait-ms", type=float, default=1000.0,
+                   help="time between the screen settling and the turn starting (not counted in wall)")
+    p.set_defaults(func=bench_pipeline)
+
+    p = sub.add_parser("settle", help="replay frame sequences through the settle detector (exit 1 on failure)")
+    p.add_argument("--frames", nargs="*", help="directories recorded with record-frames (default: synthetic scenarios)")
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--max-lag-ms", type=float, default=600.0, help="allowed delay between the last change and settle")
+    p.set_defaults(func=bench_settle)
+
+    p = sub.add_parser("record-frames", help="record a live frame sequence for settle --frames")
+    p.add_argument("--out", required=True)
+    p.add_argument("--duration", type=float, default=5.0)
+    p.add_argument("--interval-ms", type=float, default=40.0)
+    p.set_defaults(func=bench_record_frames)
+
+    p = sub.add_parser("engine", help="ActionEngine step throughput, one vs several engines per event loop")
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--engines", type=int, default=4)
+    p.add_argument("--batches", type=int, default=3)
+    p.add_argument("--errors", type=int, default=0, help="failing steps added to each batch")
+    p.add_argument("--error-pause-ms", type=float, default=app.STEP_ERROR_PAUSE_MS)
+    p.set_defaults(func=bench_engine)
+
+    p = sub.add_parser("daemon", help="tasks through the daemon API, 1 vs N concurrent displays (exit 1 on failure)")
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--tasks", type=int, default=4)
+    p.add_argument("--concurrency", type=int, default=2)
+    p.add_argument("--elements", type=int, default=40)
+    p.add_argument("--parse-ms", type=float, default=300.0, help="stub OmniParser latency")
+    p.add_argument("--gemini-ms", type=float, default=800.0, help="scripted Gemini latency")
+    p.set_defaults(func=bench_daemon)
+
+    p = sub.add_parser("sessions", help="throughput vs number of sessions sharing one OmniParser client and planner")
+    p.add_argument("--width", type=int, default=960)
+    p.add_argument("--height", type=int, default=540)
+    p.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--tasks-per-session", type=int, default=2)
+    p.add_argument("--elements", type=int, default=40)
+    p.add_argument("--inflight", type=int, default=app.SHARED_OMNIPARSER_MAX_INFLIGHT,
+                   help="shared requests in flight per service")
+    p.add_argument("--omniparser-rpm", type=float, default=0, help="per-session OmniParser rate limit")
+    p.add_argument("--planner-rpm", type=float, default=0, help="per-session planner rate limit")
+    p.add_argument("--parse-ms", type=float, default=300.0, help="stub OmniParser latency")
+    p.add_argument("--gemini-ms", type=float, default=800.0, help="scripted Gemini latency")
+    p.set_defaults(func=bench_sessions)
+
+    p = sub.add_parser("startup", help="time to the input window and import cost (exit 1 on regression)")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--top", type=int, default=10, help="slowest direct imports to list")
+    p.add_argument("--budget-ms", type=float, default=0, help="fail if the window takes longer (0 = no budget)")
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("wake-word", help="local wake-word hits, false wakes, latency and CPU on WAV fixtures")
+    p.add_argument("--fixtures", help="directory with templates/*.wav, stream.wav and labels.json "
+                                      "(synthesized there if missing)")
+    p.add_argument("--threshold", type=float, help="detection threshold (default WAKE_WORD_THRESHOLD)")
+    p.add_argument("--snr-db", type=float, default=20, help="background noise of synthesized fixtures")
+    p.add_argument("--min-recall", type=float, default=0.9)
+    p.add_argument("--max-false-wakes", type=int, default=0)
+    p.set_defaults(func=bench_wake_word)
+
+    p = sub.add_parser("voice", help="wake word + command through the voice thread with a fake microphone "
+                                     "(exit 1 if a command is lost)")
+    p.add_argument("--fixtures", help="directory with templates/*.wav, commands.wav and commands.json "
+                                      "(synthesized there if missing)")
+    p.add_argument("--commands", type=int, default=9, help="commands in synthesized fixtures")
+    p.add_argument("--realtime", action="store_true", help="play the WAV at real-time speed")
+    p.set_defaults(func=bench_voice)
+
+    p = sub.add_parser("voice-task", help="spoken command to planner request, fixed delay vs parse on wake word")
+    p.add_argument("--tasks", type=int, default=3)
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.add_argument("--elements", type=int, default=60)
+    p.add_argument("--parse-ms", type=float, default=800)
+    p.add_argument("--gemini-ms", type=float, default=0)
+    p.add_argument("--speech-ms", type=float, default=2500, help="wake word to recognized text")
+    p.add_argument("--timeout", type=float, default=60)
+    p.set_defaults(func=bench_voice_task)
+
+    p = sub.add_parser("elements", help="ElementStore lookups vs scanning the raw element list")
+    p.add_argument("--elements", type=int, nargs="+", default=[50, 200, 1000])
+    p.add_argument("--width", type=int, default=3840)
+    p.add_argument("--height", type=int, default=2160)
+    p.add_argument("--queries", type=int, default=2000)
+    p.set_defaults(func=bench_elements)
+
+    p = sub.add_parser("tracking", help="stable element IDs across re-parses (exit 1 if too few survive)")
+    p.add_argument("--elements", type=int, nargs="+", default=[40, 150, 500])
+    p.add_argument("--turns", type=int, default=20)
+    p.add_argument("--churn", type=int, default=3)
+    p.add_argument("--scroll-every", type=int, default=4)
+    p.add_argument("--scroll-rows", type=int, default=2)
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.add_argument("--min-kept", type=float, default=0.95)
+    p.set_defaults(func=bench_tracking)
+
+    p = sub.add_parser("prompt", help="planner prompt tokens over a long synthetic task (exit 1 unless flat)")
+    p.add_argument("--turns", type=int, default=200)
+    p.add_argument("--elements", type=int, default=150)
+    p.add_argument("--churn", type=int, default=3)
+    p.add_argument("--scroll-every", type=int, default=4)
+    p.add_argument("--budget", type=int, default=app.PROMPT_TOKEN_BUDGET)
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.set_defaults(func=bench_prompt)
+
+    p = sub.add_parser("agent", help="headless end-to-end run of VirtualAssistant (exit 1 unless all tasks complete)")
+    p.add_argument("--tasks", type=int, default=3)
+    p.add_argument("--frames", help="directory of recorded PNG frames (default: synthetic)")
+    p.add_argument("--responses", help="directory of gemini_response_*.txt to replay (default: built-in script)")
+    p.add_argument("--width", type=int, default=1920)
+    p.add_argument("--height", type=int, default=1080)
+    p.add_argument("--elements", type=int, default=40)
+    p.add_argument("--parse-ms", type=float, default=300.0, help="stub OmniParser latency")
+    p.add_argument("--gemini-ms", type=float, default=800.0, help="scripted Gemini latency")
+    p.add_argument("--timeout", type=float, default=300.0, help="give up after this many seconds")
+    p.set_defaults(func=bench_agent)
+
+    p = sub.add_parser("trace-summary", help="p50/p95 per stage across trace files")
+    p.add_argument("paths", nargs="*", help=f"trace files or globs (default: {app.TRACE_DIR}/trace_*.json)")
+    p.set_defaults(func=bench_trace_summary)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Local stand-in for the OmniParser server, for offline testing and benchmarks.
+
+Accepts the same multipart POST /process request as the real server and returns
+canned `parsed_content` plus the uploaded image as `image_base64` (omitted when the
+request sets `return_image=false`).
+
+Usage:
+python omniparser_stub.py [--port 8765] [--latency-ms 800] [--jitter-ms 200] [--fail-rate 0.1] [--elements 40] [--mbps 20]
+Then point OMNIPARSER_URL at http://127.0.0.1:8765/process
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def canned_elements(count, seed=0):
+    """A grid of fake UI elements with normalized bboxes, like OmniParser returns"""
+    rng = random.Random(seed)
+    kinds = ["icon", "text", "button", "input"]
+    cols = max(1, int(count ** 0.5))
+    elements = []
+    for i in range(count):
+        row, col = divmod(i, cols)
+        x1 = 0.02 + col * (0.96 / cols)
+        y1 = 0.05 + row * (0.9 / max(1, (count + cols - 1) // cols))
+        elements.append({
+            "type": kinds[i % len(kinds)],
+            "bbox": [round(x1, 4), round(y1, 4), round(x1 + 0.6 / cols, 4), round(y1 + 0.03, 4)],
+            "interactivity": i % 2 == 0,
+            "content": f"Element {i} ({rng.choice(['Search', 'Chrome', 'Login', 'Settings', 'File', 'Edit'])})",
+        })
+    return elements
+
+
+def parse_multipart(content_type, body):
+    """Return {field name: bytes} for a multipart/form-data body"""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name:
+            fields[name] = part.get_payload(decode=True) or b""
+    return fields
+
+
+class OmniParserStubHandler(BaseHTTPRequestHandler):
+    server_version = "OmniParserStub/1.0"
+    protocol_version = "HTTP/1.1"  # Keep-alive, so client connection pooling is measurable
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        """Request body, with or without chunked transfer encoding (streamed uploads)"""
+        if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._throttle(len(body))
+            return body
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+            if size == 0:
+                while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+            self._throttle(size)
+
+    def _throttle(self, nbytes):
+        """Model a slower uplink: hold the request as long as the bytes would take to arrive"""
+        if self.server.mbps:
+            time.sleep(nbytes * 8 / (self.server.mbps * 1e6))
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._send_json(200, {"status": "ok", "requests": self.server.request_count})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self.path.startswith("/process"):
+            self._send_json(404, {"error": "not found"})
+            return
+        body = self._read_body()
+        length = len(body)
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            server.bytes_received += length
+
+        delay = server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+        if random.random() < server.fail_rate:
+            self._send_json(503, {"error": "stub failure"})
+            return
+
+        try:
+            fields = parse_multipart(self.headers.get("Content-Type", ""), body)
+        except Exception as e:
+            self._send_json(400, {"error": f"bad multipart body: {e}"})
+            return
+        image = fields.get("image")
+        if not image:
+            self._send_json(400, {"error": "missing image"})
+            return
+
+        payload = {"parsed_content": server.elements}
+        if fields.get("return_image", b"true").lower() not in (b"false", b"0"):
+            payload["image_base64"] = base64.b64encode(image).decode("ascii")
+        self._send_json(200, payload)
+
+
+class OmniParserStubServer(ThreadingHTTPServer):
+    """In-process stub server; use start()/stop() or run it as a script"""
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0.0, jitter_ms=0.0,
+                 fail_rate=0.0, elements=40, verbose=False, mbps=0.0):
+        super().__init__((host, port), OmniParserStubHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+        self.elements = canned_elements(elements) if isinstance(elements, int) else elements
+        self.verbose = verbose
+        self.mbps = mbps
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.bytes_received = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/process"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--elements", type=int, default=40)
+    parser.add_argument("--mbps", type=float, default=0.0, help="modelled upload bandwidth (0 = unlimited)")
+    parser.add_argument("--quiet", action="store_true", help="do not log requests")
+    args = parser.parse_args()
+
+    server = OmniParserStubServer(args.host, args.port, args.latency_ms, args.jitter_ms,
+                                  args.fail_rate, args.elements, verbose=not args.quiet, mbps=args.mbps)
+    print(f"OmniParser stub listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()